@@ -0,0 +1,80 @@
+"""
+Micro-benchmark: Grad-CAM with and without the second feature-extractor pass.
+
+The legacy path (forward + backward + `get_activations`) runs the convolutional feature extractor twice per
+image; `gradcam.gradcam_core` reuses the activations captured in `forward`. Models use random weights, so no
+weight files are needed.
+
+Usage:
+    python benchmarks/gradcam_forward_pass.py [--batch-size 8] [--repeats 20]
+"""
+import argparse
+import time
+
+import torch
+
+from visual_ccc.gradcam import AlexnetHook, custom_alexnet, gradcam_core, SIZE_REQUIREMENT
+from visual_ccc.visualcnn_model import VisualCNN
+
+
+# Legacy Grad-CAM: recomputes the activations with a second pass through the feature extractor
+def legacy_gradcam(img_model, model):
+    logits = model(img_model)
+    if logits.shape[1] == 1:
+        targets = torch.where(logits[:, 0] > 0, logits[:, 0], -logits[:, 0])
+    else:
+        targets = logits.gather(1, logits.argmax(dim=1, keepdim=True)).squeeze(1)
+    targets.sum().backward()
+
+    average_gradients = torch.mean(model.get_grads(), dim=[2, 3])
+    activations = model.get_activations(img_model).detach()
+    for i in range(activations.shape[1]):
+        activations[:, i, :, :] *= average_gradients[:, i].view(-1, 1, 1)
+    cam = torch.mean(activations, dim=1)
+
+    model.zero_grad(set_to_none=True)
+    return cam
+
+
+# Count the calls to the feature extractor and time one Grad-CAM function
+def measure(function, model, extractor, img_model, repeats: int):
+    calls = [0]
+    handle = extractor.register_forward_hook(lambda *_: calls.__setitem__(0, calls[0] + 1))
+
+    function(img_model, model)  # warm-up
+    calls[0] = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cam = function(img_model, model)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    handle.remove()
+    return cam, elapsed, calls[0] / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    img_model = torch.rand(args.batch_size, 1, SIZE_REQUIREMENT, SIZE_REQUIREMENT)
+
+    visualcnn = VisualCNN("3-class").eval()
+    alexnet = AlexnetHook(custom_alexnet("3-class")).eval()
+
+    print(f"Batch size {args.batch_size}, {args.repeats} repeats, {torch.get_num_threads()} threads\n")
+    print(f"{'model':<12}{'path':<10}{'extractor passes':>18}{'ms / batch':>14}")
+    for name, model, extractor in [("VisualCNN", visualcnn, visualcnn.features), ("AlexNet", alexnet, alexnet.cnn)]:
+        cam_legacy, t_legacy, passes_legacy = measure(legacy_gradcam, model, extractor, img_model, args.repeats)
+        cam_core, t_core, passes_core = measure(lambda x, m: gradcam_core(x, m)[0], model, extractor, img_model, args.repeats)
+
+        print(f"{name:<12}{'legacy':<10}{passes_legacy:>18.0f}{1000 * t_legacy:>14.2f}")
+        print(f"{name:<12}{'core':<10}{passes_core:>18.0f}{1000 * t_core:>14.2f}")
+        max_error = (cam_legacy - cam_core).abs().max().item()
+        print(f"{'':<12}speed-up {t_legacy / t_core:.2f}x, max |difference| {max_error:.2e}\n")
+
+
+if __name__ == "__main__":
+    main()
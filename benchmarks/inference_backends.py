@@ -0,0 +1,93 @@
+"""
+Benchmark: classification throughput and accuracy parity of the inference backends.
+
+Every backend of `visual_ccc.backends` is built from the eager model and run on the images of a dataset
+folder (one sub-folder per class, e.g. `two_classes` or `three_classes`). Reports images/s, agreement with
+the eager predictions, the largest logit difference and, when the folder names match the class map, accuracy.
+
+Usage:
+    python benchmarks/inference_backends.py [--dataset three_classes] [--model visualcnn] [--max-images 512]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+from visual_ccc import backends, gradcam
+
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+# Load up to `max_images` model inputs and their folder labels
+def load_dataset(dataset_dir: Path, max_images: int):
+    transform_model, _ = gradcam.get_transforms()
+    paths = sorted(path for path in dataset_dir.rglob("*") if path.suffix.lower() in gradcam.valid_extensions)
+    # Spread the selection over all classes
+    step = max(1, len(paths) // max_images)
+    paths = paths[::step][:max_images]
+    if not paths:
+        raise IOError(f"No images found in '{dataset_dir}'.")
+
+    inputs = []
+    for path in paths:
+        with Image.open(path) as img:
+            inputs.append(transform_model(img))
+    labels = [path.parent.name for path in paths]
+    return torch.stack(inputs), labels
+
+
+# Time the model over the batches, returning images/s and the predicted class indices
+def measure(model, batches: list[torch.Tensor], device, repeats: int):
+    with torch.inference_mode():
+        model(batches[0].to(device))  # warm-up (and compilation)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            predictions = [gradcam._predict_classes(model(batch.to(device))).cpu() for batch in batches]
+        elapsed = time.perf_counter() - start
+    n_images = sum(batch.shape[0] for batch in batches) * repeats
+    return n_images / elapsed, torch.cat(predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", type=Path, default=ROOT / "three_classes", help="Dataset folder (class sub-folders).")
+    parser.add_argument("--classes", choices=["2-class", "3-class"], default=None, help="Default: from the dataset name.")
+    parser.add_argument("--model", choices=["alexnet", "visualcnn"], default="visualcnn")
+    parser.add_argument("--backends", nargs="+", choices=backends.BACKENDS, default=backends.BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-images", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    classes = args.classes or ("2-class" if "two" in args.dataset.name else "3-class")
+    inputs, labels = load_dataset(args.dataset, args.max_images)
+    batches = list(inputs.split(args.batch_size))
+
+    model, class_map = gradcam.create_model(classes=classes, model_type=args.model)
+    model.eval()
+    label_indices = None
+    if isinstance(class_map, dict) and all(label in class_map for label in labels):
+        label_indices = torch.tensor([class_map[label] for label in labels])
+
+    print(f"{args.model} ({classes}) on {len(labels)} images of '{args.dataset.name}', "
+          f"batch size {args.batch_size}, {torch.get_num_threads()} threads\n")
+    print(f"{'backend':<14}{'images/s':>10}{'agreement':>12}{'max |diff|':>12}{'accuracy':>10}")
+
+    for backend in args.backends:
+        try:
+            backend_model = backends.build_backend(model, backend, calibration_batches=batches[:backends.CALIBRATION_BATCHES])
+        except (ImportError, RuntimeError) as e:
+            print(f"{backend:<14}skipped: {e}")
+            continue
+
+        throughput, predictions = measure(backend_model, batches, gradcam._model_device(backend_model), args.repeats)
+        parity = backends.check_parity(model, backend_model, batches)
+        accuracy = f"{(predictions == label_indices).float().mean().item():.3f}" if label_indices is not None else "-"
+        print(f"{backend:<14}{throughput:>10.1f}{parity['agreement']:>12.3f}{parity['max_abs_diff']:>12.2e}{accuracy:>10}")
+
+
+if __name__ == "__main__":
+    main()
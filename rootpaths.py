@@ -15,6 +15,7 @@ PM.metrics = PM.results / "metrics"
 
 PM.sam_inputs = PM.ROOT / "sam_inputs"
 PM.sam_outputs = PM.ROOT / "sam_outputs"
+PM.sam_cache = PM.sam_outputs / "embedding_cache"
 PM.sam_artifacts = PM.ROOT / "visual_ccc" / "resources"
 
 PM.sam_weights_file = PM.sam_artifacts / "sam2_1_hiera_large.pth"
@@ -1,16 +1,29 @@
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
 from PIL import Image
-import cv2
 from pathlib import Path
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from hydra import initialize_config_dir
 from hydra.core.global_hydra import GlobalHydra
 from sam2.build_sam import build_sam2
 from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
 from ml_tools.path_manager import list_files_by_extension
+from typing import Callable, Optional
 
 from rootpaths import PM
+from visual_ccc.sam_cache import SAMEmbeddingCache, model_cache_key
+from visual_ccc.sam_masks import mask_shape, render_mask_layer, export_annotations
+from visual_ccc.image_source import read_rgb
+from visual_ccc.sam_manifest import SAMManifest, params_key
+from visual_ccc.sam_tiles import generate_tiled
 
 
 ##############################
@@ -35,6 +48,31 @@ MASK_GENERATOR_PARAMS = {
     "use_m2m": True
 }
 
+# persistent image-embedding cache (re-tuning MASK_GENERATOR_PARAMS then only runs the mask decoder)
+USE_EMBEDDING_CACHE = True
+EMBEDDING_CACHE_MAX_GB = 10
+
+# keep masks as RLE (decoded lazily when rendered) and export a per-image annotation file
+COMPACT_MASKS = True
+SAVE_ANNOTATIONS = True
+
+# pipeline: reader threads decode upcoming images, writer threads render and encode finished ones
+PIPELINE_READERS = 2
+PIPELINE_WRITERS = 2
+PIPELINE_QUEUE_SIZE = 4   # max images waiting on each side of the model (backpressure)
+
+# tiled mode: images with a side above TILED_MIN_SIDE are segmented in overlapping tiles (None disables)
+TILED_MIN_SIDE = 2048
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+TILE_MERGE_IOU = 0.5
+
+# sharded mode (CPU-only nodes): worker processes, each with its own model and pinned cores
+MAX_SHARD_RETRIES = 2
+
+# processing manifest (one JSON line per processed image) used to skip up-to-date outputs on re-runs
+MANIFEST_FILE = "sam_manifest.jsonl"
+
 # define valid extensions
 VALID_IMG_EXTENSIONS = ['jpg', 'jpeg', 'png', 'bmp', 'tif', 'tiff', 'ppm', 'pgm', 'pbm', 'pfm']
 
@@ -72,30 +110,53 @@ def build_sam_model(device, postprocessing: bool=True):
     return sam_model
 
 
-def get_generator(sam_model, device):
-    """ Returns a SAM2 mask generator instance."""
-    # mask generator
+def generator_params(device) -> dict:
+    """ Mask generator parameters used on `device` (the CPU generator runs with SAM2 defaults)."""
     if device.type == "cpu":
-        mask_generator = SAM2AutomaticMaskGenerator(model=sam_model)
-    else:
-        mask_generator = SAM2AutomaticMaskGenerator(
-            model=sam_model,
-            **MASK_GENERATOR_PARAMS
-        )
+        return dict()
+    return dict(MASK_GENERATOR_PARAMS)
+
+
+def get_generator(sam_model, device, cache: Optional[SAMEmbeddingCache]=None, compact_masks: bool=COMPACT_MASKS):
+    """ 
+    Returns a SAM2 mask generator instance. Image embeddings are reused from `cache` if given.
+    With `compact_masks`, annotation masks are returned as uncompressed RLE instead of full boolean arrays.
+    """
+    output_mode = "uncompressed_rle" if compact_masks else "binary_mask"
+    # mask generator
+    mask_generator = SAM2AutomaticMaskGenerator(
+        model=sam_model,
+        output_mode=output_mode,
+        **generator_params(device)
+    )
+    if cache is not None:
+        cache.attach(mask_generator.predictor)
     return mask_generator
 
 
+def get_embedding_cache():
+    """ Returns the on-disk embedding cache under the outputs directory, or None if disabled."""
+    if not USE_EMBEDDING_CACHE:
+        return None
+    return SAMEmbeddingCache(cache_dir=PM.sam_cache,
+                             model_key=model_cache_key(CONFIG_NAME, PM.sam_weights_file),
+                             max_bytes=int(EMBEDDING_CACHE_MAX_GB * 1024**3))
+
+
 # transform single image
 def transform_image(path: Path):
     """  
     Opens an image from path and transforms it to numpy array be used in the pipeline.
     """
-    image = Image.open(path)
-    return np.array(image.convert("RGB"))
+    return read_rgb(path)
 
 
 # Long process
 def generate_mask(mask_generator: SAM2AutomaticMaskGenerator, image: np.ndarray):
+    # Large images: per-tile generation at native resolution, masks merged across seams
+    if TILED_MIN_SIDE is not None and max(image.shape[:2]) > TILED_MIN_SIDE:
+        return generate_tiled(mask_generator, image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, iou_thresh=TILE_MERGE_IOU)
+    
     mask_annotations = mask_generator.generate(image)
     
     return mask_annotations
@@ -136,7 +197,7 @@ def render_segmentation(anns: list[dict], original_image: np.ndarray, borders=Fa
     if 'segmentation' not in sorted_anns[0]:
         return base_pil
 
-    h, w = sorted_anns[0]['segmentation'].shape
+    h, w = mask_shape(sorted_anns[0])
     
     # Check dimensions match
     if base_pil.size != (w, h):
@@ -145,38 +206,10 @@ def render_segmentation(anns: list[dict], original_image: np.ndarray, borders=Fa
          raise ValueError(f"Image shape {base_pil.size} does not match mask shape {(w, h)}")
 
     # 2. Generate Mask Layer
-    # Initialize transparent layer
-    mask_layer = np.zeros((h, w, 4), dtype=np.float32)
-    
-    cmap = plt.get_cmap(cmap_name)
-    num_colors = cmap.N
-
-    for i, ann in enumerate(sorted_anns):
-        m = ann['segmentation']
-        
-        color = list(cmap(i % num_colors)) 
-        color[3] = alpha 
-        
-        mask_layer[m] = color 
-        
-        if borders:
-            contours, _ = cv2.findContours(m.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            if contours:
-                contours = [
-                    cv2.approxPolyDP(contour, epsilon=0.001 * cv2.arcLength(contour, True), closed=True) 
-                    for contour in contours
-                ]
-                
-                border_alpha = min(1.0, alpha + 0.4)
-                b_r, b_g, b_b = border_color[:3]
-                final_border_color = (b_r, b_g, b_b, border_alpha)
-
-                cv2.drawContours(mask_layer, contours, -1, final_border_color, thickness=1) 
+    # One int32 label image (last writer wins) and a single uint8 palette lookup
+    mask_uint8 = render_mask_layer(sorted_anns, (h, w), borders=borders, cmap_name=cmap_name, alpha=alpha, border_color=border_color)
 
     # 3. Composite using Pillow
-    # Convert mask layer from float32 (0-1) to uint8 (0-255)
-    mask_uint8 = (mask_layer * 255).astype(np.uint8)
     mask_pil = Image.fromarray(mask_uint8, mode="RGBA")
 
     # Alpha composite puts the mask_pil 'over' the base_pil
@@ -200,6 +233,18 @@ def save_output_img(image: Image.Image, filename: str):
     image.save(save_path, format="PNG")
 
 
+def save_annotations(anns: list[dict], image_name: str):
+    """
+    Saves the SAM annotations of an image (RLE masks and scores) as JSON in the outputs path.
+
+    Args:
+        anns (list): List of annotation dicts from SAM.
+        image_name (str): The base filename.
+    """
+    save_path = PM.sam_outputs / f"sam_{image_name}.json"
+    export_annotations(anns, save_path=save_path, image_name=image_name)
+
+
 def check_input_images():
     images_dict: dict[str, Path] = dict()
     
@@ -217,49 +262,364 @@ def check_input_images():
     return images_dict
 
 
-def main():
-    # images
-    images_dict = check_input_images()
-    # device
-    device, dtype = get_device()
-    # get model
-    sam_model = build_sam_model(device=device, postprocessing=True)
-    # generator
-    mask_generator = get_generator(sam_model, device)
-    
+class StageTimings:
+    """Thread-safe accumulated busy time per pipeline stage."""
+    def __init__(self):
+        self.totals: dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+
+    def report(self, n_images: int, wall_time: float):
+        print(f"\nStage timings ({wall_time:.1f} s wall time):")
+        for stage, total in self.totals.items():
+            print(f"    {stage:<12} {total:8.1f} s total, {total / max(n_images, 1):6.2f} s/image")
+
+
+def run_pipeline(images_dict: dict[str, Path], mask_generator: SAM2AutomaticMaskGenerator, device, dtype,
+                 on_result: Optional[Callable[[dict], None]]=None):
+    """
+    Runs decode -> generate -> render/save as a pipeline and returns the number of saved images.
+
+    A reader pool decodes up to PIPELINE_QUEUE_SIZE images ahead of the model, and writer threads render and
+    encode finished results from a bounded queue, so the model thread (this one) only waits when one side
+    falls behind. Per-stage timings are printed at the end.
+
+    If given, `on_result` is called once per image (from any pipeline thread) with a record holding its
+    status, output file name or error, and per-stage seconds.
+    """
+    timings = StageTimings()
+    image_names = list(images_dict.keys())
+    write_queue: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    count_lock = threading.Lock()
     count = 0
-    
-    if device.type == "cpu":
-        use_autocast = False
-    else:
-        use_autocast = True
-    
-    # Use inference mode and autocast context
-    with torch.inference_mode(), torch.autocast(device.type, dtype=dtype, enabled=use_autocast):
-        for image_name, image_path in images_dict.items():
+
+    def report(image_name: str, seconds: dict, error: Optional[Exception]=None):
+        if on_result is None:
+            return
+        record = {"image": image_name, "seconds": {stage: round(t, 3) for stage, t in seconds.items()}}
+        if error is None:
+            record.update(status="ok", output=output_name(image_name))
+        else:
+            record.update(status="error", error=str(error))
+        on_result(record)
+
+    def read(image_name: str):
+        start = time.perf_counter()
+        with timings.measure("decode"):
+            image_numpy = transform_image(images_dict[image_name])
+        return image_numpy, time.perf_counter() - start
+
+    def write_worker():
+        nonlocal count
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            image_name, image_numpy, mask_annotations, seconds = item
             try:
-                # transform
-                image_numpy = transform_image(image_path)
-                # generate
-                mask_annotations = generate_mask(mask_generator=mask_generator, image=image_numpy)
                 # render
-                image_rendered = render_segmentation(anns=mask_annotations,
-                                                    original_image=image_numpy,
-                                                    borders=False)
+                start = time.perf_counter()
+                with timings.measure("render"):
+                    image_rendered = render_segmentation(anns=mask_annotations,
+                                                         original_image=image_numpy,
+                                                         borders=False)
+                seconds["render"] = time.perf_counter() - start
                 # save
-                save_output_img(image=image_rendered, filename="sam_" + image_name)
-            
+                start = time.perf_counter()
+                with timings.measure("save"):
+                    save_output_img(image=image_rendered, filename="sam_" + image_name)
+                    if SAVE_ANNOTATIONS:
+                        save_annotations(anns=mask_annotations, image_name=image_name)
+                seconds["save"] = time.perf_counter() - start
             except Exception as e:
                 print(f"❌ Error processing {image_name}: {e}")
-                
+                report(image_name, seconds, error=e)
             else:
-                count += 1
-                if count % 5 == 0:
-                    print(f"    > Processed {count}/{len(images_dict)} images...")
+                report(image_name, seconds)
+                with count_lock:
+                    count += 1
+                    if count % 5 == 0:
+                        print(f"    > Processed {count}/{len(images_dict)} images...")
+
+    writers = [threading.Thread(target=write_worker, daemon=True) for _ in range(PIPELINE_WRITERS)]
+    for writer in writers:
+        writer.start()
+
+    use_autocast = (device.type != "cpu")
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=PIPELINE_READERS) as reader_pool:
+        # Prefetch: keep PIPELINE_QUEUE_SIZE decodes in flight
+        names_iter = iter(image_names)
+        in_flight: deque = deque()
+        for _, name in zip(range(PIPELINE_QUEUE_SIZE), names_iter):
+            in_flight.append((name, reader_pool.submit(read, name)))
+
+        # Use inference mode and autocast context
+        with torch.inference_mode(), torch.autocast(device.type, dtype=dtype, enabled=use_autocast):
+            while in_flight:
+                image_name, future = in_flight.popleft()
+                next_name = next(names_iter, None)
+                if next_name is not None:
+                    in_flight.append((next_name, reader_pool.submit(read, next_name)))
+
+                seconds: dict[str, float] = dict()
+                try:
+                    with timings.measure("wait_input"):
+                        image_numpy, seconds["decode"] = future.result()
+                    # generate
+                    start = time.perf_counter()
+                    with timings.measure("generate"):
+                        mask_annotations = generate_mask(mask_generator=mask_generator, image=image_numpy)
+                    seconds["generate"] = time.perf_counter() - start
+                except Exception as e:
+                    print(f"❌ Error processing {image_name}: {e}")
+                    report(image_name, seconds, error=e)
+                    continue
+
+                # Blocks while the writers are PIPELINE_QUEUE_SIZE images behind
+                with timings.measure("wait_output"):
+                    write_queue.put((image_name, image_numpy, mask_annotations, seconds))
+
+    for _ in writers:
+        write_queue.put(None)
+    for writer in writers:
+        writer.join()
+
+    timings.report(n_images=len(image_names), wall_time=time.perf_counter() - start_time)
+    return count
+
+
+def output_name(image_name: str) -> str:
+    """ File name of the rendered output of an image (as written by `save_output_img`)."""
+    filename = "sam_" + image_name
+    return filename if filename.endswith(".png") else filename + ".png"
+
+
+def process_image(mask_generator: SAM2AutomaticMaskGenerator, image_name: str, image_path: Path) -> dict[str, float]:
+    """Decode, segment, render and save one image (serial). Returns the seconds spent in each stage."""
+    seconds: dict[str, float] = dict()
+    start = time.perf_counter()
+    # transform
+    image_numpy = transform_image(image_path)
+    seconds["decode"] = time.perf_counter() - start
+    # generate
+    mask_annotations = generate_mask(mask_generator=mask_generator, image=image_numpy)
+    seconds["generate"] = time.perf_counter() - start - sum(seconds.values())
+    # render
+    image_rendered = render_segmentation(anns=mask_annotations,
+                                         original_image=image_numpy,
+                                         borders=False)
+    seconds["render"] = time.perf_counter() - start - sum(seconds.values())
+    # save
+    save_output_img(image=image_rendered, filename="sam_" + image_name)
+    if SAVE_ANNOTATIONS:
+        save_annotations(anns=mask_annotations, image_name=image_name)
+    seconds["save"] = time.perf_counter() - start - sum(seconds.values())
+    
+    return seconds
+
+
+def shard_worker(shard_index: int, images: list[tuple[str, Path]], cpu_ids: list[int], result_queue):
+    """
+    Worker process of the sharded runner: pins itself to `cpu_ids`, builds its own CPU model and reports
+    one record per image to `result_queue`, followed by a final "done" message.
+    """
+    # Pin cores and intra-op threads
+    if cpu_ids and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_ids)
+    torch.set_num_threads(max(1, len(cpu_ids)))
+    
+    device = torch.device("cpu")
+    sam_model = build_sam_model(device=device, postprocessing=True)
+    mask_generator = get_generator(sam_model, device, cache=get_embedding_cache())
+    
+    with torch.inference_mode():
+        for image_name, image_path in images:
+            start = time.perf_counter()
+            record = {"image": image_name, "shard": shard_index}
+            try:
+                seconds = process_image(mask_generator, image_name, image_path)
+            except Exception as e:
+                record.update(status="error", error=str(e), seconds={"total": round(time.perf_counter() - start, 3)})
+            else:
+                record.update(status="ok", output=output_name(image_name),
+                              seconds={stage: round(t, 3) for stage, t in seconds.items()})
+            result_queue.put(record)
+    
+    result_queue.put({"shard": shard_index, "done": True})
+
+
+def split_cores(n_workers: int) -> list[list[int]]:
+    """Splits the CPUs available to this process into `n_workers` contiguous groups."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    n_workers = min(n_workers, len(cpus))
+    size, extra = divmod(len(cpus), n_workers)
+    groups = []
+    start = 0
+    for i in range(n_workers):
+        stop = start + size + (1 if i < extra else 0)
+        groups.append(cpus[start:stop])
+        start = stop
+    return groups
+
+
+def run_sharded(images_dict: dict[str, Path], n_workers: int, on_result: Optional[Callable[[dict], None]]=None) -> list[dict]:
+    """
+    Splits the images round-robin across `n_workers` CPU worker processes and merges their records.
+
+    If a worker dies before finishing its shard, the images it has not reported are re-queued as a new shard
+    (up to MAX_SHARD_RETRIES times). Every record is passed to `on_result` as it arrives (in this process),
+    and aggregate throughput is printed at the end.
+    """
+    core_groups = split_cores(n_workers)
+    n_workers = len(core_groups)
+    image_items = list(images_dict.items())
+    
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    # (shard index, images, attempt)
+    pending = deque((i, image_items[i::n_workers], 0) for i in range(n_workers))
+    running: dict[int, dict] = dict()   # shard index -> process, cores, remaining names, images, attempt
+    free_cores = list(core_groups)
+    records: dict[str, dict] = dict()
+    next_shard = n_workers
+    
+    print(f"Running {n_workers} CPU workers with {[len(group) for group in core_groups]} cores each.")
+    start_time = time.perf_counter()
+    
+    def handle(message: dict):
+        if message.get("done"):
+            running[message["shard"]]["done"] = True
+            return
+        records[message["image"]] = message
+        if on_result is not None:
+            on_result(message)
+        shard = running.get(message["shard"])
+        if shard is not None:
+            shard["remaining"].discard(message["image"])
+        if message["status"] != "ok":
+            print(f"❌ Error processing {message['image']}: {message.get('error')}")
+        elif len(records) % 5 == 0:
+            print(f"    > Processed {len(records)}/{len(images_dict)} images...")
+    
+    while pending or running:
+        # Start shards on free core groups
+        while pending and free_cores:
+            shard_index, shard_images, attempt = pending.popleft()
+            cores = free_cores.pop()
+            process = context.Process(target=shard_worker, args=(shard_index, shard_images, cores, result_queue), daemon=True)
+            process.start()
+            running[shard_index] = {"process": process, "cores": cores, "images": shard_images, "attempt": attempt,
+                                    "remaining": {name for name, _ in shard_images}, "done": False}
+        
+        try:
+            handle(result_queue.get(timeout=1.0))
+        except queue.Empty:
+            pass
+        
+        # Reap finished or crashed workers
+        for shard_index in list(running):
+            shard = running[shard_index]
+            if shard["process"].is_alive():
+                continue
+            # Collect messages the worker sent before exiting
+            while True:
+                try:
+                    handle(result_queue.get_nowait())
+                except queue.Empty:
+                    break
+            del running[shard_index]
+            free_cores.append(shard["cores"])
+            
+            if not shard["done"] and shard["remaining"]:
+                leftover = [(name, path) for name, path in shard["images"] if name in shard["remaining"]]
+                if shard["attempt"] < MAX_SHARD_RETRIES:
+                    print(f"⚠️ Worker of shard {shard_index} exited (code {shard['process'].exitcode}), re-queuing {len(leftover)} images.")
+                    pending.append((next_shard, leftover, shard["attempt"] + 1))
+                    next_shard += 1
+                else:
+                    print(f"❌ Worker of shard {shard_index} failed {MAX_SHARD_RETRIES + 1} times, giving up on {len(leftover)} images.")
+                    for name, _ in leftover:
+                        handle({"image": name, "shard": shard_index, "status": "error", "error": "worker crashed"})
+    
+    elapsed = time.perf_counter() - start_time
+    n_ok = sum(1 for record in records.values() if record["status"] == "ok")
+    print(f"\nThroughput: {n_ok / (elapsed / 60):.1f} images/min ({n_ok} images in {elapsed:.1f} s, {n_workers} workers).")
+    
+    return list(records.values())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch SAM2 segmentation of the images in 'sam_inputs'. "
+                                     "Re-runs only process new, changed, failed or outdated images.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of CPU worker processes (sharded mode). 1 runs the threaded pipeline on the best device.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--force", action="store_true", help="Process every image, even if its output is up to date.")
+    mode.add_argument("--params-changed-only", action="store_true",
+                      help="Only re-process images whose outputs were made with other generator parameters or model.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # images
+    images_dict = check_input_images()
+    
+    # device (sharded mode: one CPU model per worker process)
+    sharded = args.workers > 1
+    device, dtype = (torch.device("cpu"), torch.float32) if sharded else get_device()
+    
+    # manifest: select new, changed, failed or outdated images
+    manifest = SAMManifest(PM.sam_outputs / MANIFEST_FILE)
+    run_key = {"params": params_key({**generator_params(device), "compact_masks": COMPACT_MASKS,
+                                     "tiles": [TILED_MIN_SIDE, TILE_SIZE, TILE_OVERLAP, TILE_MERGE_IOU]}),
+               "model": model_cache_key(CONFIG_NAME, PM.sam_weights_file)}
+    mode = "force" if args.force else "params-changed-only" if args.params_changed_only else "incremental"
+    selected, summary = manifest.plan(images_dict, run_key=run_key, output_dir=PM.sam_outputs, mode=mode)
+    print("Manifest: " + ", ".join(f"{n} {reason}" for reason, n in summary.items()) + f" -> {len(selected)} to process.")
+    if not selected:
+        print("All outputs are up to date.")
+        return
+    
+    def record_result(record: dict):
+        manifest.append({**selected[record["image"]], **record})
+    
+    images_dict = {name: images_dict[name] for name in selected}
+    
+    if sharded:
+        records = run_sharded(images_dict, n_workers=args.workers, on_result=record_result)
+        count = sum(1 for record in records if record["status"] == "ok")
+        print(f"\nSaved {count} SAM2 segmented images to '{PM.sam_outputs.name}'.")
+        return
+    
+    # get model
+    sam_model = build_sam_model(device=device, postprocessing=True)
+    # generator
+    embedding_cache = get_embedding_cache()
+    mask_generator = get_generator(sam_model, device, cache=embedding_cache)
+    
+    count = run_pipeline(images_dict, mask_generator, device, dtype, on_result=record_result)
     
     print(f"\nSaved {count} SAM2 segmented images to '{PM.sam_outputs.name}'.")
+    if embedding_cache is not None:
+        print(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses.")
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     PM.make_dirs()
     main()
@@ -1,13 +1,54 @@
-from visual_ccc import mygui
-from visual_ccc import gradcam
-from visual_ccc import image_a
-from visual_ccc import sam_segment
 import multiprocessing
+import sys
 
 CLASSES_OPTIONS = ["2-class", "3-class"]
 TASK = "3-class"
+MODEL_TYPE = "alexnet"
 
 def main():
+    # Headless subcommand: visual_ccc batch <input_dir> [options]
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from visual_ccc import batch
+        batch.main(sys.argv[2:])
+    # Headless subcommand: visual_ccc stack <stack.tif> [options]
+    elif len(sys.argv) > 1 and sys.argv[1] == "stack":
+        from visual_ccc import stack
+        stack.main(sys.argv[2:])
+    # Headless subcommand: visual_ccc dense <image> [options]
+    elif len(sys.argv) > 1 and sys.argv[1] == "dense":
+        from visual_ccc import dense_map
+        dense_map.main(sys.argv[2:])
+    # Report the import time of each module (startup path first)
+    elif "--profile-startup" in sys.argv[1:]:
+        from visual_ccc import startup
+        startup.profile_startup()
+    else:
+        run_gui()
+
+
+# Sweep k = 2..10 in the background (inertia/silhouette curves on the fitting sample, fitted models kept by the engine)
+def start_k_sweep(window, gray_standardized, cluster_engine, image_key):
+    from visual_ccc import image_a
+    window.find_element("-KSWEEP_BTN-").update(disabled=True) # type: ignore
+    window.find_element("-K_SUGGEST-").update(value="Sweeping k = 2..10 ...") # type: ignore
+    window.perform_long_operation(lambda: (image_key, image_a.clustering_k_sweep(gray_standardized, engine=cluster_engine)),
+                                  "-RETURN_KSWEEP_TRIGGER-")
+
+
+# Full-resolution analysis for the native mode (strip-wise, bounded memory)
+def native_analysis(img_cv2):
+    from visual_ccc import image_a
+    gray, segmented, contrast = image_a.image_analysis(img_cv2, output_size=None)
+    gray_standardized = image_a.standardize_image(gray, strip_rows=image_a.STRIP_ROWS)
+    return gray, segmented, contrast, gray_standardized
+
+
+def run_gui():
+    # Only the GUI is imported before the window shows. Heavy modules (torch, sam2, sklearn, ...)
+    # load with the models in the background, or on first use.
+    from visual_ccc import mygui
+    from visual_ccc import registry
+    
     # Initial values
     img_original_pil = None
     img_cv2 = None
@@ -28,23 +69,14 @@ def main():
     processing = False
     gray = None
     gray_standardized = None
+    cluster_engine = None
+    image_key = None
+    k_sweep = None
     clusters = None
-    # Load model in evaluation mode
-    model, class_map = gradcam.create_model(classes=TASK)
-    model.cpu()
-    model.eval()
-    # Setup SAM
-    sam_device, sam_dtype = sam_segment.get_device()
-    sam_model = sam_segment.build_sam_model(device=sam_device)
-    sam_model.to(sam_device)
-    sam_model.eval()
-    sam_mask_generator = sam_segment.get_generator(sam_model)
-    
-    # validate class map
-    if class_map is None or not isinstance(class_map, dict):
-        class_map = {"0": 0,
-                     "1": 1,
-                     "2": 2}
+    n_clusters = None
+    # Load the classifier, then SAM, in the background: the window shows immediately
+    registry.preload_classifier(classes=TASK, model_type=MODEL_TYPE, device="cpu")
+    registry.preload_sam()
     
     # Window
     window = mygui.main_window()
@@ -58,11 +90,16 @@ def main():
         # Load Image
         elif event == "-IMG_PATH-" and not processing:
             path: str = values[event]
-            # Validation
-            img_original_pil, _ = gradcam.read_image_pil(path)
-            img_cv2, filename = image_a.read_image_cv(path)
-            if img_original_pil:
-                img_sam = sam_segment.transform_image(img_original_pil)
+            from visual_ccc import image_source
+            # Validation. Decoded once: the PIL, OpenCV and SAM inputs are views of the same RGB buffer
+            img_original_pil, img_cv2, img_sam = None, None, None
+            source = image_source.open_image(path)
+            if source is not None:
+                try:
+                    img_sam = source.rgb()
+                    img_original_pil, img_cv2, filename = source.pil(), source.bgr(), source.filename
+                except Exception:
+                    img_sam = None
             # Error disable events
             if img_original_pil is None or img_cv2 is None:
                 window.find_element('-WARNING-').update(visible=True) # type: ignore
@@ -87,9 +124,11 @@ def main():
                     
         # Grad-CAM
         if event == "-GRADCAM-" and img_original_pil is not None:
+            from visual_ccc import gradcam
             # Disable button
             window.find_element('-GRADCAM-').update(disabled=True, visible=False) # type: ignore
-            # Grad-CAM process
+            # Grad-CAM process (waits for the classifier if it is still loading)
+            model, class_map = registry.get_classifier(classes=TASK, model_type=MODEL_TYPE, device="cpu")
             img_model, img_display = gradcam.transform_image(img_original_pil)
             # CHOOSE BINARY OR TERNARY MODEL
             if TASK == "3-class":
@@ -116,17 +155,31 @@ def main():
             processing = True
             # save original image
             original_img_array = img_sam.copy()
-            # SAM process
-            window.perform_long_operation(lambda: sam_segment.generate_mask(mask_generator=sam_mask_generator,
-                                                                            image=original_img_array, # type: ignore
-                                                                            device=sam_device,
-                                                                            dtype=sam_dtype), 
-                                          "-RETURN_SAM_TRIGGER-")
+            # SAM process (the first run waits for SAM to finish loading), optionally classifying every mask
+            def run_sam(image, classify):
+                from visual_ccc import sam_segment
+                sam_mask_generator, sam_device, sam_dtype = registry.get_sam()
+                anns = sam_segment.generate_mask(mask_generator=sam_mask_generator,
+                                                 image=image,
+                                                 device=sam_device,
+                                                 dtype=sam_dtype)
+                if not classify:
+                    return anns, None
+                from visual_ccc import sam_classify
+                model, class_map = registry.get_classifier(classes=TASK, model_type=MODEL_TYPE, device="cpu")
+                return sam_classify.classify_masks(anns, image, model, class_map), class_map
+            classify_segments = bool(values['-SAM_CLASSIFY-'])
+            window.perform_long_operation(lambda: run_sam(original_img_array, classify_segments), "-RETURN_SAM_TRIGGER-")
         elif event == "-RETURN_SAM_TRIGGER-" and original_img_array is not None:
+            from visual_ccc import sam_segment
             mygui.notification_popup_sam()
-            mask_annotations = values[event]
-            # get rendered image
-            _pil_image, mat_sam_figure = sam_segment.render_segmentation(anns=mask_annotations, original_image_array=original_img_array, borders=False)
+            mask_annotations, sam_class_map = values[event]
+            # get rendered image (coloured by class when the segments were classified)
+            if sam_class_map is not None:
+                from visual_ccc import sam_classify
+                _pil_image, mat_sam_figure = sam_classify.render_class_overlay(anns=mask_annotations, original_image_array=original_img_array, class_map=sam_class_map)
+            else:
+                _pil_image, mat_sam_figure = sam_segment.render_segmentation(anns=mask_annotations, original_image_array=original_img_array, borders=False)
             # plot
             figure_canvas_agg_sam, toolbar_sam = mygui.draw_figure(canvas=window.find_element('-SAM_CANVAS-').TKCanvas, figure=mat_sam_figure,     # type: ignore
                                                                     figure_canvas_agg=figure_canvas_agg_sam, toolbar=toolbar_sam)
@@ -140,6 +193,7 @@ def main():
         
         # Image Analysis
         if event == "-IMG_ANALYSIS-" and img_cv2 is not None:
+            from visual_ccc import image_a
             # Disable button and hide tab
             window.find_element('-IMG_ANALYSIS-').update(disabled=True, visible=False) # type: ignore
             window.find_element('-SAM_BUTTON-').update(disabled=True, visible=False) # type: ignore
@@ -153,27 +207,58 @@ def main():
             window.perform_long_operation(lambda: image_a.image_texture(segmented), "-RETURN_TRIGGER-")
         # Long process completed
         elif event == "-RETURN_TRIGGER-":
+            from visual_ccc import image_a
             mygui.notification_popup()
             # Continue process
             contrast = values[event]
             images_figure = image_a.plot_image_analysis(gray, segmented, contrast)
-            # save standardized version for later use in clustering
+            # save standardized version for later use in clustering (features and subsample cached by the engine)
             gray_standardized = image_a.standardize_image(gray)
+            cluster_engine = image_a.ClusteringEngine(gray_standardized)
+            image_key = image_a.image_hash(gray)
+            k_sweep = None
+            start_k_sweep(window, gray_standardized, cluster_engine, image_key)
             # plot
             figure_canvas_agg_image, toolbar_image = mygui.draw_figure(canvas=window.find_element('-IMG_CANVAS-').TKCanvas, figure=images_figure,     # type: ignore
                                                                     figure_canvas_agg=figure_canvas_agg_image, toolbar=toolbar_image) 
             # Enable clustering
             window.find_element('-SECRET_TAB-').update(visible=True) # type: ignore
+            if values['-NATIVE_RES-']:
+                # The preview stays usable while the full-resolution results compute (image selection stays locked)
+                window.find_element('-PATH_BUTTON-').set_tooltip("Disabled while computing full resolution") # type: ignore
+                native_source = img_cv2
+                window.perform_long_operation(lambda: (native_source, native_analysis(native_source)), "-RETURN_NATIVE_TRIGGER-")
+            else:
+                # Restore buttons
+                window.find_element('-PATH_BUTTON-').update(disabled=False) # type: ignore
+                window.find_element('-PATH_BUTTON-').set_tooltip("Select Image") # type: ignore
+                processing = False
+            is_img_processed = True
+            if not is_sam_processed:
+                window.find_element('-SAM_BUTTON-').update(disabled=False, visible=True) # type: ignore
+        # Full-resolution results replace the preview
+        elif event == "-RETURN_NATIVE_TRIGGER-" and values[event][0] is img_cv2:
+            from visual_ccc import image_a
+            gray, segmented, contrast, gray_standardized = values[event][1]
+            images_figure = image_a.plot_image_analysis(gray, segmented, contrast)
+            figure_canvas_agg_image, toolbar_image = mygui.draw_figure(canvas=window.find_element('-IMG_CANVAS-').TKCanvas, figure=images_figure,     # type: ignore
+                                                                    figure_canvas_agg=figure_canvas_agg_image, toolbar=toolbar_image) 
+            # Preview clusters no longer match the image
+            cluster_engine = image_a.ClusteringEngine(gray_standardized)
+            image_key = image_a.image_hash(gray)
+            clusters = None
+            window.find_element("-TARGET_BTN-").update(visible=False) # type: ignore
+            k_sweep = None
+            # The sweep only fits the engine's pixel sample: no full-resolution labels are computed or cached
+            start_k_sweep(window, gray_standardized, cluster_engine, image_key)
             # Restore buttons
             window.find_element('-PATH_BUTTON-').update(disabled=False) # type: ignore
             window.find_element('-PATH_BUTTON-').set_tooltip("Select Image") # type: ignore
             processing = False
-            is_img_processed = True
-            if not is_sam_processed:
-                window.find_element('-SAM_BUTTON-').update(disabled=False, visible=True) # type: ignore
         
         # Clustering
         if event == "-CLUSTER_BTN-":
+            from visual_ccc import image_a
             # Validate number of clusters
             try:
                 n_clusters = int(values['-CLUSTERS-'])
@@ -184,17 +269,43 @@ def main():
                     window.find_element("-CLUSTER_ERROR-").update(visible=True) # type: ignore
                 else:
                     window.find_element("-CLUSTER_ERROR-").update(visible=False) # type: ignore
-                    # Perform clustering
-                    clusters = image_a.image_clustering(gray_standardized, n_clusters)
-                    cluster_figure = image_a.plot_image_clustering(clusters, gray)
-                    # Plot
-                    figure_canvas_agg_cluster, toolbar_cluster = mygui.draw_figure(canvas=window.find_element('-CLUSTER_CANVAS-').TKCanvas, figure=cluster_figure,     # type: ignore
-                                                                        figure_canvas_agg=figure_canvas_agg_cluster, toolbar=toolbar_cluster) 
-                    # Enable cluster target
-                    window.find_element("-TARGET_BTN-").update(visible=True) # type: ignore
-                    window.find_element("-TARGET_CLUSTER-").update(values=list(range(0,n_clusters)), value=0) # type: ignore
+                    window.find_element("-CLUSTER_BTN-").update(disabled=True) # type: ignore
+                    # Perform clustering (long process)
+                    window.perform_long_operation(lambda: image_a.image_clustering_cached(gray_standardized, n_clusters, engine=cluster_engine, image_key=image_key),
+                                                  "-RETURN_CLUSTER_TRIGGER-")
+        elif event == "-RETURN_CLUSTER_TRIGGER-":
+            from visual_ccc import image_a
+            window.find_element("-CLUSTER_BTN-").update(disabled=False) # type: ignore
+            # Discard a preview result that arrives after the full-resolution image replaced it
+            if values[event].labels.size != gray.size:
+                continue
+            clusters = values[event]
+            cluster_figure = image_a.plot_image_clustering(clusters.labels, gray)
+            # Plot
+            figure_canvas_agg_cluster, toolbar_cluster = mygui.draw_figure(canvas=window.find_element('-CLUSTER_CANVAS-').TKCanvas, figure=cluster_figure,     # type: ignore
+                                                                figure_canvas_agg=figure_canvas_agg_cluster, toolbar=toolbar_cluster) 
+            # Enable cluster target
+            window.find_element("-TARGET_BTN-").update(visible=True) # type: ignore
+            window.find_element("-TARGET_CLUSTER-").update(values=list(range(0,clusters.n_clusters)), value=0) # type: ignore
+        # k-sweep completed (ignored if another image was analysed meanwhile)
+        elif event == "-RETURN_KSWEEP_TRIGGER-":
+            from visual_ccc import image_a
+            sweep_key, sweep = values[event]
+            if sweep_key == image_key:
+                k_sweep = sweep
+                window.find_element("-KSWEEP_BTN-").update(disabled=False) # type: ignore
+                window.find_element("-K_SUGGEST-").update(value=f"Suggested k: {image_a.suggested_k(k_sweep)}") # type: ignore
+        elif event == "-KSWEEP_BTN-" and k_sweep is not None:
+            from visual_ccc import image_a
+            sweep_figure = image_a.plot_k_sweep(k_sweep)
+            # Plot
+            figure_canvas_agg_cluster, toolbar_cluster = mygui.draw_figure(canvas=window.find_element('-CLUSTER_CANVAS-').TKCanvas, figure=sweep_figure,     # type: ignore
+                                                                figure_canvas_agg=figure_canvas_agg_cluster, toolbar=toolbar_cluster)
         # Target cluster
         elif event == "-TARGET_BTN-":
+            from visual_ccc import image_a
+            if clusters is None:
+                continue
             target = int(values['-TARGET_CLUSTER-'])
             mask_2d, percentage = image_a.target_cluster(clusters, gray, target)
             target_figure = image_a.plot_target_cluster(mask_2d)
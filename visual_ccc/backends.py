@@ -0,0 +1,233 @@
+import copy
+import tempfile
+from pathlib import Path
+from typing import Literal, Optional
+
+import torch
+from torch import nn
+
+from visual_ccc.gradcam import AlexnetHook, SIZE_REQUIREMENT, _model_device, _predict_classes
+from visual_ccc.visualcnn_model import VisualCNN
+
+
+# Settings
+BACKENDS = ["eager", "compile", "torchscript", "int8-dynamic", "int8-static", "onnx"]
+CALIBRATION_BATCHES = 8
+
+
+# Inference-only wrapper: quantized feature extractor, float pooling + classifier
+class StaticQuantizedModel(nn.Module):
+    def __init__(self, features: nn.Module, pool: nn.Module, classifier: nn.Module):
+        super().__init__()
+        self.quant = torch.ao.quantization.QuantStub()
+        self.features = features
+        self.dequant = torch.ao.quantization.DeQuantStub()
+        self.pool = pool
+        self.classifier = classifier
+
+    def forward(self, x):
+        x = self.dequant(self.features(self.quant(x)))
+        x = self.pool(x)
+        x = torch.flatten(x, 1)
+        return self.classifier(x)
+
+
+# ONNX Runtime session with the same call signature as a module (tensor in, logits tensor out)
+class OnnxModel:
+    def __init__(self, onnx_path: Path):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The 'onnx' backend requires 'onnx' and 'onnxruntime' to be installed.") from e
+
+        self.onnx_path = Path(onnx_path)
+        self.session = onnxruntime.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        logits = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+# Split a model into (feature extractor, pooling, classifier)
+def _model_parts(model):
+    if isinstance(model, VisualCNN):
+        return model.features, model.gap, model.classifier
+    if isinstance(model, AlexnetHook):
+        return model.cnn, model.lastpool, model.ann
+    raise TypeError(f"Unsupported model type: {type(model).__name__}")
+
+
+# Names of consecutive Conv2d(-BatchNorm2d)(-ReLU) modules of a Sequential, for fusion
+def fusion_groups(sequential: nn.Sequential) -> list[list[str]]:
+    names = list(sequential._modules.keys())
+    modules = list(sequential._modules.values())
+    groups = []
+    for i, module in enumerate(modules):
+        if not isinstance(module, nn.Conv2d):
+            continue
+        group = [names[i]]
+        j = i + 1
+        if j < len(modules) and isinstance(modules[j], nn.BatchNorm2d):
+            group.append(names[j])
+            j += 1
+        if j < len(modules) and isinstance(modules[j], nn.ReLU):
+            group.append(names[j])
+        if len(group) > 1:
+            groups.append(group)
+    return groups
+
+
+# Pick the best available quantized engine for this CPU
+def _set_quantized_engine() -> str:
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized engine is available in this PyTorch build.")
+
+
+# int8 static quantization of the feature extractor, with Conv-BN-ReLU fused
+def quantize_static(model, calibration_batches: list[torch.Tensor]):
+    engine = _set_quantized_engine()
+    features, pool, classifier = _model_parts(copy.deepcopy(model).cpu().eval())
+    # In-place ReLUs cannot be fused or observed reliably
+    for module in features.modules():
+        if isinstance(module, nn.ReLU):
+            module.inplace = False
+
+    features = torch.ao.quantization.fuse_modules(features, fusion_groups(features)) # type: ignore
+    quantized = StaticQuantizedModel(features, pool, classifier).eval()
+    # Only the feature extractor is quantized, the (small) head stays in float
+    quantized.qconfig = None
+    for module in (quantized.quant, quantized.features, quantized.dequant):
+        module.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+
+    torch.ao.quantization.prepare(quantized, inplace=True)
+    with torch.inference_mode():
+        for batch in calibration_batches:
+            quantized(batch.cpu())
+    torch.ao.quantization.convert(quantized, inplace=True)
+    return quantized
+
+
+# int8 dynamic quantization of the Linear layers (weights int8, activations quantized on the fly)
+def quantize_dynamic(model):
+    _set_quantized_engine()
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+# Replace AdaptiveAvgPool2d layers by the equivalent fixed AvgPool2d for the input size of `example_input`
+# (ONNX cannot export adaptive pooling when the output size does not divide the input size, e.g. AlexNet's 7 -> 6)
+def _fix_adaptive_pooling(model, example_input: torch.Tensor):
+    input_sizes: dict[nn.Module, tuple[int, int]] = dict()
+    handles = [module.register_forward_hook(lambda m, args, _: input_sizes.__setitem__(m, tuple(args[0].shape[-2:])))
+               for module in model.modules() if isinstance(module, nn.AdaptiveAvgPool2d)]
+    with torch.no_grad():
+        model(example_input)
+    for handle in handles:
+        handle.remove()
+
+    for parent in list(model.modules()):
+        for name, module in parent.named_children():
+            if module not in input_sizes:
+                continue
+            output_size = nn.modules.utils._pair(module.output_size)
+            kernels, strides = [], []
+            for size_in, size_out in zip(input_sizes[module], output_size):
+                size_out = size_out or size_in
+                starts = [(i * size_in) // size_out for i in range(size_out)]
+                ends = [-((-(i + 1) * size_in) // size_out) for i in range(size_out)]
+                stride = starts[1] - starts[0] if size_out > 1 else 1
+                # Only uniform windows have a fixed-kernel equivalent
+                if len({end - start for start, end in zip(starts, ends)}) != 1 or starts != [i * stride for i in range(size_out)]:
+                    break
+                kernels.append(ends[0] - starts[0])
+                strides.append(stride)
+            else:
+                setattr(parent, name, nn.AvgPool2d(kernel_size=tuple(kernels), stride=tuple(strides)))
+    return model
+
+
+# Export to ONNX (dynamic batch size) and open an ONNX Runtime session
+def export_onnx(model, example_input: torch.Tensor, onnx_path: Optional[Path] = None) -> OnnxModel:
+    if onnx_path is None:
+        onnx_path = Path(tempfile.mkdtemp()) / f"{type(model).__name__}.onnx"
+    export_model = _fix_adaptive_pooling(copy.deepcopy(model).cpu().eval(), example_input.cpu())
+    with torch.no_grad():
+        torch.onnx.export(export_model, (example_input.cpu(),), str(onnx_path),
+                          input_names=["input"], output_names=["logits"],
+                          dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}}, dynamo=False)
+    return OnnxModel(onnx_path)
+
+
+def build_backend(model, backend: Literal["eager", "compile", "torchscript", "int8-dynamic", "int8-static", "onnx"] = "eager",
+                  calibration_batches: Optional[list[torch.Tensor]] = None, onnx_path: Optional[Path] = None):
+    """
+    Returns an inference-only version of a classifier (`AlexnetHook` or `VisualCNN`) for the given backend.
+
+    The result is called like the model (input batch -> logits) under `torch.inference_mode`. It does not
+    support Grad-CAM: use the eager model for heatmaps. "eager" and "compile" stay on the model's device,
+    the other backends run on CPU.
+
+    Args:
+        model: Model returned by `gradcam.create_model`.
+        backend (str): One of BACKENDS:
+            - "eager": the model itself, in eval mode.
+            - "compile": `torch.compile` (the first call compiles).
+            - "torchscript": traced and frozen TorchScript.
+            - "int8-dynamic": Linear layers quantized to int8 (CPU).
+            - "int8-static": feature extractor quantized to int8 with fused Conv-BN-ReLU, calibrated on
+              `calibration_batches` (CPU).
+            - "onnx": exported to ONNX and run with ONNX Runtime (CPU).
+        calibration_batches (list | None): Model inputs for "int8-static" calibration, e.g. a few real batches.
+            Defaults to random inputs, which gives poorer accuracy.
+        onnx_path (Path | None): Where to write the ONNX file. Defaults to a temporary directory.
+    """
+    model.eval()
+    example_input = torch.rand(1, 1, SIZE_REQUIREMENT, SIZE_REQUIREMENT)
+
+    if backend == "eager":
+        return model
+    elif backend == "compile":
+        return torch.compile(model)
+    elif backend == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(copy.deepcopy(model).cpu(), example_input)
+        return torch.jit.freeze(traced)
+    elif backend == "int8-dynamic":
+        return quantize_dynamic(model)
+    elif backend == "int8-static":
+        if not calibration_batches:
+            print("No calibration data given, calibrating int8 model on random inputs.")
+            calibration_batches = [torch.rand(8, 1, SIZE_REQUIREMENT, SIZE_REQUIREMENT) for _ in range(CALIBRATION_BATCHES)]
+        return quantize_static(model, calibration_batches)
+    elif backend == "onnx":
+        return export_onnx(model, example_input, onnx_path)
+    else:
+        raise ValueError(f"Unknown backend: {backend}. Choose from {BACKENDS}")
+
+
+def check_parity(reference, candidate, batches: list[torch.Tensor]) -> dict[str, float]:
+    """
+    Compares a backend with the eager model on the same inputs.
+
+    Returns:
+        dict: "agreement" (fraction of identical predicted classes) and "max_abs_diff" (largest logit difference).
+    """
+    device, candidate_device = _model_device(reference), _model_device(candidate)
+    n_same = 0
+    n_total = 0
+    max_abs_diff = 0.0
+    with torch.inference_mode():
+        for batch in batches:
+            logits_reference = reference(batch.to(device)).float().cpu()
+            logits_candidate = candidate(batch.to(candidate_device)).float().cpu()
+            n_same += int((_predict_classes(logits_reference) == _predict_classes(logits_candidate)).sum().item())
+            n_total += batch.shape[0]
+            max_abs_diff = max(max_abs_diff, (logits_reference - logits_candidate).abs().max().item())
+    return {"agreement": n_same / max(n_total, 1), "max_abs_diff": max_abs_diff}
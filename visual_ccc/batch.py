@@ -0,0 +1,282 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy
+import torch
+from torch.utils import data
+from PIL import Image
+import matplotlib.pyplot as plt
+
+from visual_ccc import backends, gradcam
+from visual_ccc.image_source import ImageSource
+
+
+# Settings
+BATCH_SIZE = 32
+NUM_WORKERS = min(4, os.cpu_count() or 1)
+WRITER_THREADS = 4
+PREDICTIONS_FILE = "predictions.csv"
+HEATMAPS_DIR = "heatmaps"
+DEFAULT_OUTPUT_DIR = "visual_ccc_results"
+CSV_FIELDS = ["image", "prediction", "status", "heatmap"]
+HEATMAP_FORMATS = ["npz", "png", "none"]
+OUTPUT_FORMATS = ["csv", "parquet"]
+
+
+# Dataset that decodes and transforms images inside the DataLoader workers
+class ImageFileDataset(data.Dataset):
+    def __init__(self, paths: list[Path], with_display: bool=False):
+        self.paths = paths
+        self.with_display = with_display
+        self.transform_model, self.transform_display = gradcam.get_transforms()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        size = gradcam.SIZE_REQUIREMENT
+        # Unreadable files are reported back instead of crashing the worker
+        try:
+            img = ImageSource(self.paths[index]).pil()
+            img_model = self.transform_model(img)
+            if self.with_display:
+                img_display = self.transform_display(img)
+            else:
+                img_display = torch.zeros(0)
+            is_valid = True
+        except Exception:
+            img_model = torch.zeros(1, size, size)
+            img_display = torch.zeros(3, size, size) if self.with_display else torch.zeros(0)
+            is_valid = False
+
+        return img_model, img_display, index, is_valid
+
+
+# List the images of a directory (non-recursive), keyed by file name
+def list_input_images(directory: Path) -> dict[str, Path]:
+    images_dict: dict[str, Path] = dict()
+
+    for path in sorted(Path(directory).iterdir()):
+        if path.is_file() and path.suffix.lower() in gradcam.valid_extensions:
+            images_dict[path.name] = path
+
+    # check dict
+    if not images_dict:
+        raise IOError(f"No valid image files found in directory '{directory}'.")
+
+    return images_dict
+
+
+# Images already processed successfully by a previous (possibly interrupted) run
+def load_completed(predictions_path: Path) -> set[str]:
+    if not predictions_path.is_file():
+        return set()
+
+    with open(predictions_path, newline="") as f:
+        # A row cut short by a crash has no status and is processed again
+        return {row["image"] for row in csv.DictReader(f) if row.get("status") == "ok"}
+
+
+# Make the predictions file ready for appending: returns True if the header must be written (missing or empty file,
+# e.g. a crash before the first batch), and terminates a row cut short by a crash so new rows start on their own line
+def prepare_append(predictions_path: Path) -> bool:
+    if not predictions_path.is_file() or predictions_path.stat().st_size == 0:
+        return True
+
+    with open(predictions_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+    return False
+
+
+# Write one heatmap as a compressed array or as a PNG overlay on the display image
+def save_heatmap(heatmap: numpy.ndarray, img_display: Optional[torch.Tensor], save_path: Path):
+    if save_path.suffix == ".npz":
+        numpy.savez_compressed(save_path, heatmap=heatmap)
+    else:
+        colored = plt.get_cmap("jet")(heatmap)[..., :3]
+        display = img_display.permute(1, 2, 0).numpy() # type: ignore
+        overlay = 0.5 * display + 0.5 * colored
+        Image.fromarray((overlay * 255).astype(numpy.uint8)).save(save_path, format="PNG")
+
+
+# Convert the predictions CSV to Parquet, keeping the last row of each image
+def export_parquet(predictions_path: Path):
+    try:
+        import pandas
+    except ImportError as e:
+        raise ImportError("Parquet output requires 'pandas' and 'pyarrow' to be installed.") from e
+
+    table = pandas.read_csv(predictions_path).drop_duplicates(subset="image", keep="last")
+    parquet_path = predictions_path.with_suffix(".parquet")
+    table.to_parquet(parquet_path, index=False)
+    print(f"Saved predictions to '{parquet_path}'.")
+
+
+# Headless classification + Grad-CAM over a directory
+def run_batch(input_dir: Path,
+              output_dir: Optional[Path] = None,
+              classes: Literal["2-class", "3-class"] = "3-class",
+              model_type: Literal["alexnet", "visualcnn"] = "alexnet",
+              batch_size: int = BATCH_SIZE,
+              num_workers: int = NUM_WORKERS,
+              heatmap_format: Literal["npz", "png", "none"] = "npz",
+              output_format: Literal["csv", "parquet"] = "csv",
+              device: Optional[str] = None,
+              backend: str = "eager"):
+    """
+    Classifies every image in `input_dir` and optionally saves its Grad-CAM heatmap.
+
+    Images are decoded by `num_workers` DataLoader processes and classified in batches of `batch_size`.
+    Predictions are appended to `predictions.csv` after every batch (after the batch heatmaps are written),
+    so an interrupted run resumes where it stopped: images with an "ok" row are skipped, failed ones are retried.
+
+    Args:
+        input_dir (Path): Directory with the input images.
+        output_dir (Path | None): Results directory. Defaults to `<input_dir>/visual_ccc_results`.
+        classes (str): "2-class" or "3-class" model.
+        model_type (str): "alexnet" or "visualcnn".
+        batch_size (int): Images per forward/backward pass.
+        num_workers (int): DataLoader worker processes (0 decodes in the main process).
+        heatmap_format (str): "npz" (compressed float arrays), "png" (overlays) or "none" (prediction only).
+        output_format (str): "csv", or "parquet" to also export the predictions table as Parquet.
+        device (str | None): Torch device. Defaults to CUDA if available, else CPU.
+        backend (str): Inference backend (see `backends.BACKENDS`). Backends other than "eager" only
+            classify, so they require `heatmap_format="none"`.
+    """
+    if backend != "eager" and heatmap_format != "none":
+        raise ValueError(f"The '{backend}' backend cannot compute Grad-CAM heatmaps. Use heatmap_format='none'.")
+
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir) if output_dir is not None else input_dir / DEFAULT_OUTPUT_DIR
+    heatmaps_dir = output_dir / HEATMAPS_DIR
+    predictions_path = output_dir / PREDICTIONS_FILE
+
+    # images
+    images_dict = list_input_images(input_dir)
+    completed = load_completed(predictions_path)
+    pending = [name for name in images_dict if name not in completed]
+    print(f"Found {len(images_dict)} images, {len(images_dict) - len(pending)} already processed.")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if heatmap_format != "none":
+        heatmaps_dir.mkdir(exist_ok=True)
+
+    if pending:
+        # device and model
+        torch_device = torch.device(device) if device else torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model, class_map = gradcam.create_model(classes=classes, model_type=model_type)
+        model.to(torch_device)
+        model.eval()
+        if class_map is None or not isinstance(class_map, dict):
+            class_map = {str(i): i for i in range(3 if classes == "3-class" else 2)}
+
+        # data
+        dataset = ImageFileDataset([images_dict[name] for name in pending], with_display=(heatmap_format == "png"))
+
+        # inference backend (int8-static is calibrated on the first readable images)
+        if backend != "eager":
+            calibration_batches = None
+            if backend == "int8-static":
+                calibration = []
+                for i in range(len(dataset)):
+                    if len(calibration) == backends.CALIBRATION_BATCHES * 8:
+                        break
+                    img_model, _img_display, _index, is_valid = dataset[i]
+                    # Unreadable files come back as zero tensors and would skew the activation ranges
+                    if is_valid:
+                        calibration.append(img_model)
+                calibration_batches = list(torch.stack(calibration).split(8)) if calibration else []
+            model = backends.build_backend(model, backend, calibration_batches=calibration_batches)
+        dataloader = data.DataLoader(dataset=dataset, batch_size=batch_size, num_workers=num_workers,
+                                     pin_memory=(torch_device.type == "cuda"))
+
+        write_header = prepare_append(predictions_path)
+        count = 0
+        start_time = time.perf_counter()
+
+        with open(predictions_path, "a", newline="") as f, ThreadPoolExecutor(max_workers=WRITER_THREADS) as writer_pool:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            if write_header:
+                writer.writeheader()
+
+            for img_batch, img_display, indices, is_valid in dataloader:
+                names = [pending[i] for i in indices.tolist()]
+                rows = {name: {"image": name, "prediction": "", "status": "error", "heatmap": ""} for name in names}
+                valid_names = [name for name, ok in zip(names, is_valid.tolist()) if ok]
+
+                if valid_names:
+                    img_batch = img_batch[is_valid]
+                    # predict (+ Grad-CAM)
+                    if heatmap_format == "none":
+                        predictions = gradcam.get_predictions_batch(img_batch, model, class_map, micro_batch_size=batch_size)
+                    else:
+                        heatmaps, predictions = gradcam.get_gradients_batch(img_batch, model, class_map, micro_batch_size=batch_size)
+                        displays = img_display[is_valid] if heatmap_format == "png" else [None] * len(valid_names)
+                        futures = []
+                        for name, heatmap, display in zip(valid_names, heatmaps, displays):
+                            save_path = heatmaps_dir / f"{name}.{heatmap_format}"
+                            futures.append(writer_pool.submit(save_heatmap, heatmap, display, save_path))
+                            rows[name]["heatmap"] = str(save_path.relative_to(output_dir))
+                        # Heatmaps must be on disk before their rows are recorded
+                        for future in futures:
+                            future.result()
+
+                    for name, prediction in zip(valid_names, predictions):
+                        rows[name].update(prediction=prediction, status="ok")
+
+                for name in names:
+                    if rows[name]["status"] != "ok":
+                        print(f"❌ Error processing {name}")
+
+                writer.writerows(rows.values())
+                f.flush()
+
+                count += len(names)
+                if count % (10 * batch_size) < len(names):
+                    elapsed = time.perf_counter() - start_time
+                    print(f"    > Processed {count}/{len(pending)} images ({count / elapsed:.1f} images/s)...")
+
+        elapsed = time.perf_counter() - start_time
+        print(f"\nProcessed {count} images in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.1f} images/s).")
+
+    if output_format == "parquet":
+        export_parquet(predictions_path)
+    print(f"Results saved to '{output_dir}'.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="visual_ccc batch",
+                                     description="Headless classification and Grad-CAM over a directory of images.")
+    parser.add_argument("input_dir", type=Path, help="Directory with the input images.")
+    parser.add_argument("-o", "--output-dir", type=Path, default=None, help=f"Results directory (default: <input_dir>/{DEFAULT_OUTPUT_DIR}).")
+    parser.add_argument("--classes", choices=["2-class", "3-class"], default="3-class")
+    parser.add_argument("--model", choices=["alexnet", "visualcnn"], default="alexnet")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="DataLoader worker processes.")
+    parser.add_argument("--heatmaps", choices=HEATMAP_FORMATS, default="npz", help="Heatmap output format.")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", help="Predictions table format.")
+    parser.add_argument("--device", default=None, help="Torch device (default: cuda if available, else cpu).")
+    parser.add_argument("--backend", choices=backends.BACKENDS, default="eager",
+                        help="Inference backend. Backends other than 'eager' require '--heatmaps none'.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_batch(input_dir=args.input_dir,
+              output_dir=args.output_dir,
+              classes=args.classes,
+              model_type=args.model,
+              batch_size=args.batch_size,
+              num_workers=args.workers,
+              heatmap_format=args.heatmaps,
+              output_format=args.format,
+              device=args.device,
+              backend=args.backend)
@@ -0,0 +1,232 @@
+from typing import Iterable, Optional, Sequence
+
+import numpy
+import torch
+from torch import nn
+import matplotlib.pyplot as plt
+
+from visual_ccc.gradcam import SIZE_REQUIREMENT, _class_probabilities, _model_device, _predict_classes
+
+
+# Settings
+GRADIENT_METHODS = ("gradcam", "gradcam++", "layercam")   # derived together from one forward + backward pass
+SCORE_METHOD = "scorecam"
+SCORECAM_CHUNK = 32      # masked inputs per Score-CAM forward pass
+EPSILON = 1e-7
+FIGSIZE = (8, 4)
+DPI = 150
+
+
+# Default CAM layer: the output of the convolutional feature extractor (the layer used by `gradcam_core`)
+def default_layers(model) -> list[str]:
+    if hasattr(model, "cnn"):
+        return ["cnn"]        # AlexnetHook: features[:12]
+    if hasattr(model, "features"):
+        return ["features"]   # VisualCNN
+    raise ValueError("No default CAM layer for this model, pass the layer names explicitly.")
+
+
+# Names of the layers a CAMEngine can attach to (convolutional, activation and pooling modules, and their containers)
+def layer_names(model) -> list[str]:
+    return [name for name, module in model.named_modules()
+            if name and isinstance(module, (nn.Sequential, nn.Conv2d, nn.ReLU, nn.MaxPool2d, nn.AvgPool2d))]
+
+
+class CAMEngine:
+    """
+    Class activation maps of several methods and several layers from shared passes through the model.
+
+    Forward hooks capture the activations of every requested layer and tensor hooks their gradients, so a
+    single forward and a single backward pass give Grad-CAM, Grad-CAM++ and LayerCAM for all layers at once.
+    Score-CAM (gradient-free) is optional: every activation channel becomes an input mask, and the masked
+    inputs are scored in inference-mode forward passes of `score_chunk` images.
+
+    Hooked outputs are passed on to the network as copies, so in-place activations (AlexNet's ReLU) cannot
+    overwrite the captured tensors. Use as a context manager, or call `close()` to remove the hooks.
+
+    Args:
+        model: Classifier in eval mode (`AlexnetHook` or `VisualCNN`).
+        layers (Sequence[str] | None): Module names (see `layer_names`). Defaults to the last convolutional stage.
+    """
+    def __init__(self, model, layers: Optional[Sequence[str]] = None):
+        self.model = model
+        self.layers = list(layers) if layers is not None else default_layers(model)
+        modules = dict(model.named_modules())
+        missing = [name for name in self.layers if name not in modules]
+        if missing:
+            raise ValueError(f"Unknown layers {missing}. Available layers: {layer_names(model)}")
+
+        self.activations: dict[str, torch.Tensor] = dict()
+        self.gradients: dict[str, torch.Tensor] = dict()
+        self._capturing = False
+        self._handles = [modules[name].register_forward_hook(self._forward_hook(name)) for name in self.layers]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Removes the hooks and drops the captured tensors."""
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._clear()
+
+    def _clear(self):
+        self.activations.clear()
+        self.gradients.clear()
+
+    def _forward_hook(self, name: str):
+        def hook(module, inputs, output):
+            if not self._capturing or not output.requires_grad:
+                return None
+            self.activations[name] = output
+            output.register_hook(lambda grad: self.gradients.__setitem__(name, grad))
+            # The network continues with a copy (in-place layers downstream would modify the captured tensor)
+            return output.clone()
+        return hook
+
+    def compute(self, img_batch: torch.Tensor, methods: Iterable[str] = GRADIENT_METHODS, class_index: Optional[int] = None,
+                score_chunk: int = SCORECAM_CHUNK, output_size: Optional[tuple[int, int]] = (SIZE_REQUIREMENT, SIZE_REQUIREMENT)):
+        """
+        Computes the requested CAM methods at every layer of the engine for a batch of images.
+
+        Args:
+            img_batch (torch.Tensor): Model inputs of shape (N, 1, H, W), as produced by `gradcam.transform_image`.
+            methods (Iterable[str]): Any of "gradcam", "gradcam++", "layercam" and "scorecam".
+            class_index (int | None): Class explained by the maps. None explains the predicted class of each image.
+            score_chunk (int): Masked inputs per Score-CAM forward pass (bounds peak memory).
+            output_size (tuple[int, int] | None): (width, height) of the returned heatmaps. None keeps the layer resolution.
+
+        Returns:
+            (dict[tuple[str, str], np.ndarray], np.ndarray): Heatmaps in [0, 1] of shape (N, height, width) keyed by
+            (method, layer), and the predicted class indices of shape (N,).
+        """
+        methods = list(methods)
+        unknown = [m for m in methods if m not in (*GRADIENT_METHODS, SCORE_METHOD)]
+        if unknown:
+            raise ValueError(f"Unknown CAM methods {unknown}. Options: {[*GRADIENT_METHODS, SCORE_METHOD]}")
+        if torch.is_inference_mode_enabled():
+            raise RuntimeError("CAMEngine.compute needs autograd and cannot run inside torch.inference_mode().")
+        # Gradients flow from the input, so layers are captured even when the parameters are frozen
+        img_batch = img_batch.to(_model_device(self.model)).detach().clone().requires_grad_(True)
+
+        # One forward pass capturing every layer; one backward pass only if a gradient method is requested
+        gradient_methods = [m for m in methods if m in GRADIENT_METHODS]
+        self._capturing = True
+        try:
+            with torch.enable_grad():
+                logits = self.model(img_batch)
+                class_pred = _predict_classes(logits)
+                class_target = class_pred if class_index is None else torch.full_like(class_pred, class_index)
+                if gradient_methods:
+                    _target_scores(logits, class_target).sum().backward()
+        finally:
+            self._capturing = False
+
+        cams: dict[tuple[str, str], torch.Tensor] = dict()
+        try:
+            for layer in self.layers:
+                activations = self.activations[layer].detach()
+                if gradient_methods:
+                    gradients = self.gradients[layer]
+                    for method in gradient_methods:
+                        cams[(method, layer)] = _gradient_cam(method, activations, gradients)
+                if SCORE_METHOD in methods:
+                    cams[(SCORE_METHOD, layer)] = _score_cam(self.model, img_batch, activations, class_target, score_chunk)
+        finally:
+            # Free the graph tensors and the parameter gradients
+            self._clear()
+            self.model.zero_grad(set_to_none=True)
+            for attribute in ("activations", "grads"):
+                if hasattr(self.model, attribute):
+                    setattr(self.model, attribute, None)
+
+        heatmaps = {key: _normalize_resize(cam, output_size).cpu().numpy() for key, cam in cams.items()}
+        return heatmaps, class_pred.detach().cpu().numpy()
+
+
+# Score of the explained class (binary: the single logit towards the target side)
+def _target_scores(logits, class_target):
+    if logits.shape[1] == 1:
+        return torch.where(class_target == 1, logits[:, 0], -logits[:, 0])
+    return logits.gather(1, class_target.unsqueeze(1)).squeeze(1)
+
+
+# Grad-CAM, Grad-CAM++ and LayerCAM maps (N, h, w) from the captured activations and gradients (N, C, h, w)
+def _gradient_cam(method: str, activations, gradients):
+    if method == "gradcam":
+        weights = gradients.mean(dim=(2, 3))
+        return nn.functional.relu(torch.einsum("nchw,nc->nhw", activations, weights))
+    if method == "gradcam++":
+        # Closed-form pixel weights with the exponential-score approximation (higher derivatives are powers of the gradient)
+        gradients_2 = gradients.pow(2)
+        gradients_3 = gradients_2 * gradients
+        activation_sums = activations.sum(dim=(2, 3), keepdim=True)
+        alpha = gradients_2 / (2 * gradients_2 + activation_sums * gradients_3 + EPSILON)
+        alpha = torch.where(gradients != 0, alpha, torch.zeros_like(alpha))
+        weights = (alpha * nn.functional.relu(gradients)).sum(dim=(2, 3))
+        return nn.functional.relu(torch.einsum("nchw,nc->nhw", activations, weights))
+    # LayerCAM: element-wise positive gradients as weights
+    return nn.functional.relu((nn.functional.relu(gradients) * activations).sum(dim=1))
+
+
+# Score-CAM: every activation channel, upsampled and min-max normalized, masks the input; the class scores weight the channels
+def _score_cam(model, img_batch, activations, class_target, chunk_size: int):
+    n_images, n_channels = activations.shape[:2]
+    height, width = img_batch.shape[2:]
+    cams = []
+    with torch.inference_mode():
+        masks = nn.functional.interpolate(activations, size=(height, width), mode="bilinear", align_corners=False)
+        low = masks.amin(dim=(2, 3), keepdim=True)
+        high = masks.amax(dim=(2, 3), keepdim=True)
+        masks = torch.where(high > low, (masks - low) / (high - low + EPSILON), torch.zeros_like(masks))
+
+        for n in range(n_images):
+            scores = []
+            for start in range(0, n_channels, chunk_size):
+                # (chunk, 1, H, W) masked copies of image n
+                masked = img_batch[n:n + 1].detach() * masks[n, start:start + chunk_size, None]
+                probabilities = _class_probabilities(model(masked))
+                scores.append(probabilities[:, int(class_target[n])])
+            weights = torch.softmax(torch.cat(scores), dim=0)
+            cams.append(nn.functional.relu(torch.einsum("chw,c->hw", activations[n], weights)))
+    return torch.stack(cams)
+
+
+# Per-map normalization to [0, 1] and batched resize to (width, height)
+def _normalize_resize(cam, output_size: Optional[tuple[int, int]]):
+    cam = cam.detach().float()
+    if output_size is not None:
+        cam = nn.functional.interpolate(cam[:, None], size=(output_size[1], output_size[0]), mode="bilinear", align_corners=False)[:, 0]
+    cam_max = cam.amax(dim=(1, 2), keepdim=True)
+    return torch.where(cam_max > 0, cam / cam_max, cam)
+
+
+# CAMs of a batch in one call (hooks removed afterwards)
+def compute_cams(img_batch, model, methods: Iterable[str] = GRADIENT_METHODS, layers: Optional[Sequence[str]] = None, **kwargs):
+    with CAMEngine(model, layers) as engine:
+        return engine.compute(img_batch, methods=methods, **kwargs)
+
+
+# Plot the maps of one image: one row per layer, one column per method
+def plot_cam_grid(img_display, heatmaps: dict[tuple[str, str], numpy.ndarray], index: int = 0):
+    methods = list(dict.fromkeys(method for method, _ in heatmaps))
+    layers = list(dict.fromkeys(layer for _, layer in heatmaps))
+    fig, axs = plt.subplots(nrows=len(layers), ncols=len(methods) + 1, figsize=FIGSIZE, dpi=DPI, squeeze=False)
+
+    for row, layer in enumerate(layers):
+        axs[row, 0].imshow(img_display, cmap='gray')
+        axs[row, 0].set_title(layer, fontsize='small')
+        axs[row, 0].axis('off')
+        for col, method in enumerate(methods, start=1):
+            axs[row, col].imshow(img_display, cmap='gray')
+            if (method, layer) in heatmaps:
+                axs[row, col].imshow(heatmaps[(method, layer)][index], cmap='jet', alpha=0.5)
+            axs[row, col].set_title(method, fontsize='small')
+            axs[row, col].axis('off')
+
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,228 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Literal, Optional
+
+import numpy
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+
+# Settings
+SAMPLE_SIZE = 100_000     # pixels used to fit the centroids (None: all pixels)
+RANDOM_SEED = 0
+N_INIT = 10
+MINIBATCH_SIZE = 4096
+N_STRATA = 16             # intensity bins for stratified sampling
+CACHE_ENTRIES = 16        # clustering results kept in memory (least recently used evicted first)
+CACHE_BYTES = 1 << 30     # and at most this many bytes of labels (full-resolution label arrays are large)
+K_SWEEP = range(2, 11)
+SILHOUETTE_SAMPLE = 5000  # silhouette is O(n^2): scored on a subsample of the fitting sample
+
+
+class ClusteringEngine:
+    """
+    KMeans clustering of per-pixel features, fitted on a pixel subsample and applied to every pixel.
+
+    The features are converted once to a contiguous float32 (N, F) array and the subsample is drawn once,
+    so clustering the same image again with another `n_clusters` only pays for the fit and one vectorized
+    predict. Fitted models and labels are cached per `n_clusters`; results are reproducible for a given seed.
+
+    Args:
+        features (np.ndarray): (N, F) standardized features (e.g. from `image_a.standardize_image`), or an (H, W, F) stack.
+        sample_size (int | None): Pixels used to fit the centroids. None fits on all pixels.
+        sampling (str): "random", or "stratified" to draw proportionally from N_STRATA quantile bins of the
+            first feature (keeps rare dark/bright structures represented in small samples).
+        method (str): "kmeans" (KMeans with N_INIT restarts) or "minibatch" (MiniBatchKMeans).
+        seed (int): Random seed for the subsample and the centroid initialization.
+    """
+    def __init__(self, features, sample_size: Optional[int] = SAMPLE_SIZE,
+                 sampling: Literal["random", "stratified"] = "random",
+                 method: Literal["kmeans", "minibatch"] = "kmeans", seed: int = RANDOM_SEED):
+        features = numpy.asarray(features)
+        if features.ndim == 3:
+            features = features.reshape(-1, features.shape[2])
+        elif features.ndim == 1:
+            features = features.reshape(-1, 1)
+        self.features = numpy.ascontiguousarray(features, dtype=numpy.float32)
+        self.sample_size = sample_size
+        self.sampling = sampling
+        self.method = method
+        self.seed = seed
+        self.models: dict[int, KMeans | MiniBatchKMeans] = dict()
+        self._labels: dict[int, numpy.ndarray] = dict()
+        self._sample: Optional[numpy.ndarray] = None
+        # Serializes fits when a k-sweep and a single clustering run in parallel threads
+        self._lock = threading.RLock()
+
+    @property
+    def settings(self) -> tuple:
+        """Settings that change the fitted model (part of every cache key)."""
+        return (self.sample_size, self.sampling, self.method, self.seed)
+
+    @property
+    def sample(self) -> numpy.ndarray:
+        """Features of the fitting subsample (drawn once)."""
+        if self._sample is None:
+            n_pixels = self.features.shape[0]
+            if self.sample_size is None or self.sample_size >= n_pixels:
+                self._sample = self.features
+            else:
+                rng = numpy.random.default_rng(self.seed)
+                if self.sampling == "stratified":
+                    indices = self._stratified_indices(rng)
+                else:
+                    indices = rng.choice(n_pixels, size=self.sample_size, replace=False)
+                self._sample = self.features[numpy.sort(indices)]
+        return self._sample
+
+    def _stratified_indices(self, rng) -> numpy.ndarray:
+        # Quantile bins of the first feature, each sampled in proportion to its size (at least one pixel)
+        values = self.features[:, 0]
+        edges = numpy.quantile(values, numpy.linspace(0, 1, N_STRATA + 1)[1:-1])
+        strata = numpy.searchsorted(edges, values, side="right")
+        order = numpy.argsort(strata, kind="stable")
+        counts = numpy.bincount(strata, minlength=N_STRATA)
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+
+        indices = []
+        for start, count in zip(starts, counts):
+            if count == 0:
+                continue
+            n_draw = min(count, max(1, round(self.sample_size * count / values.shape[0]))) # type: ignore
+            indices.append(order[start + rng.choice(count, size=n_draw, replace=False)])
+        return numpy.concatenate(indices)
+
+    def fit(self, n_clusters: int):
+        """Fits (or returns the cached) model for `n_clusters` on the subsample."""
+        with self._lock:
+            return self._fit(n_clusters)
+
+    def _fit(self, n_clusters: int):
+        if n_clusters not in self.models:
+            if self.method == "minibatch":
+                model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=MINIBATCH_SIZE, n_init=3, random_state=self.seed)
+            else:
+                model = KMeans(n_clusters=n_clusters, n_init=N_INIT, random_state=self.seed)
+            model.fit(self.sample)
+            self.models[n_clusters] = model
+        return self.models[n_clusters]
+
+    def labels(self, n_clusters: int, keep: bool = True) -> numpy.ndarray:
+        """
+        Cluster index of every pixel (flat uint8 array, int32 above 255 clusters), predicted in one vectorized pass.
+        With `keep=False` the labels are not stored in the engine (the caller keeps them, e.g. in a ClusterCache).
+        """
+        with self._lock:
+            if n_clusters in self._labels:
+                return self._labels[n_clusters]
+            model = self._fit(n_clusters)
+            if self._sample is self.features:
+                labels = model.labels_
+            else:
+                labels = model.predict(self.features)
+            labels = labels.astype(numpy.uint8 if n_clusters <= 255 else numpy.int32)
+            if keep:
+                self._labels[n_clusters] = labels
+            return labels
+
+    def result(self, n_clusters: int, keep: bool = True) -> "ClusterResult":
+        """Labels of every pixel together with per-cluster statistics."""
+        labels = self.labels(n_clusters, keep=keep)
+        return ClusterResult(labels, n_clusters, inertia=float(self.fit(n_clusters).inertia_))
+
+
+class ClusterResult:
+    """
+    Clustering of one image for one `n_clusters`: pixel labels, pixel counts and area percentages per cluster.
+
+    Percentages are computed once, so inspecting a target cluster is a lookup; masks are built on first use.
+    `inertia` is the KMeans inertia on the fitting sample.
+    """
+    def __init__(self, labels: numpy.ndarray, n_clusters: int, inertia: Optional[float] = None):
+        self.labels = labels
+        self.n_clusters = n_clusters
+        self.inertia = inertia
+        self.counts = numpy.bincount(labels, minlength=n_clusters)
+        self.percentages = [round(100 * int(count) / labels.size, 2) for count in self.counts]
+        self._masks: dict[int, numpy.ndarray] = dict()
+
+    def mask(self, target: int) -> numpy.ndarray:
+        """Flat boolean mask of the pixels in cluster `target`."""
+        if target not in self._masks:
+            self._masks[target] = self.labels == target
+        return self._masks[target]
+
+
+def image_hash(image: numpy.ndarray) -> str:
+    """Content hash of an image array (shape, dtype and pixels)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}|{image.dtype}".encode())
+    digest.update(numpy.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class ClusterCache:
+    """
+    Thread-safe LRU cache of ClusterResult objects keyed by (image hash, n_clusters, feature set, *engine settings).
+
+    Bounded by the number of entries and by the bytes of their label arrays (the most recent entry is always kept).
+    """
+    def __init__(self, max_entries: int = CACHE_ENTRIES, max_bytes: int = CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._results: OrderedDict[Hashable, ClusterResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[ClusterResult]:
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, key: Hashable, result: ClusterResult):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > 1 and (len(self._results) > self.max_entries or self.nbytes > self.max_bytes):
+                self._results.popitem(last=False)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(result.labels.nbytes for result in self._results.values())
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], ClusterResult]) -> ClusterResult:
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+
+CLUSTER_CACHE = ClusterCache()
+
+
+def k_sweep(engine: ClusteringEngine, ks=K_SWEEP) -> dict[str, list]:
+    """
+    Fits the engine for every k in `ks`, returning the inertia and silhouette curves used to choose k.
+
+    Only the fitting sample is used: the inertia is the one of the fitted model and the silhouette is scored
+    on a subsample of it, so no k labels the whole image. Full labels are computed when a k is selected.
+
+    Returns:
+        dict: {"k": [...], "inertia": [...], "silhouette": [...]}
+    """
+    sample = engine.sample
+    rng = numpy.random.default_rng(engine.seed)
+    scored = rng.choice(sample.shape[0], size=min(SILHOUETTE_SAMPLE, sample.shape[0]), replace=False)
+
+    sweep: dict[str, list] = {"k": [], "inertia": [], "silhouette": []}
+    for k in ks:
+        model = engine.fit(k)
+        labels = model.labels_[scored]
+        silhouette = float(silhouette_score(sample[scored], labels)) if len(numpy.unique(labels)) > 1 else float("nan")
+        sweep["k"].append(k)
+        sweep["inertia"].append(float(model.inertia_))
+        sweep["silhouette"].append(silhouette)
+    return sweep
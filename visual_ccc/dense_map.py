@@ -0,0 +1,280 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy
+import torch
+from torch import nn
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
+from PIL import Image
+
+from visual_ccc import gradcam
+from visual_ccc.image_a import preview_image
+from visual_ccc.image_source import open_image
+
+
+# Settings
+WINDOW_SIZE = gradcam.SIZE_REQUIREMENT   # pixels pooled by the classifier head (the training input size)
+WINDOW_STRIDE = 64                       # pixels between neighbouring windows (multiple of the feature stride)
+TILE_SIZE = 512                          # pixels per tile side (bounds the memory of the feature extractor)
+TILE_HALO = 32                           # overlap around every tile, at least the receptive-field radius of the features
+CLASS_CMAP = "tab10"
+FIGSIZE = (8, 4)
+DPI = 150
+DEFAULT_OUTPUT_DIR = "visual_ccc_results"
+
+
+class DenseClassMap:
+    """
+    Class probabilities of every classifier window of an image.
+
+    Window (i, j) covers the pixels [i*stride, i*stride + window) x [j*stride, j*stride + window) of the
+    (rescaled) image; `stride` and `window` are given in pixels of the original image.
+
+    Args:
+        probabilities (np.ndarray): (n_classes, rows, cols) probabilities (binary models: class 0 and class 1).
+        class_map (dict[str, int]): Class name to index.
+        stride (float): Pixels between window origins.
+        window (float): Window size in pixels.
+        image_shape (tuple[int, int]): (height, width) of the original image.
+    """
+    def __init__(self, probabilities: numpy.ndarray, class_map: dict[str, int], stride: float, window: float, image_shape: tuple[int, int]):
+        self.probabilities = probabilities
+        self.class_map = class_map
+        self.stride = stride
+        self.window = window
+        self.image_shape = image_shape
+
+    @property
+    def labels(self) -> numpy.ndarray:
+        """Most probable class of every window, (rows, cols)."""
+        return self.probabilities.argmax(axis=0)
+
+    @property
+    def confidence(self) -> numpy.ndarray:
+        """Probability of the most probable class of every window, (rows, cols)."""
+        return self.probabilities.max(axis=0)
+
+    @property
+    def extent(self) -> tuple[float, float, float, float]:
+        """Matplotlib `imshow` extent that centres every window cell on the centre of its window."""
+        rows, cols = self.probabilities.shape[1:]
+        offset = (self.window - self.stride) / 2
+        return (offset, offset + cols * self.stride, offset + rows * self.stride, offset)
+
+    def class_fractions(self) -> dict[str, float]:
+        """Percentage of windows assigned to each class."""
+        counts = numpy.bincount(self.labels.ravel(), minlength=self.probabilities.shape[0])
+        index_to_str = {v: k for k, v in self.class_map.items()}
+        return {index_to_str.get(i, f"Class {i}"): round(100 * int(c) / self.labels.size, 2) for i, c in enumerate(counts)}
+
+
+# Total stride (pixels per feature cell) of a feature extractor: product of the conv and pooling strides
+def feature_stride(features: nn.Module) -> int:
+    stride = 1
+    for module in features.modules():
+        if isinstance(module, (nn.Conv2d, nn.MaxPool2d, nn.AvgPool2d)):
+            module_stride = module.stride if isinstance(module.stride, int) else module.stride[0]
+            stride *= module_stride
+    return stride
+
+
+# Head logits (without bias) of every feature cell, computed tile by tile
+def cell_logits(gray: torch.Tensor, model, tile_size: int = TILE_SIZE, halo: int = TILE_HALO) -> torch.Tensor:
+    """
+    Applies the GAP + Linear head of a `VisualCNN` as a 1x1 convolution over the feature map of a whole image.
+
+    The image is split into tiles of `tile_size` pixels, each read with `halo` extra pixels on every side;
+    tile origins are multiples of the feature stride, so pooling stays aligned, and the halo cells are dropped
+    after the forward pass. With a halo of at least the receptive-field radius the stitched map equals the
+    feature map of the full image, while only one tile of activations is alive at a time. Each tile keeps
+    only the n_classes head channels (instead of the 256 feature channels).
+
+    Args:
+        gray (torch.Tensor): (H, W) grayscale image in [0, 1] on the model device.
+        model: `VisualCNN` (or any model accepted by `gradcam.supports_cam`) in eval mode.
+        tile_size (int): Tile side in pixels (rounded down to a multiple of the feature stride).
+        halo (int): Overlap in pixels (rounded up to a multiple of the feature stride).
+
+    Returns:
+        torch.Tensor: (n_outputs, H // stride, W // stride) logits minus the classifier bias.
+    """
+    stride = feature_stride(model.features)
+    tile_size = max(stride, tile_size // stride * stride)
+    halo = -(-halo // stride) * stride
+    height, width = gray.shape
+    rows, cols = height // stride, width // stride
+    weight = model.classifier.weight
+
+    logits = torch.zeros((weight.shape[0], rows, cols), dtype=weight.dtype, device=gray.device)
+    with torch.inference_mode():
+        for top in range(0, rows * stride, tile_size):
+            for left in range(0, cols * stride, tile_size):
+                # Tile with halo, clipped to the image (the image border is zero-padded exactly like the full image)
+                y0, x0 = max(0, top - halo), max(0, left - halo)
+                y1, x1 = min(height, top + tile_size + halo), min(width, left + tile_size + halo)
+                features = model.features(gray[y0:y1, x0:x1][None, None])
+                tile_logits = torch.einsum("nchw,kc->nkhw", features, weight)[0]
+
+                # Keep the cells of the tile proper
+                row0, col0 = (top - y0) // stride, (left - x0) // stride
+                n_rows = min(tile_size // stride, rows - top // stride)
+                n_cols = min(tile_size // stride, cols - left // stride)
+                logits[:, top // stride:top // stride + n_rows, left // stride:left // stride + n_cols] = \
+                    tile_logits[:, row0:row0 + n_rows, col0:col0 + n_cols]
+    return logits
+
+
+# Dense class-probability map of a whole image: one feature pass, every classifier window pooled from it
+def dense_class_map(image: numpy.ndarray, model, class_map: dict[str, int],
+                    window: int = WINDOW_SIZE, window_stride: int = WINDOW_STRIDE, scale: float = 1.0,
+                    tile_size: int = TILE_SIZE, halo: int = TILE_HALO) -> DenseClassMap:
+    """
+    Classifies every `window` x `window` region of an image, sliding by `window_stride`.
+
+    Because the head is global average pooling followed by one linear layer, the logits of a window are the
+    mean of the per-cell head logits (`cell_logits`) over the window plus the bias: all windows come from one
+    average pooling of the cell map instead of one forward pass per patch. The windows see their real
+    surroundings instead of zero padding, so they can differ slightly from classifying each crop on its own.
+
+    Args:
+        image (np.ndarray): RGB (H, W, 3) or grayscale (H, W) uint8 image, at native resolution.
+        model: `VisualCNN` in eval mode.
+        class_map (dict[str, int]): Class name to index.
+        window (int): Window size in pixels of the rescaled image (the classifier input size by default).
+        window_stride (int): Pixels between windows (rounded to a multiple of the feature stride).
+        scale (float): Resize factor applied to the image first (e.g. to match the magnification of the training images).
+        tile_size (int): Tile side in pixels for the feature extractor.
+        halo (int): Tile overlap in pixels.
+
+    Returns:
+        DenseClassMap: Probabilities of shape (n_classes, rows, cols).
+    """
+    if not gradcam.supports_cam(model):
+        raise ValueError("Dense maps need a model ending in global average pooling and one Linear layer (VisualCNN).")
+    device = gradcam._model_device(model)
+
+    # Grayscale like transforms.Grayscale (PIL "L"), then ToTensor scaling
+    gray_pil = Image.fromarray(image).convert("L")
+    if scale != 1.0:
+        gray_pil = gray_pil.resize((max(1, round(gray_pil.width * scale)), max(1, round(gray_pil.height * scale))), Image.BILINEAR) # type: ignore
+    gray = torch.from_numpy(numpy.asarray(gray_pil, dtype=numpy.float32) / 255).to(device)
+
+    stride = feature_stride(model.features)
+    logits = cell_logits(gray, model, tile_size=tile_size, halo=halo)
+    if logits.shape[1] == 0 or logits.shape[2] == 0:
+        raise ValueError(f"Image is smaller than the feature stride ({stride} px).")
+
+    # Windows: average pooling of the cell logits (windows larger than the image shrink to the whole image)
+    kernel = (min(max(1, window // stride), logits.shape[1]), min(max(1, window // stride), logits.shape[2]))
+    step = max(1, round(window_stride / stride))
+    with torch.inference_mode():
+        window_logits = nn.functional.avg_pool2d(logits[None], kernel_size=kernel, stride=step)[0]
+        window_logits = window_logits + model.classifier.bias[:, None, None]
+        probabilities = gradcam._class_probabilities(window_logits.flatten(1).T).T.reshape(-1, *window_logits.shape[1:])
+
+    return DenseClassMap(probabilities=probabilities.float().cpu().numpy(),
+                         class_map=class_map,
+                         stride=step * stride / scale,
+                         window=kernel[0] * stride / scale,
+                         image_shape=(image.shape[0], image.shape[1]))
+
+
+# Plot the image and its class map (colour: most probable class, opacity: its probability)
+def plot_dense_map(image: numpy.ndarray, dense_map: DenseClassMap, alpha: float = 0.6):
+    fig, axs = plt.subplots(nrows=1, ncols=2, figsize=FIGSIZE, dpi=DPI)
+    height, width = dense_map.image_shape
+    preview = preview_image(numpy.asarray(Image.fromarray(image).convert("L")))
+
+    # Original image
+    axs[0].imshow(preview, cmap='gray', extent=(0, width, height, 0))
+    axs[0].title.set_text("Input Image")
+    axs[0].axis('off')
+
+    # Class map over the image
+    cmap = plt.get_cmap(CLASS_CMAP)
+    overlay = cmap(dense_map.labels % cmap.N)
+    overlay[..., 3] = alpha * dense_map.confidence
+    axs[1].imshow(preview, cmap='gray', extent=(0, width, height, 0))
+    axs[1].imshow(overlay, extent=dense_map.extent, interpolation="nearest")
+    axs[1].set_xlim(0, width)
+    axs[1].set_ylim(height, 0)
+    axs[1].title.set_text("Class Map")
+    axs[1].axis('off')
+
+    fractions = dense_map.class_fractions()
+    index_to_str = {v: k for k, v in dense_map.class_map.items()}
+    handles = [mpatches.Patch(color=cmap(i % cmap.N), label=f"{name} ({fractions[name]}%)")
+               for i, name in ((i, index_to_str.get(i, f"Class {i}")) for i in range(dense_map.probabilities.shape[0]))]
+    axs[1].legend(handles=handles, loc='upper right', fontsize='small')
+
+    fig.tight_layout()
+    return fig
+
+
+# Dense class map of one image file, saved as .npy probabilities and a .png figure
+def run_dense(image_path: Path,
+              output_dir: Optional[Path] = None,
+              classes: Literal["2-class", "3-class"] = "3-class",
+              window: int = WINDOW_SIZE,
+              window_stride: int = WINDOW_STRIDE,
+              scale: float = 1.0,
+              tile_size: int = TILE_SIZE,
+              device: Optional[str] = None) -> Path:
+    image_path = Path(image_path)
+    source = open_image(image_path)
+    if source is None:
+        raise IOError(f"'{image_path}' is not a readable image.")
+    output_dir = Path(output_dir) if output_dir is not None else image_path.parent / DEFAULT_OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    torch_device = torch.device(device) if device else torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model, class_map = gradcam.create_model(classes=classes, model_type="visualcnn")
+    model.to(torch_device)
+    model.eval()
+    if class_map is None or not isinstance(class_map, dict):
+        class_map = {str(i): i for i in range(3 if classes == "3-class" else 2)}
+
+    start_time = time.perf_counter()
+    image = source.rgb()
+    dense_map = dense_class_map(image, model, class_map, window=window, window_stride=window_stride, scale=scale, tile_size=tile_size)
+    rows, cols = dense_map.probabilities.shape[1:]
+    print(f"Classified {rows * cols} windows of '{image_path.name}' ({image.shape[1]}x{image.shape[0]}) in {time.perf_counter() - start_time:.1f} s.")
+    for name, fraction in dense_map.class_fractions().items():
+        print(f"    {name}: {fraction}%")
+
+    map_path = output_dir / f"{image_path.stem}_dense.npy"
+    numpy.save(map_path, dense_map.probabilities)
+    fig = plot_dense_map(image, dense_map)
+    fig.savefig(output_dir / f"{image_path.stem}_dense.png")
+    plt.close(fig)
+    print(f"Class map saved to '{map_path}'.")
+    return map_path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="visual_ccc dense",
+                                     description="Dense class-probability map of a whole image with the fully-convolutional VisualCNN.")
+    parser.add_argument("image", type=Path, help="Image file (native resolution).")
+    parser.add_argument("-o", "--output-dir", type=Path, default=None, help=f"Results directory (default: <image dir>/{DEFAULT_OUTPUT_DIR}).")
+    parser.add_argument("--classes", choices=["2-class", "3-class"], default="3-class")
+    parser.add_argument("--window", type=int, default=WINDOW_SIZE, help="Classifier window in pixels.")
+    parser.add_argument("--stride", type=int, default=WINDOW_STRIDE, help="Pixels between windows.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Resize factor applied to the image first.")
+    parser.add_argument("--tile", type=int, default=TILE_SIZE, help="Tile size in pixels (bounds memory).")
+    parser.add_argument("--device", default=None, help="Torch device (default: cuda if available, else cpu).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_dense(image_path=args.image,
+              output_dir=args.output_dir,
+              classes=args.classes,
+              window=args.window,
+              window_stride=args.stride,
+              scale=args.scale,
+              tile_size=args.tile,
+              device=args.device)
@@ -34,6 +34,39 @@ def custom_alexnet(classes: Literal["2-class", "3-class"]):
     return alexnet
 
 
+# Wrapper for AlexNet (External Hook)
+class AlexnetHook(nn.Module):
+    def __init__(self, base_model):
+        super().__init__()
+        self.cnn = base_model.features[:12]
+        self.lastpool = nn.Sequential(base_model.features[12], base_model.avgpool)
+        self.ann = base_model.classifier
+        self.grads = None
+        self.activations = None
+
+    def activations_hook(self, grad):
+        self.grads = grad
+
+    def forward(self, x):
+        x = self.cnn(x)
+        if x.requires_grad:
+            x.register_hook(self.activations_hook)
+            self.activations = x
+        x = self.lastpool(x)
+        x = torch.flatten(x, 1)
+        x = self.ann(x)
+        return x
+
+    def get_grads(self):
+        return self.grads
+
+    def get_activations(self, x):
+        return self.cnn(x)
+
+    def get_forward_activations(self):
+        return self.activations
+
+
 # Load image PIL
 def read_image_pil(path):
     # Validation
@@ -49,9 +82,8 @@ def read_image_pil(path):
     return original_img, filename
 
 
-# Transform Input Image, return image_model and image_display
-def transform_image(img):
-    # Transformations
+# Transformations for the model input (grayscale tensor) and for display
+def get_transforms():
     transform_model = transforms.Compose([
         transforms.Resize(size=int(1.2*SIZE_REQUIREMENT)),
         transforms.CenterCrop(size=SIZE_REQUIREMENT),
@@ -65,6 +97,14 @@ def transform_image(img):
         transforms.ToTensor(),
     ])
     
+    return transform_model, transform_display
+
+
+# Transform Input Image, return image_model and image_display
+def transform_image(img):
+    # Transformations
+    transform_model, transform_display = get_transforms()
+    
     # Transform image for the model
     img_model = transform_model(img).unsqueeze(0)
     dataset = data.TensorDataset(img_model, torch.zeros(size=(1,1)))
@@ -101,33 +141,7 @@ def create_model(classes: Literal["2-class", "3-class"], model_type: Literal["al
             print(f"Could not load weights for AlexNet ({classes}).")
             raise e
 
-        # Define Wrapper for AlexNet (External Hook)
-        class AlexnetHook(nn.Module):
-            def __init__(self):
-                super().__init__()
-                self.cnn = base_model.features[:12]
-                self.lastpool = nn.Sequential(base_model.features[12], base_model.avgpool)
-                self.ann = base_model.classifier
-                self.grads = None
-
-            def activations_hook(self, grad):
-                self.grads = grad
-
-            def forward(self, x):
-                x = self.cnn(x)
-                x.register_hook(self.activations_hook)
-                x = self.lastpool(x)
-                x = x.view(1,-1)
-                x = self.ann(x)
-                return x
-
-            def get_grads(self):
-                return self.grads
-
-            def get_activations(self, x):
-                return self.cnn(x)
-        
-        return AlexnetHook(), class_map
+        return AlexnetHook(base_model), class_map
 
     elif model_type == "visualcnn":
         # Instantiate VisualCNN (Native Support)
@@ -151,88 +165,241 @@ def create_model(classes: Literal["2-class", "3-class"], model_type: Literal["al
         raise ValueError(f"Unknown model_type: {model_type}")
 
 
-# Get gradients and activations
+# Predicted class indices from a batch of logits (binary: single logit, positive means class 1)
+def _predict_classes(logits):
+    if logits.shape[1] == 1:
+        return (logits[:, 0] > 0).long()
+    return logits.argmax(dim=1)
+
+
+# Class probabilities (N, n_classes) from a batch of logits (binary: sigmoid of the single logit, as [class 0, class 1])
+def _class_probabilities(logits):
+    if logits.shape[1] == 1:
+        positive = torch.sigmoid(logits[:, 0])
+        return torch.stack((1 - positive, positive), dim=1)
+    return torch.softmax(logits, dim=1)
+
+
+# Grad-CAM core: one forward + one backward pass, reusing the activations captured during forward
+def gradcam_core(img_model, model, class_index: Optional[int] = None):
+    """
+    Computes the Grad-CAM map (before ReLU) of a batch, for the predicted class or for `class_index`.
+
+    The activations of the last convolutional layer are the ones captured by the model hook in `forward`,
+    so the feature extractor runs only once. Channel weighting and channel mean are a single reduction,
+    and the channel count comes from the activations themselves.
+
+    Returns:
+        (torch.Tensor, torch.Tensor): Maps of shape (N, h, w) and predicted class indices of shape (N,).
+    """
+    logits = model(img_model)
+    class_pred = _predict_classes(logits)
+    class_target = class_pred if class_index is None else torch.full_like(class_pred, class_index)
+    
+    if logits.shape[1] == 1:
+        # Binary: backpropagate the score towards the target side ("more negative" or "more positive")
+        targets = torch.where(class_target == 1, logits[:, 0], -logits[:, 0])
+    else:
+        # Multi-class: backpropagate the score of the target class
+        targets = logits.gather(1, class_target.unsqueeze(1)).squeeze(1)
+    
+    # Samples do not interact in eval mode, so the summed target gives per-sample gradients
+    targets.sum().backward()
+    
+    # Activations [N, C, h, w] from forward, gradients pooled to per-sample channel weights [N, C]
+    activations = model.get_forward_activations().detach()
+    average_gradients = torch.mean(model.get_grads(), dim=[2, 3])
+    
+    # Weight the channels and average them in one reduction
+    cam = torch.einsum("nchw,nc->nhw", activations, average_gradients) / activations.shape[1]
+    
+    # Free parameter gradients and the stored graph tensor
+    model.zero_grad(set_to_none=True)
+    model.activations = None
+    
+    return cam, class_pred
+
+
+# Models ending in features -> global average pooling -> single Linear layer (VisualCNN)
+def supports_cam(model) -> bool:
+    gap = getattr(model, "gap", None)
+    return (isinstance(getattr(model, "features", None), nn.Module)
+            and isinstance(gap, nn.AdaptiveAvgPool2d) and gap.output_size in (1, (1, 1))
+            and isinstance(getattr(model, "classifier", None), nn.Linear))
+
+
+# Backward-free CAM core for GAP + Linear models: the class maps are the classifier weights dotted with the features
+def cam_core(img_model, model):
+    """
+    Computes the class activation maps of every class for a batch, with a single forward pass.
+
+    With global average pooling followed by one linear layer, the gradient of class score k with respect
+    to the final features is the constant w_k / (h*w), so Grad-CAM reduces to the classifier weights dotted
+    with the feature maps and needs no backward pass. Everything runs under `torch.inference_mode`, and
+    the maps use the Grad-CAM scale of `gradcam_core` (identical maps for the predicted class).
+    Binary models (single logit) get two maps: class 0 ("more negative") and class 1 ("more positive").
+
+    Returns:
+        (torch.Tensor, torch.Tensor): Maps of shape (N, n_classes, h, w) and predicted class indices of shape (N,).
+    """
+    with torch.inference_mode():
+        features = model.features(img_model)
+        logits = model.classifier(torch.flatten(model.gap(features), 1))
+        n_channels, height, width = features.shape[1:]
+        weights = model.classifier.weight / (n_channels * height * width)
+        if weights.shape[0] == 1:
+            weights = torch.cat((-weights, weights))
+        cams = torch.einsum("nchw,kc->nkhw", features, weights)
+    return cams, _predict_classes(logits)
+
+
+# Predicted-class map: backward-free CAM when the architecture allows it, Grad-CAM otherwise (AlexnetHook)
+def heatmap_core(img_model, model):
+    if supports_cam(model):
+        cams, class_pred = cam_core(img_model, model)
+        return cams[torch.arange(cams.shape[0], device=cams.device), class_pred], class_pred
+    return gradcam_core(img_model, model)
+
+
+# Get the Grad-CAM map [1, h, w] and the prediction of a single image (binary model)
 def get_gradients(img_model, model, class_map):
     index_to_str = {v:k for k,v in class_map.items()}
     
-    # model.eval()
-    logits = model(img_model)
+    cam, class_pred = heatmap_core(img_model, model)
+    class_index = int(class_pred[0].item())
+    prediction = index_to_str.get(class_index, f"Class {class_index}")
+        
+    return cam, prediction
+
+
+# Get the Grad-CAM map [1, h, w] and the prediction of a single image (multi-class model)
+def get_gradients_multiclass(img_model, model, class_map):
+    index_to_str = {v:k for k,v in class_map.items()}
     
-    # Get the single score from the model output (shape [1, 1])
-    score = logits[0, 0]
+    cam, class_pred = heatmap_core(img_model, model)
+    prediction = index_to_str.get(int(class_pred[0].item()), "Unknown")
+        
+    return cam, prediction
+
+
+# Device of a model's weights (CPU for wrappers without parameters: quantized, frozen TorchScript, ONNX)
+def _model_device(model):
+    parameter = next(model.parameters(), None) if hasattr(model, "parameters") else None
+    return parameter.device if parameter is not None else torch.device("cpu")
+
+
+# Batched prediction only (no Grad-CAM), returns the predicted class names
+def get_predictions_batch(img_batch, model, class_map, micro_batch_size: int=32) -> list[str]:
+    index_to_str = {v:k for k,v in class_map.items()}
+    device = _model_device(model)
     
-    # Prediction
-    if score <= 0:
-        prediction = index_to_str.get(0, "Class 0")
-        # Backpropagate the negative score to see what makes it "more negative"
-        target_for_grad = -score
-    else:
-        prediction = index_to_str.get(1, "Class 1")
-        # Backpropagate the positive score to see what makes it "more positive"
-        target_for_grad = score
+    predictions: list[str] = []
+    with torch.inference_mode():
+        for start in range(0, img_batch.shape[0], micro_batch_size):
+            logits = model(img_batch[start:start + micro_batch_size].to(device))
+            predictions.extend(index_to_str.get(i, f"Class {i}") for i in _predict_classes(logits).tolist())
     
-    # Backpropagate the correct target
-    target_for_grad.backward()
+    return predictions
+
 
-    # Get gradients
-    gradients = model.get_grads()
+# Batched predicted-class heatmaps: one forward pass per micro-batch (plus one backward pass for Grad-CAM)
+def get_gradients_batch(img_batch, model, class_map, micro_batch_size: int=32, output_size: tuple[int,int]=(SIZE_REQUIREMENT, SIZE_REQUIREMENT)):
+    """
+    Computes predicted-class heatmaps for a batch of images.
 
-    # Pool the gradients across the channels
-    average_gradients = torch.mean(gradients, dim=[0, 2, 3])
+    Works for binary (single logit) and multi-class models. `VisualCNN` (GAP + Linear) uses the backward-free
+    `cam_core` under `torch.inference_mode`; `AlexnetHook` falls back to Grad-CAM, where each micro-batch runs
+    one forward pass and one backward pass on the sum of the per-sample targets (samples do not interact in
+    eval mode, so every sample receives its own gradients). Both give the same map for GAP + Linear models.
 
-    # Get activations of the last convolutional layer
-    activations_avg = model.get_activations(img_model).detach()
+    Args:
+        img_batch (torch.Tensor): Model inputs of shape (N, 1, H, W), as produced by `transform_image`.
+        model: Model in eval mode.
+        class_map (dict[str, int]): Class name to index.
+        micro_batch_size (int): Maximum number of images per pass (bounds peak memory).
+        output_size (tuple[int, int]): (width, height) of the returned heatmaps.
 
-    # weight the output channels (final layer) by the corresponding gradients
-    # Reshape grads to [1, 256, 1, 1] for broadcasting
-    average_gradients = average_gradients.unsqueeze(0).unsqueeze(-1).unsqueeze(-1)
-    # Multiply activations [1, 256, H, W] by grads [1, 256, 1, 1]
-    activations_avg *= average_gradients
+    Returns:
+        (np.ndarray, list[str]): Heatmaps of shape (N, height, width) in [0, 1], and the predicted class names.
+    """
+    index_to_str = {v:k for k,v in class_map.items()}
+    device = _model_device(model)
+    
+    heatmaps = []
+    predictions: list[str] = []
+    
+    for start in range(0, img_batch.shape[0], micro_batch_size):
+        img_model = img_batch[start:start + micro_batch_size].to(device)
+        cam, class_pred = heatmap_core(img_model, model)
         
-    return activations_avg, prediction
+        for heatmap in _normalize_heatmaps(cam).cpu().numpy():
+            heatmaps.append(_resize_heatmap(heatmap, output_size))
+        predictions.extend(index_to_str.get(i, f"Class {i}") for i in class_pred.tolist())
+    
+    return numpy.stack(heatmaps) if heatmaps else numpy.zeros((0, output_size[1], output_size[0]), dtype=numpy.float32), predictions
 
 
-def get_gradients_multiclass(img_model, model, class_map):
-    index_to_str = {v:k for k,v in class_map.items()}
+# Batched heatmaps of every class: one forward pass per micro-batch for GAP + Linear models
+def get_cams_batch(img_batch, model, class_map, micro_batch_size: int=32, output_size: tuple[int,int]=(SIZE_REQUIREMENT, SIZE_REQUIREMENT)):
+    """
+    Computes the heatmaps of all classes for a batch of images.
 
-    # model.eval()
-    # Logits will have shape [1, 3] from a 3-class model
-    logits = model(img_model)
+    `VisualCNN` gets every class map from the single inference-mode forward pass of `cam_core` (no autograd
+    graph, no hooks). Other models (`AlexnetHook`) fall back to Grad-CAM with one forward/backward pass per class.
+    Binary models return two maps, for class 0 and class 1.
+
+    Args:
+        img_batch (torch.Tensor): Model inputs of shape (N, 1, H, W), as produced by `transform_image`.
+        model: Model in eval mode.
+        class_map (dict[str, int]): Class name to index.
+        micro_batch_size (int): Maximum number of images per pass (bounds peak memory).
+        output_size (tuple[int, int]): (width, height) of the returned heatmaps.
+
+    Returns:
+        (np.ndarray, list[str]): Heatmaps of shape (N, n_classes, height, width), each in [0, 1], and the predicted class names.
+    """
+    index_to_str = {v:k for k,v in class_map.items()}
+    device = _model_device(model)
     
-    # Prediction:
-    # Find the index of the highest score
-    class_pred_tensor = logits.argmax(dim=1)
-    class_pred = class_pred_tensor.item()
+    heatmaps = []
+    predictions: list[str] = []
     
-    # Get the string name for the predicted class
-    prediction = index_to_str.get(class_pred, "Unknown")
+    for start in range(0, img_batch.shape[0], micro_batch_size):
+        img_model = img_batch[start:start + micro_batch_size].to(device)
+        if supports_cam(model):
+            cams, class_pred = cam_core(img_model, model)
+        else:
+            n_classes = max(len(class_map), 2)
+            maps = [gradcam_core(img_model, model, class_index=k) for k in range(n_classes)]
+            cams, class_pred = torch.stack([cam for cam, _ in maps], dim=1), maps[0][1]
+        
+        for sample in _normalize_heatmaps(cams).cpu().numpy():
+            heatmaps.append(numpy.stack([_resize_heatmap(heatmap, output_size) for heatmap in sample]))
+        predictions.extend(index_to_str.get(i, f"Class {i}") for i in class_pred.tolist())
     
-    # Backpropagate the score for the predicted class
-    # This tells us which pixels contributed most to *this specific class*
-    logits[:, class_pred].backward()
+    return numpy.stack(heatmaps) if heatmaps else numpy.zeros((0, max(len(class_map), 2), output_size[1], output_size[0]), dtype=numpy.float32), predictions
 
-    # Get gradients
-    gradients = model.get_grads()
 
-    # Pool the gradients across the channels
-    average_gradients = torch.mean(gradients, dim=[0, 2, 3])
+# ReLU and per-map normalization to [0, 1] over the last two dimensions
+def _normalize_heatmaps(cam):
+    heatmap_batch = nn.functional.relu(cam)
+    heatmap_max = heatmap_batch.amax(dim=(-2, -1), keepdim=True)
+    return torch.where(heatmap_max > 0, heatmap_batch / heatmap_max, heatmap_batch)
 
-    # Get activations of the last convolutional layer
-    activations_avg = model.get_activations(img_model).detach()
 
-    # weight the output channels (final layer) by the corresponding gradients
-    output_channels = SIZE_REQUIREMENT
-    for i in range(output_channels):
-        activations_avg[:, i, :, :] *= average_gradients[i]
-        
-    return activations_avg, prediction
+# Resize a 2D heatmap to (width, height)
+def _resize_heatmap(heatmap, size):
+    heatmap_resized = Image.fromarray(heatmap).resize(size, Image.BICUBIC) # type: ignore
+    return numpy.array(heatmap_resized)
 
 
 # Prepare the heatmap
 def process_heatmap(activations, img_display):
     ## Heatmap
-    # Average the channels of the activations
-    heatmap_avg = torch.mean(activations, dim=1).squeeze()
+    # Average the channels of weighted activations [1, C, h, w]; Grad-CAM maps [1, h, w] are already reduced
+    if activations.dim() == 4:
+        activations = torch.mean(activations, dim=1)
+    heatmap_avg = activations.squeeze()
 
     # Apply a Relu on the heatmap
     heatmap_avg = nn.functional.relu(heatmap_avg)
@@ -241,10 +408,7 @@ def process_heatmap(activations, img_display):
     heatmap_avg /= torch.max(heatmap_avg)
     
     # Resize heatmap to match image dimensions
-    heatmap_resized = Image.fromarray(heatmap_avg.cpu().numpy()).resize(img_display.size, Image.BICUBIC) # type: ignore
-
-    # Convert heatmap to numpy array
-    heatmap_resized_np = numpy.array(heatmap_resized)
+    heatmap_resized_np = _resize_heatmap(heatmap_avg.cpu().numpy(), img_display.size)
     
     return heatmap_resized_np
 
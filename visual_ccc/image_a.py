@@ -8,10 +8,16 @@ import matplotlib.colors as mcolors
 import matplotlib.patches as mpatches
 import os
 from joblib import Parallel, delayed
+from typing import Optional
+
+from visual_ccc.texture import glcm_contrast_map, glcm_feature_stack
+from visual_ccc.clustering import CLUSTER_CACHE, ClusterResult, ClusteringEngine, image_hash, k_sweep
 
 
 # Settings
-OUTPUT_SIZE = 512
+OUTPUT_SIZE = 512           # analysis width in pixels (None: native resolution)
+PREVIEW_SIZE = 512          # longest side of the arrays drawn in figures
+STRIP_ROWS = 256            # rows processed at a time at native resolution
 FIGSIZE_L = (10, 5)
 FIGSIZE_S = (4, 4)
 DPI = 150
@@ -37,11 +43,14 @@ def read_image_cv(path):
 
 
 # Image Analysis: Grayscale - Image segmentation - Texture
-def image_segmentation(img, threshold: int=127):
-    # Resize image
-    ratio = OUTPUT_SIZE / img.shape[1]
-    dim = (OUTPUT_SIZE, int(img.shape[0] * ratio))
-    resized = cv2.resize(img, dim, interpolation = cv2.INTER_AREA)
+def image_segmentation(img, threshold: int=127, output_size: Optional[int]=OUTPUT_SIZE):
+    # Resize image (output_size=None keeps the native resolution)
+    if output_size is None:
+        resized = img
+    else:
+        ratio = output_size / img.shape[1]
+        dim = (output_size, int(img.shape[0] * ratio))
+        resized = cv2.resize(img, dim, interpolation = cv2.INTER_AREA)
     
     # Convert the image to true grayscale
     if len(resized.shape) == 3:
@@ -78,6 +87,23 @@ def _compute_contrast_row(segmented, i, window_size, cols):
 
 # Calculate GLCM (Gray Level Co-occurrence Matrix) to get texture features
 def image_texture(segmented):
+    return glcm_contrast_map(segmented, window_size=5)
+
+
+# Full image analysis (gray, segmented, contrast) at `output_size`, or at native resolution with output_size=None.
+# Native resolution works strip-wise and keeps the contrast map in float32, so an 8k image stays in a few hundred MB.
+def image_analysis(img, output_size: Optional[int]=OUTPUT_SIZE):
+    gray, segmented = image_segmentation(img, output_size=output_size)
+    if output_size is None:
+        contrast = glcm_contrast_map(segmented, window_size=5, strip_rows=STRIP_ROWS, dtype=numpy.float32)
+    else:
+        contrast = image_texture(segmented)
+    
+    return gray, segmented, contrast
+
+
+# Reference implementation of image_texture: one graycomatrix call per pixel (slow, kept for equivalence checks)
+def image_texture_reference(segmented):
     contrast = numpy.zeros_like(segmented, dtype=float)
     window_size = 5
     ws_h = window_size // 2
@@ -98,32 +124,82 @@ def image_texture(segmented):
     return contrast
 
 
-# standardize image pixel values
-def standardize_image(gray):
-    # Standardize values in gray
+# GLCM texture feature stack (H, W, F) on the quantized grayscale image
+def image_texture_features(gray, properties=('contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM'),
+                           distances=(1,), angles=(0.0, numpy.pi/4, numpy.pi/2, 3*numpy.pi/4), levels: int=16):
+    return glcm_feature_stack(gray, properties=properties, distances=distances, angles=angles, levels=levels)
+
+
+# standardize image pixel values (gray image (H, W) or feature stack (H, W, F))
+def standardize_image(gray, strip_rows: Optional[int]=None):
+    # Native resolution: same scaling as StandardScaler, written strip by strip into a float32 array
+    if strip_rows is not None:
+        return _standardize_strips(gray, strip_rows)
+    
+    # Standardize values in gray, one column per feature
     scaler = StandardScaler()
-    gray_standardized = scaler.fit_transform(gray.reshape(-1,1))
+    gray_standardized = scaler.fit_transform(gray.reshape(gray.shape[0] * gray.shape[1], -1))
+    
+    return gray_standardized
+
+
+# Strip-wise standardization (float64 statistics, float32 output, zero variance scaled by 1 like StandardScaler)
+def _standardize_strips(gray, strip_rows: int):
+    rows, cols = gray.shape[:2]
+    values = gray.reshape(rows, cols, -1)
+    n_features = values.shape[2]
+    
+    # Mean and variance accumulated per strip
+    total = numpy.zeros(n_features)
+    total_sq = numpy.zeros(n_features)
+    for start in range(0, rows, strip_rows):
+        strip = values[start : start + strip_rows].reshape(-1, n_features).astype(numpy.float64)
+        total += strip.sum(axis=0)
+        total_sq += (strip * strip).sum(axis=0)
+    n_pixels = rows * cols
+    mean = total / n_pixels
+    std = numpy.sqrt(numpy.maximum(total_sq / n_pixels - mean * mean, 0))
+    std[std == 0] = 1.0
+    
+    gray_standardized = numpy.empty((n_pixels, n_features), dtype=numpy.float32)
+    for start in range(0, rows, strip_rows):
+        strip = values[start : start + strip_rows].reshape(-1, n_features)
+        gray_standardized[start * cols : start * cols + strip.shape[0]] = (strip - mean) / std
     
     return gray_standardized
 
 
+# Downsample a 2D array for display (nearest neighbour for labels and masks)
+def preview_image(array, size: int=PREVIEW_SIZE, nearest: bool=False):
+    rows, cols = array.shape[:2]
+    if max(rows, cols) <= size:
+        return array
+    ratio = size / max(rows, cols)
+    dim = (max(1, int(cols * ratio)), max(1, int(rows * ratio)))
+    if nearest:
+        row_index = (numpy.arange(dim[1]) * rows) // dim[1]
+        col_index = (numpy.arange(dim[0]) * cols) // dim[0]
+        return array[row_index[:, None], col_index]
+    return cv2.resize(array.astype(numpy.float32), dim, interpolation=cv2.INTER_AREA)
+
+
 # Plot gray, segmented and texture
 def plot_image_analysis(gray, segmented, contrast):
     # Figure with 3 subplots
     fig, axs = plt.subplots(1, 3, figsize=FIGSIZE_L, dpi=DPI) 
     
     # show grayscale image
-    axs[0].imshow(gray, cmap='gray')
+    axs[0].imshow(preview_image(gray), cmap='gray')
     axs[0].title.set_text('Grayscale')
     axs[0].axis('off')
     
     # show segmented image
-    axs[1].imshow(segmented, cmap='gray')
+    axs[1].imshow(preview_image(segmented), cmap='gray')
     axs[1].title.set_text('Image Segmentation')
     axs[1].axis('off')
     
     # show texture (contrast)
-    axs[2].imshow(contrast, cmap='hot')
+    axs[2].imshow(preview_image(contrast), cmap='hot')
     axs[2].title.set_text('Texture Analysis')
     axs[2].axis('off')
     
@@ -133,8 +209,40 @@ def plot_image_analysis(gray, segmented, contrast):
     return fig
 
 
-# Image clustering
-def image_clustering(gray_standardized, n_clusters: int):
+# Image clustering: centroids fitted on a pixel subsample, then every pixel labelled
+def image_clustering(gray_standardized, n_clusters: int, engine: Optional[ClusteringEngine]=None):
+    # Reusing an engine (same image) keeps its cached features, subsample and fitted models
+    if engine is None:
+        engine = ClusteringEngine(gray_standardized)
+    clusters = engine.labels(n_clusters)
+    
+    return clusters
+
+
+# Cached image clustering: labels with per-cluster counts and percentages, kept in an LRU cache keyed by
+# (image hash, n_clusters, feature set, engine settings) so that switching back to a previous image or k is immediate
+def image_clustering_cached(gray_standardized, n_clusters: int, engine: Optional[ClusteringEngine]=None,
+                            image_key: Optional[str]=None, feature_set: str="intensity") -> ClusterResult:
+    if image_key is None:
+        image_key = image_hash(gray_standardized)
+    if engine is None:
+        engine = ClusteringEngine(gray_standardized)
+    # The bounded cache holds the only copy of the labels (not the engine), so full-resolution results can be evicted
+    return CLUSTER_CACHE.get_or_compute((image_key, n_clusters, feature_set, *engine.settings), lambda: engine.result(n_clusters, keep=False))
+
+
+# Inertia and silhouette curves for k = 2..10, on the fitting sample (the fitted models are reused by later clustering requests)
+def clustering_k_sweep(gray_standardized, engine: Optional[ClusteringEngine]=None):
+    if engine is None:
+        engine = ClusteringEngine(gray_standardized)
+    return k_sweep(engine)
+
+
+# Full-data KMeans on every pixel (reference for image_clustering)
+def image_clustering_reference(gray_standardized, n_clusters: int):
+    # Accept a (H, W, F) feature stack directly: one sample per pixel
+    if gray_standardized.ndim == 3:
+        gray_standardized = gray_standardized.reshape(-1, gray_standardized.shape[2])
     kmeans = KMeans(n_clusters=n_clusters, n_init=10)
     clusters = kmeans.fit_predict(gray_standardized)
     
@@ -146,14 +254,14 @@ def plot_image_clustering(clusters, gray):
     fig = plt.figure(figsize=FIGSIZE_S, dpi=DPI)
     axs = fig.add_axes((0,0,1,1))
     axs.set_title("Clustering Result")
-    axs.imshow(clusters.reshape(gray.shape), cmap='viridis', label="Clusters")
+    axs.imshow(preview_image(clusters.reshape(gray.shape), nearest=True), cmap='viridis', label="Clusters")
     axs.set_axis_off()
     
     # Create handles and labels
     handles = []
     labels = []
     # Loop through the unique values in the clusters array
-    for i in numpy.unique(clusters):
+    for i in numpy.flatnonzero(numpy.bincount(clusters.ravel())):
         # Create a patch with the color of the cluster
         patch = mpatches.Patch(color=plt.cm.viridis(i / clusters.max())) # type: ignore
         # Append the patch and the cluster number to the lists
@@ -167,6 +275,10 @@ def plot_image_clustering(clusters, gray):
 
 # Get pixels in target cluster
 def target_cluster(clusters, gray, target):
+    # Cached result: precomputed percentage, mask built once per target
+    if isinstance(clusters, ClusterResult):
+        return clusters.mask(target).reshape(gray.shape), clusters.percentages[target]
+
     # Create a mask for the cluster
     mask = clusters == target
 
@@ -182,12 +294,33 @@ def target_cluster(clusters, gray, target):
     return mask_2d, percentage
 
 
+# Plot the k-sweep curves (inertia and silhouette score against the number of clusters)
+def plot_k_sweep(sweep):
+    fig, ax_inertia = plt.subplots(figsize=FIGSIZE_S, dpi=DPI)
+    ax_inertia.plot(sweep["k"], sweep["inertia"], marker="o", color="tab:blue")
+    ax_inertia.set_xlabel("Number of clusters")
+    ax_inertia.set_ylabel("Inertia", color="tab:blue")
+    ax_silhouette = ax_inertia.twinx()
+    ax_silhouette.plot(sweep["k"], sweep["silhouette"], marker="s", color="tab:orange")
+    ax_silhouette.set_ylabel("Silhouette", color="tab:orange")
+    ax_inertia.set_title("Choosing k")
+    fig.tight_layout()
+    
+    return fig
+
+
+# Number of clusters with the best silhouette score
+def suggested_k(sweep):
+    scores = numpy.nan_to_num(numpy.asarray(sweep["silhouette"], dtype=float), nan=-1.0)
+    return int(sweep["k"][int(numpy.argmax(scores))])
+
+
 # Plot target cluster
 def plot_target_cluster(mask_2d):
     fig = plt.figure(figsize=FIGSIZE_S, dpi=DPI)
     axs = fig.add_axes((0,0,1,1))
     axs.set_title("Target Cluster")
-    axs.imshow(mask_2d, cmap=my_cmap)
+    axs.imshow(preview_image(mask_2d, nearest=True), cmap=my_cmap)
     axs.set_axis_off()
     
     return fig
@@ -0,0 +1,201 @@
+import threading
+import warnings
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy
+from PIL import Image
+
+
+# Settings
+SUPPORTED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.ppm', '.pgm', '.pbm', '.pfm', '.npy']
+TIFF_EXTENSIONS = ['.tif', '.tiff']
+# PIL modes kept as decoded, everything else (palette, CMYK, LA, ...) is converted to RGB
+NATIVE_PIL_MODES = {"L", "RGB", "RGBA", "I;16", "I;16L", "I;16B", "I", "F"}
+
+
+class ImageSource:
+    """
+    One image (or one frame of a stack) decoded once and shared by every analysis path.
+
+    The pixels are read on first access and kept in a single buffer: `array` holds the native values
+    (e.g. uint16 for 16-bit TIFF), `rgb()` the 8-bit RGB version, and `bgr()` and `tensor()` are views
+    of that same RGB buffer. For 8-bit RGB images the native and RGB buffers are one array. PIL cannot
+    wrap 3-channel buffers, so `pil()` is the one copy, made once and cached.
+
+    Uncompressed TIFF pages (with `tifffile`) and `.npy` files are memory-mapped read-only: only the
+    pages of the file that are used are loaded. Multi-page TIFF files and 3D `.npy` stacks (N, H, W)
+    are exposed as lazy frames through `frames()`.
+
+    Args:
+        path (str | Path): Image file.
+        frame (int): Frame of a multi-page TIFF or `.npy` stack.
+    """
+    def __init__(self, path, frame: int = 0):
+        self.path = Path(path)
+        self.filename = self.path.name
+        self.frame = frame
+        self._array: Optional[numpy.ndarray] = None
+        self._rgb: Optional[numpy.ndarray] = None
+        self._pil: Optional[Image.Image] = None
+        self._n_frames: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"ImageSource('{self.path}', frame={self.frame})"
+
+    @property
+    def n_frames(self) -> int:
+        """Number of frames in the file (1 for ordinary images)."""
+        if self._n_frames is None:
+            self._n_frames = _count_frames(self.path)
+        return self._n_frames
+
+    @property
+    def array(self) -> numpy.ndarray:
+        """Native pixels, (H, W) or (H, W, C), possibly a read-only memory map."""
+        if self._array is None:
+            with self._lock:
+                if self._array is None:
+                    self._array = _decode(self.path, self.frame)
+        return self._array
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.array.shape
+
+    def rgb(self) -> numpy.ndarray:
+        """Contiguous uint8 (H, W, 3) RGB pixels (the same buffer on every call; do not modify)."""
+        if self._rgb is None:
+            array = self.array
+            with self._lock:
+                if self._rgb is None:
+                    self._rgb = to_rgb8(array)
+        return self._rgb
+
+    def bgr(self) -> numpy.ndarray:
+        """OpenCV channel order, as a view of `rgb()`."""
+        return self.rgb()[..., ::-1]
+
+    def pil(self) -> Image.Image:
+        """PIL RGB image of `rgb()` (the same image on every call; do not modify)."""
+        if self._pil is None:
+            rgb = self.rgb()
+            with self._lock:
+                if self._pil is None:
+                    self._pil = Image.frombuffer("RGB", (rgb.shape[1], rgb.shape[0]), rgb, "raw", "RGB", 0, 1)
+        return self._pil
+
+    def tensor(self):
+        """uint8 (H, W, 3) torch tensor sharing the buffer of `rgb()` (read-only: do not modify in place)."""
+        import torch
+
+        with warnings.catch_warnings():
+            # Memory-mapped buffers are read-only, torch warns about non-writable arrays
+            warnings.simplefilter("ignore", UserWarning)
+            return torch.from_numpy(self.rgb())
+
+    def frames(self) -> Iterator["ImageSource"]:
+        """Lazy sources of every frame, each decoded when first accessed."""
+        for index in range(self.n_frames):
+            yield self if index == self.frame else ImageSource(self.path, frame=index)
+
+    def release(self):
+        """Drops the decoded buffers (they are decoded again on the next access)."""
+        with self._lock:
+            self._array = None
+            self._rgb = None
+            self._pil = None
+
+
+# Validate the path and read the header, returning None for missing, unsupported or unreadable files
+def open_image(path) -> Optional[ImageSource]:
+    path = Path(path)
+    if not path.is_file() or path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+        return None
+    source = ImageSource(path)
+    try:
+        source.n_frames
+    except Exception:
+        return None
+    return source
+
+
+# Decoded 8-bit RGB pixels of an image file (convenience for one-shot readers)
+def read_rgb(path, frame: int = 0) -> numpy.ndarray:
+    return ImageSource(path, frame=frame).rgb()
+
+
+# Optional dependency (installed with scikit-image)
+def _tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    return tifffile
+
+
+def _npy_stack(array: numpy.ndarray) -> bool:
+    # (N, H, W) or (N, H, W, C) stacks, as opposed to (H, W, C) color images
+    return (array.ndim == 3 and array.shape[2] not in (1, 3, 4)) or array.ndim == 4
+
+
+def _count_frames(path: Path) -> int:
+    suffix = path.suffix.lower()
+    if suffix == ".npy":
+        array = numpy.load(path, mmap_mode="r")
+        return array.shape[0] if _npy_stack(array) else 1
+    tifffile = _tifffile()
+    if suffix in TIFF_EXTENSIONS and tifffile is not None:
+        with tifffile.TiffFile(path) as tif:
+            return len(tif.pages)
+    with Image.open(path) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def _decode(path: Path, frame: int) -> numpy.ndarray:
+    suffix = path.suffix.lower()
+    if suffix == ".npy":
+        array = numpy.load(path, mmap_mode="r")
+        return array[frame] if _npy_stack(array) else array
+
+    tifffile = _tifffile()
+    if suffix in TIFF_EXTENSIONS and tifffile is not None:
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[frame]
+            if page.is_memmappable: # type: ignore
+                return tifffile.memmap(path, page=frame, mode="r")
+            return page.asarray() # type: ignore
+
+    with Image.open(path) as img:
+        img.seek(frame)
+        if img.mode not in NATIVE_PIL_MODES:
+            img = img.convert("RGB")
+        return numpy.asarray(img)
+
+
+def to_rgb8(array: numpy.ndarray) -> numpy.ndarray:
+    """
+    Converts native pixels to contiguous uint8 RGB: 16-bit values keep their high byte (like `cv2.imread`),
+    other integer and float images are scaled from their min-max range, gray is replicated and alpha dropped.
+    Returns `array` itself when it already is contiguous uint8 RGB.
+    """
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[..., 0]
+    elif array.ndim == 3 and array.shape[2] in (2, 4):
+        # Gray + alpha or RGBA: drop alpha
+        array = array[..., 0] if array.shape[2] == 2 else array[..., :3]
+
+    if array.dtype == numpy.uint8:
+        pass
+    elif array.dtype.kind in "iu" and array.min() >= 0 and array.max() <= 65535:
+        # 16-bit (PIL decodes some 16-bit files as int32): same scaling as cv2.imread
+        array = (array >> 8).astype(numpy.uint8)
+    else:
+        low, high = float(numpy.min(array)), float(numpy.max(array))
+        scale = 255.0 / (high - low) if high > low else 0.0
+        array = numpy.round((array.astype(numpy.float32) - low) * scale).astype(numpy.uint8)
+
+    if array.ndim == 2:
+        array = numpy.repeat(array[..., None], 3, axis=2)
+    return numpy.ascontiguousarray(array)
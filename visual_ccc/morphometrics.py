@@ -0,0 +1,265 @@
+import csv
+from pathlib import Path
+from typing import Optional, Sequence
+
+import cv2
+import numpy
+
+from visual_ccc.sam_masks import label_boundaries, string_to_counts
+
+
+# Settings
+MIN_AREA = 1                    # objects smaller than this (pixels) are ignored
+HISTOGRAM_BINS = 30
+FIGSIZE = (8, 4)
+DPI = 150
+SIZE_COLUMNS = ("area", "equivalent_diameter")
+
+# skimage.measure.perimeter weights (4-connectivity) indexed by the boundary configuration code
+_PERIMETER_WEIGHTS = numpy.zeros(50)
+_PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+_PERIMETER_WEIGHTS[[21, 33]] = numpy.sqrt(2)
+_PERIMETER_WEIGHTS[[13, 23]] = (1 + numpy.sqrt(2)) / 2
+
+
+# ------------------------------------------
+# Label images
+def labels_from_binary(binary: numpy.ndarray, connectivity: int = 8) -> numpy.ndarray:
+    """Connected components of a binary image (e.g. the Otsu output of `image_a.image_segmentation`) as an int32 label image."""
+    _n_labels, labels = cv2.connectedComponents((binary > 0).astype(numpy.uint8), connectivity=connectivity, ltype=cv2.CV_32S)
+    return labels
+
+
+def labels_from_annotations(anns: list[dict], shape: Optional[tuple[int, int]] = None) -> numpy.ndarray:
+    """
+    Paints SAM annotations (binary masks or RLE) into one int32 label image, label i+1 for annotation i.
+
+    Overlapping masks are painted from the largest to the smallest, so small objects lying on larger ones
+    keep their pixels. RLE masks are painted from their runs without decoding them.
+
+    Args:
+        anns (list[dict]): SAM annotations.
+        shape (tuple | None): (H, W) of the image. Defaults to the shape of the first mask.
+    """
+    if shape is None:
+        if not anns:
+            raise ValueError("shape is required when there are no annotations")
+        segmentation = anns[0]["segmentation"]
+        shape = segmentation.shape if isinstance(segmentation, numpy.ndarray) else tuple(segmentation["size"])
+    height, width = shape # type: ignore
+
+    # Column-major buffer: RLE runs index it directly, binary masks through its transpose
+    labels_f = numpy.zeros(height * width, dtype=numpy.int32)
+    areas = [ann.get("area", 0) for ann in anns]
+    for index in sorted(range(len(anns)), key=lambda i: areas[i], reverse=True):
+        segmentation = anns[index]["segmentation"]
+        if isinstance(segmentation, numpy.ndarray):
+            labels_f[segmentation.ravel(order="F")] = index + 1
+            continue
+        counts = segmentation["counts"]
+        if isinstance(counts, (str, bytes)):
+            counts = string_to_counts(counts)
+        bounds = numpy.cumsum(numpy.concatenate(([0], counts)))
+        # Runs of ones are the odd runs: [bounds[1], bounds[2]), [bounds[3], bounds[4]), ...
+        starts, ends = bounds[1:-1:2], bounds[2::2]
+        lengths = ends - starts
+        positions = numpy.repeat(starts - numpy.concatenate(([0], numpy.cumsum(lengths)[:-1])), lengths) + numpy.arange(lengths.sum())
+        labels_f[positions] = index + 1
+    return labels_f.reshape(width, height).T.copy()
+
+
+# ------------------------------------------
+# Descriptors
+def _perimeters(labels: numpy.ndarray, boundary: numpy.ndarray, n_labels: int) -> numpy.ndarray:
+    # Same estimate as skimage.measure.perimeter(region, neighborhood=4) for every region at once:
+    # boundary pixels are weighted by how they connect to the boundary pixels of the same region
+    boundary_labels = numpy.pad(numpy.where(boundary, labels, 0), 1)
+    inner = boundary_labels[1:-1, 1:-1]
+    code = boundary.astype(numpy.int32)
+    for d_row, d_col, weight in ((-1, 0, 2), (1, 0, 2), (0, -1, 2), (0, 1, 2),
+                                 (-1, -1, 10), (-1, 1, 10), (1, -1, 10), (1, 1, 10)):
+        neighbour = boundary_labels[1 + d_row : boundary_labels.shape[0] - 1 + d_row, 1 + d_col : boundary_labels.shape[1] - 1 + d_col]
+        code += weight * ((neighbour == inner) & boundary)
+
+    rows, cols = numpy.nonzero(boundary)
+    return numpy.bincount(labels[rows, cols], weights=_PERIMETER_WEIGHTS[code[rows, cols]], minlength=n_labels)
+
+
+def _hull_descriptors(labels: numpy.ndarray, boundary: numpy.ndarray, present: numpy.ndarray, n_labels: int):
+    # Convex hull area and Feret diameters from the pixel corners of the boundary pixels.
+    # Points are grouped by label with one sort; only the hull (cv2) and the calipers run per object.
+    rows, cols = numpy.nonzero(boundary)
+    point_labels = labels[rows, cols]
+    order = numpy.argsort(point_labels, kind="stable")
+    rows, cols, point_labels = rows[order], cols[order], point_labels[order]
+    splits = numpy.searchsorted(point_labels, present)
+    ends = numpy.searchsorted(point_labels, present, side="right")
+
+    corners = numpy.array([[-0.5, -0.5], [-0.5, 0.5], [0.5, -0.5], [0.5, 0.5]], dtype=numpy.float32)
+    convex_area = numpy.zeros(n_labels)
+    feret_max = numpy.zeros(n_labels)
+    feret_min = numpy.zeros(n_labels)
+    for label, start, end in zip(present, splits, ends):
+        points = (numpy.stack((cols[start:end], rows[start:end]), axis=1).astype(numpy.float32)[:, None, :] + corners).reshape(-1, 2)
+        hull = cv2.convexHull(points).reshape(-1, 2).astype(numpy.float64)
+        convex_area[label] = cv2.contourArea(hull.astype(numpy.float32))
+        # Maximum Feret: largest distance between hull vertices
+        difference = hull[:, None, :] - hull[None, :, :]
+        feret_max[label] = numpy.sqrt((difference ** 2).sum(axis=2).max())
+        # Minimum Feret: narrowest caliper, always parallel to a hull edge
+        edges = numpy.roll(hull, -1, axis=0) - hull
+        lengths = numpy.hypot(edges[:, 0], edges[:, 1])
+        valid = lengths > 0
+        if valid.any():
+            normals = numpy.stack((-edges[valid, 1], edges[valid, 0]), axis=1) / lengths[valid, None]
+            widths = (hull @ normals.T).max(axis=0) - (hull @ normals.T).min(axis=0)
+            feret_min[label] = widths.min()
+    return convex_area, feret_max, feret_min
+
+
+def measure_labels(labels: numpy.ndarray, pixel_size: float = 1.0, min_area: int = MIN_AREA) -> dict[str, numpy.ndarray]:
+    """
+    Computes shape descriptors of every object of a label image (0 is background) in one pass.
+
+    Areas, centroids and second moments come from weighted `bincount`s over the object pixels; perimeters use
+    the skimage 4-connectivity estimate, computed for all objects at once. Convex hulls (solidity, Feret
+    diameters) are built from the boundary pixel corners.
+
+    Args:
+        labels (np.ndarray): int (H, W) label image, e.g. from `labels_from_binary` or `labels_from_annotations`.
+        pixel_size (float): Physical size of a pixel. Lengths are multiplied by it, areas by its square.
+        min_area (int): Objects with fewer pixels are dropped.
+
+    Returns:
+        dict[str, np.ndarray]: Columnar table, one entry per object: label, area, perimeter, equivalent_diameter,
+        circularity (4*pi*area/perimeter^2, can exceed 1 for objects of a few pixels), solidity, feret_max,
+        feret_min, major_axis, minor_axis, eccentricity, orientation (degrees, counter-clockwise from the image
+        x-axis), centroid_x, centroid_y, touches_border.
+    """
+    labels = numpy.asarray(labels)
+    n_labels = int(labels.max()) + 1 if labels.size else 1
+    width = labels.shape[1]
+
+    # Raw moments per label, over the object pixels only
+    pixels = numpy.flatnonzero(labels)
+    flat = labels.ravel()[pixels]
+    y, x = numpy.divmod(pixels, width)
+    x, y = x.astype(numpy.float64), y.astype(numpy.float64)
+    area = numpy.bincount(flat, minlength=n_labels).astype(numpy.float64)
+    sum_x = numpy.bincount(flat, weights=x, minlength=n_labels)
+    sum_y = numpy.bincount(flat, weights=y, minlength=n_labels)
+    sum_xx = numpy.bincount(flat, weights=x * x, minlength=n_labels)
+    sum_yy = numpy.bincount(flat, weights=y * y, minlength=n_labels)
+    sum_xy = numpy.bincount(flat, weights=x * y, minlength=n_labels)
+
+    present = numpy.flatnonzero(area >= max(min_area, 1))
+    present = present[present > 0]
+    area_p = area[present]
+
+    # Central moments (covariance of the pixel coordinates) and the equivalent ellipse
+    centroid_x = sum_x[present] / area_p
+    centroid_y = sum_y[present] / area_p
+    mu20 = sum_xx[present] / area_p - centroid_x ** 2
+    mu02 = sum_yy[present] / area_p - centroid_y ** 2
+    mu11 = sum_xy[present] / area_p - centroid_x * centroid_y
+    common = numpy.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    lambda_1 = (mu20 + mu02) / 2 + common
+    lambda_2 = numpy.maximum((mu20 + mu02) / 2 - common, 0)
+    major_axis = 4 * numpy.sqrt(lambda_1)
+    minor_axis = 4 * numpy.sqrt(lambda_2)
+    eccentricity = numpy.sqrt(1 - numpy.divide(lambda_2, lambda_1, out=numpy.ones_like(lambda_1), where=lambda_1 > 0))
+    # Image rows point down: flip the sign of the covariance for a counter-clockwise angle
+    orientation = numpy.degrees(0.5 * numpy.arctan2(-2 * mu11, mu20 - mu02))
+
+    boundary = label_boundaries(labels)
+    perimeter = _perimeters(labels, boundary, n_labels)[present]
+    convex_area, feret_max, feret_min = _hull_descriptors(labels, boundary, present, n_labels)
+
+    border_labels = numpy.concatenate((labels[0], labels[-1], labels[:, 0], labels[:, -1]))
+    on_border = numpy.zeros(n_labels, dtype=bool)
+    on_border[border_labels] = True
+
+    circularity = numpy.divide(4 * numpy.pi * area_p, perimeter ** 2, out=numpy.zeros_like(area_p), where=perimeter > 0)
+    solidity = numpy.divide(area_p, convex_area[present], out=numpy.ones_like(area_p), where=convex_area[present] > 0)
+
+    return {"label": present.astype(numpy.int32),
+            "area": area_p * pixel_size ** 2,
+            "perimeter": perimeter * pixel_size,
+            "equivalent_diameter": numpy.sqrt(4 * area_p / numpy.pi) * pixel_size,
+            "circularity": circularity,
+            "solidity": numpy.minimum(solidity, 1.0),
+            "feret_max": feret_max[present] * pixel_size,
+            "feret_min": feret_min[present] * pixel_size,
+            "major_axis": major_axis * pixel_size,
+            "minor_axis": minor_axis * pixel_size,
+            "eccentricity": eccentricity,
+            "orientation": orientation,
+            "centroid_x": centroid_x * pixel_size,
+            "centroid_y": centroid_y * pixel_size,
+            "touches_border": on_border[present]}
+
+
+def measure_binary(binary: numpy.ndarray, pixel_size: float = 1.0, min_area: int = MIN_AREA) -> dict[str, numpy.ndarray]:
+    """Descriptors of the particles (8-connected components) of a binary image, e.g. the Otsu segmentation."""
+    return measure_labels(labels_from_binary(binary), pixel_size=pixel_size, min_area=min_area)
+
+
+def measure_annotations(anns: list[dict], shape: Optional[tuple[int, int]] = None, pixel_size: float = 1.0,
+                        min_area: int = MIN_AREA) -> dict[str, numpy.ndarray]:
+    """Descriptors of SAM masks (label i+1 is annotation i; overlaps go to the smaller mask)."""
+    return measure_labels(labels_from_annotations(anns, shape), pixel_size=pixel_size, min_area=min_area)
+
+
+# ------------------------------------------
+# Output
+def save_table(table: dict[str, numpy.ndarray], save_path: Path):
+    """Writes the table as CSV, or as Parquet if `save_path` ends in `.parquet` (requires pandas and pyarrow)."""
+    save_path = Path(save_path)
+    if save_path.suffix == ".parquet":
+        try:
+            import pandas
+        except ImportError as e:
+            raise ImportError("Parquet output requires 'pandas' and 'pyarrow' to be installed.") from e
+        pandas.DataFrame(table).to_parquet(save_path, index=False)
+        return
+
+    columns = list(table.keys())
+    with open(save_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(zip(*(table[column].tolist() for column in columns)))
+
+
+def size_histogram(table: dict[str, numpy.ndarray], column: str = "equivalent_diameter", bins: int = HISTOGRAM_BINS,
+                   log: bool = False) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Counts and bin edges of a column (log-spaced bins with `log=True`)."""
+    values = table[column]
+    if values.size == 0:
+        return numpy.zeros(bins, dtype=numpy.int64), numpy.linspace(0, 1, bins + 1)
+    if log:
+        low, high = values[values > 0].min(), values.max()
+        edges = numpy.geomspace(low, high if high > low else low * 10, bins + 1)
+    else:
+        edges = numpy.histogram_bin_edges(values, bins=bins)
+    counts, edges = numpy.histogram(values, bins=edges)
+    return counts, edges
+
+
+def plot_size_distribution(table: dict[str, numpy.ndarray], columns: Sequence[str] = SIZE_COLUMNS, bins: int = HISTOGRAM_BINS,
+                           log: bool = False, unit: str = "px"):
+    """Histograms of the size columns, one subplot per column."""
+    import matplotlib.pyplot as plt
+
+    fig, axs = plt.subplots(1, len(columns), figsize=FIGSIZE, dpi=DPI, squeeze=False)
+    for ax, column in zip(axs[0], columns):
+        counts, edges = size_histogram(table, column, bins=bins, log=log)
+        ax.stairs(counts, edges, fill=True, alpha=0.8)
+        if log:
+            ax.set_xscale("log")
+        suffix = f"{unit}²" if column in ("area",) else unit
+        ax.set_xlabel(f"{column.replace('_', ' ')} ({suffix})")
+        ax.set_ylabel("count")
+    fig.suptitle(f"Size distribution ({len(table['label'])} objects)")
+    fig.tight_layout()
+
+    return fig
@@ -1,9 +1,13 @@
+import os
+import sys
 import FreeSimpleGUI as sg
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.backends._backend_tk import NavigationToolbar2Tk
+
+# Matplotlib renders off-screen (Agg) and figures are embedded in Tk canvases.
+# It is imported on the first plot, so only the backend is selected here.
+if "matplotlib" in sys.modules:
+    sys.modules["matplotlib"].use('Agg')
+else:
+    os.environ["MPLBACKEND"] = "Agg"
 
 
 CLOSED = sg.WIN_CLOSED
@@ -14,6 +18,10 @@ WINDOW_SIZE = (1350, 850)
 
 # A helper function to plot a figure on a canvas with a toolbar
 def draw_figure(canvas, figure, figure_canvas_agg, toolbar):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.backends._backend_tk import NavigationToolbar2Tk
+    
     # Delete previous figure on canvas
     if figure_canvas_agg:
         figure_canvas_agg.get_tk_widget().forget()
@@ -52,20 +60,25 @@ def main_window():
     
     tab2 = [
         [sg.Text(text="Run single-image segmentation using the Segment Anything Model 2 (SAM2).\n\nNote: For batch automation and mask dataset creation, please use the CUDA-enabled Visual-CCC script on GitHub.", pad=(20,20)),
-         sg.Button("Run SAM", key="-SAM_BUTTON-", pad=(20,20), visible=False, disabled=True)],
+         sg.Button("Run SAM", key="-SAM_BUTTON-", pad=(20,20), visible=False, disabled=True),
+         sg.Checkbox("Classify segments", key="-SAM_CLASSIFY-", default=False, pad=(20,20),
+                     tooltip="Classify every mask with the image classifier and colour the masks by class")],
         [sg.Canvas(size=CANVAS_SIZE, key='-SAM_CANVAS-')]
     ]
     
     tab3 = [
         [sg.Text(text="The following visualizations will be generated:\n   1) Image Segmentation\n   2) Texture Analysis\n   3) Clustering Analysis (new tab)", pad=(20,20)), 
-         sg.Button("Run Analysis", key="-IMG_ANALYSIS-", pad=(20,20), disabled=True, visible=False),],
+         sg.Button("Run Analysis", key="-IMG_ANALYSIS-", pad=(20,20), disabled=True, visible=False),
+         sg.Checkbox("Native resolution", key="-NATIVE_RES-", default=False, pad=(20,20),
+                     tooltip="Show a 512 px preview first, then compute the full-resolution results in the background")],
         [sg.Canvas(size=CANVAS_SIZE, key='-IMG_CANVAS-')]
     ]
     
     tab4 = [
         [sg.Column([
-            [sg.Text(text="Number of clusters:", pad=((20,10),(20,10))), sg.Combo(values=[2,3,4,5,10], default_value=3, key="-CLUSTERS-", pad=((10,20),(20,10)))], 
-            [sg.Button('Cluster', key="-CLUSTER_BTN-", pad=((20,20),(20,10)))], 
+            [sg.Text(text="Number of clusters:", pad=((20,10),(20,10))), sg.Combo(values=list(range(2, 11)), default_value=3, key="-CLUSTERS-", pad=((10,20),(20,10)))], 
+            [sg.Button('Cluster', key="-CLUSTER_BTN-", pad=((20,20),(20,10))), sg.Button('k-Sweep', key="-KSWEEP_BTN-", disabled=True, pad=((0,20),(20,10))),
+             sg.Text(text="Sweeping k = 2..10 ...", key="-K_SUGGEST-", pad=((0,10),(20,10)))], 
             [sg.pin(sg.Text(text="INVALID NUMBER!", text_color='red', key="-CLUSTER_ERROR-", visible=False, pad=(20,10))), sg.Text(" ", pad=(20,10))],
             [sg.Canvas(size=CLUSTER_CANVAS_SIZE, key='-CLUSTER_CANVAS-')]
             ]), sg.VerticalSeparator(),
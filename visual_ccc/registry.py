@@ -0,0 +1,120 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable, Literal, Optional
+
+
+# Settings
+LOADER_THREADS = 1   # background loads run one at a time (they compete for the same disk and CPU)
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models, with optional loading in a background thread.
+
+    Each model is loaded at most once per key: `preload` starts a background load and returns immediately,
+    `get` returns the cached model, waiting for a load in progress or loading it in the calling thread.
+    A failed load is not cached, so the next request tries again.
+    """
+    def __init__(self, loader_threads: int = LOADER_THREADS):
+        self._futures: dict[Hashable, Future] = dict()
+        self._lock = threading.Lock()
+        self._loader_threads = loader_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _future(self, key: Hashable, loader: Callable, background: bool) -> tuple[Future, bool]:
+        """Returns the future of `key` and whether the caller must run the load itself."""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future, False
+
+            if background:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._loader_threads, thread_name_prefix="model-loader")
+                future = self._executor.submit(loader)
+                self._futures[key] = future
+                return future, False
+
+            future = Future()
+            self._futures[key] = future
+            return future, True
+
+    def preload(self, key: Hashable, loader: Callable) -> Future:
+        """Starts loading `key` in the background (no-op if it is loaded or loading)."""
+        future, _ = self._future(key, loader, background=True)
+        return future
+
+    def get(self, key: Hashable, loader: Callable):
+        """Returns the model of `key`, loading it now if nobody else is."""
+        future, must_load = self._future(key, loader, background=False)
+        if must_load:
+            try:
+                future.set_result(loader())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def is_loaded(self, key: Hashable) -> bool:
+        with self._lock:
+            future = self._futures.get(key)
+        return future is not None and future.done() and future.exception() is None
+
+    def clear(self):
+        """Drops every cached model (loads in progress still finish)."""
+        with self._lock:
+            self._futures.clear()
+
+
+REGISTRY = ModelRegistry()
+
+
+# ------------------------------------------
+# Classifier (AlexNet / VisualCNN), evaluation mode, with a validated class map
+def _classifier_key(model_type: str, classes: str, device: str):
+    return ("classifier", model_type, classes, str(device))
+
+
+def _load_classifier(model_type: str, classes: str, device: str):
+    from visual_ccc import gradcam
+
+    model, class_map = gradcam.create_model(classes=classes, model_type=model_type) # type: ignore
+    model.to(device)
+    model.eval()
+    # validate class map
+    if class_map is None or not isinstance(class_map, dict):
+        class_map = {str(i): i for i in range(3 if classes == "3-class" else 2)}
+    return model, class_map
+
+
+def get_classifier(classes: Literal["2-class", "3-class"], model_type: Literal["alexnet", "visualcnn"] = "alexnet", device: str = "cpu"):
+    """Returns (model, class_map), loading the weights only the first time."""
+    return REGISTRY.get(_classifier_key(model_type, classes, device), lambda: _load_classifier(model_type, classes, device))
+
+
+def preload_classifier(classes: Literal["2-class", "3-class"], model_type: Literal["alexnet", "visualcnn"] = "alexnet", device: str = "cpu") -> Future:
+    return REGISTRY.preload(_classifier_key(model_type, classes, device), lambda: _load_classifier(model_type, classes, device))
+
+
+# ------------------------------------------
+# SAM2 mask generator on the best available device
+def _sam_key():
+    return ("sam2",)
+
+
+def _load_sam():
+    from visual_ccc import sam_segment
+
+    device, dtype = sam_segment.get_device()
+    sam_model = sam_segment.build_sam_model(device=device)
+    sam_model.to(device)
+    sam_model.eval()
+    return sam_segment.get_generator(sam_model), device, dtype
+
+
+def get_sam():
+    """Returns (mask_generator, device, dtype), building SAM2 only the first time."""
+    return REGISTRY.get(_sam_key(), _load_sam)
+
+
+def preload_sam() -> Future:
+    return REGISTRY.preload(_sam_key(), _load_sam)
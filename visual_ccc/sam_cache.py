@@ -0,0 +1,156 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+
+
+# Settings
+DEFAULT_MAX_BYTES = 10 * 1024**3   # 10 GB
+META_FILE = "meta.json"
+
+
+def model_cache_key(config_name: str, weights_file: Path) -> str:
+    """
+    Identifies a SAM2 model by its config name and checkpoint (name, size and modification time).
+    """
+    weights_file = Path(weights_file)
+    try:
+        stat = weights_file.stat()
+        weights_id = f"{weights_file.name}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        weights_id = weights_file.name
+    return f"{config_name}|{weights_id}"
+
+
+class SAMEmbeddingCache:
+    """
+    On-disk cache of SAM2 image embeddings, keyed by image content hash + model config.
+
+    Each entry is a directory of `.npy` feature maps, loaded memory-mapped. Entries are evicted
+    least-recently-used first when the cache grows beyond `max_bytes`.
+
+    Attach it to a `SAM2AutomaticMaskGenerator` with `cache.attach(mask_generator.predictor)`: every
+    `set_image` call (one per crop) then reuses the stored features, so re-running the generator with
+    different parameters only pays for the mask decoder.
+    """
+    def __init__(self, cache_dir: Path, model_key: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.model_key = model_key
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, image: np.ndarray) -> str:
+        """Content hash of an image array together with the model key."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.model_key.encode())
+        digest.update(f"{image.shape}|{image.dtype}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def load(self, key: str, device) -> Optional[dict]:
+        """Returns the predictor features of an entry, or None if it is not cached."""
+        entry_dir = self.cache_dir / key
+        meta_path = entry_dir / META_FILE
+        if not meta_path.is_file():
+            return None
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            # Copy-on-write memory maps: pages are read lazily and never written back
+            tensors = [torch.from_numpy(np.load(entry_dir / name, mmap_mode="c")).to(device=device, dtype=getattr(torch, dtype))
+                       for name, dtype in zip(meta["files"], meta["dtypes"])]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Mark as recently used (the entry may already be evicted by another process)
+        with contextlib.suppress(OSError):
+            os.utime(meta_path)
+        return {"image_embed": tensors[0], "high_res_feats": tensors[1:]}
+
+    def save(self, key: str, features: dict):
+        """Stores the predictor features of an image and evicts old entries if needed."""
+        tensors = [features["image_embed"], *features["high_res_feats"]]
+        files = [f"feat_{i}.npy" for i in range(len(tensors))]
+        dtypes = [str(tensor.dtype).removeprefix("torch.") for tensor in tensors]
+
+        # Write to a private directory, then move it in place (safe with concurrent writers)
+        tmp_dir = self.cache_dir / f".tmp-{uuid.uuid4().hex}"
+        try:
+            tmp_dir.mkdir()
+            for name, tensor in zip(files, tensors):
+                # numpy has no bfloat16: store float32 and restore the dtype on load
+                np.save(tmp_dir / name, tensor.detach().float().cpu().numpy())
+            with open(tmp_dir / META_FILE, "w") as f:
+                json.dump({"model_key": self.model_key, "files": files, "dtypes": dtypes, "created": time.time()}, f)
+            os.replace(tmp_dir, self.cache_dir / key)
+        except OSError:
+            # Entry written by another process, or disk error: the cache is best-effort
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least-recently-used entries until the cache fits in `max_bytes`.
+
+        Entries removed by another process during the scan are skipped.
+        """
+        entries = []
+        total_bytes = 0
+        try:
+            entry_dirs = list(self.cache_dir.iterdir())
+        except OSError:
+            return
+        for entry_dir in entry_dirs:
+            meta_path = entry_dir / META_FILE
+            if entry_dir.name.startswith("."):
+                continue
+            try:
+                size = sum(path.stat().st_size for path in entry_dir.iterdir())
+                last_used = meta_path.stat().st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, size, entry_dir))
+            total_bytes += size
+
+        for _last_used, size, entry_dir in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+
+    def attach(self, predictor):
+        """Routes `predictor.set_image` through the cache (a SAM2ImagePredictor instance)."""
+        compute_embeddings = predictor.set_image
+
+        def set_image(image):
+            if not isinstance(image, np.ndarray):
+                return compute_embeddings(image)
+
+            key = self.key(image)
+            features = self.load(key, predictor.device)
+            if features is None:
+                self.misses += 1
+                compute_embeddings(image)
+                self.save(key, predictor._features)
+            else:
+                self.hits += 1
+                predictor.reset_predictor()
+                predictor._orig_hw = [image.shape[:2]]
+                predictor._features = features
+                predictor._is_image_set = True
+
+        predictor.set_image = set_image
+        return predictor
@@ -0,0 +1,160 @@
+import numpy as np
+import torch
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
+from PIL import Image
+from torchvision.ops import roi_align
+
+from visual_ccc.gradcam import SIZE_REQUIREMENT, _class_probabilities, _model_device
+from visual_ccc.sam_masks import label_boundaries, label_image, mask_shape
+
+
+# Settings
+BATCH_SIZE = 64         # crops per forward pass
+CROP_PADDING = 0.15     # context around each mask, as a fraction of its bbox size (per side)
+RESIZE_SIZE = int(1.2 * SIZE_REQUIREMENT)   # gradcam.get_transforms: Resize, then CenterCrop(SIZE_REQUIREMENT)
+CLASS_CMAP = "tab10"
+FIGSIZE = (8, 4)
+DPI = 150
+
+
+def crop_boxes(anns: list[dict], shape: tuple[int, int], padding: float = CROP_PADDING) -> np.ndarray:
+    """
+    Source windows (x0, y0, x1, y1) of the model inputs of every mask, in pixel-edge coordinates.
+
+    Each mask bbox (XYWH) is padded by `padding` of its size on every side and clipped to the image. The
+    window is then the region that `gradcam.transform_image` keeps from that crop: the shorter side resized
+    to RESIZE_SIZE, then the central SIZE_REQUIREMENT square.
+    """
+    height, width = shape
+    if not anns:
+        return np.zeros((0, 4), dtype=np.float64)
+    bbox = np.array([ann["bbox"] for ann in anns], dtype=np.float64).reshape(-1, 4)
+    x, y = bbox[:, 0], bbox[:, 1]
+    w, h = np.maximum(bbox[:, 2], 1), np.maximum(bbox[:, 3], 1)
+
+    # Padded crop, whole pixels, inside the image
+    x0 = np.clip(np.floor(x - padding * w), 0, width - 1)
+    y0 = np.clip(np.floor(y - padding * h), 0, height - 1)
+    x1 = np.clip(np.ceil(x + w + padding * w), x0 + 1, width)
+    y1 = np.clip(np.ceil(y + h + padding * h), y0 + 1, height)
+    crop_w, crop_h = x1 - x0, y1 - y0
+
+    # transforms.Resize(RESIZE_SIZE): shorter side to RESIZE_SIZE, longer side truncated
+    short_side = np.minimum(crop_w, crop_h)
+    resized_w = np.where(crop_w <= crop_h, RESIZE_SIZE, np.floor(RESIZE_SIZE * crop_w / short_side))
+    resized_h = np.where(crop_h < crop_w, RESIZE_SIZE, np.floor(RESIZE_SIZE * crop_h / short_side))
+    # transforms.CenterCrop(SIZE_REQUIREMENT)
+    left = np.round((resized_w - SIZE_REQUIREMENT) / 2)
+    top = np.round((resized_h - SIZE_REQUIREMENT) / 2)
+
+    scale_x, scale_y = resized_w / crop_w, resized_h / crop_h
+    return np.stack((x0 + left / scale_x, y0 + top / scale_y,
+                     x0 + (left + SIZE_REQUIREMENT) / scale_x, y0 + (top + SIZE_REQUIREMENT) / scale_y), axis=1)
+
+
+def extract_crops(gray: torch.Tensor, boxes: np.ndarray) -> torch.Tensor:
+    """
+    Samples the model inputs (N, 1, SIZE_REQUIREMENT, SIZE_REQUIREMENT) of all boxes in one `roi_align` call.
+
+    `gray` is the (H, W) grayscale image in [0, 1] on the model device. Every output pixel averages an
+    adaptive grid of bilinear samples over its source area, so downscaled crops are antialiased and stay
+    within about 1/255 of the PIL resize of `transform_image`.
+    """
+    rois = torch.zeros((boxes.shape[0], 5), dtype=gray.dtype, device=gray.device)
+    rois[:, 1:] = torch.from_numpy(boxes).to(device=gray.device, dtype=gray.dtype)
+    return roi_align(gray[None, None], rois, output_size=SIZE_REQUIREMENT, spatial_scale=1.0,
+                     sampling_ratio=-1, aligned=True)
+
+
+def classify_masks(anns: list[dict], image: np.ndarray, model, class_map: dict[str, int],
+                   batch_size: int = BATCH_SIZE, padding: float = CROP_PADDING) -> list[dict]:
+    """
+    Classifies the region around every SAM mask with the image classifier.
+
+    The image is converted to grayscale once (PIL "L", like `transforms.Grayscale`), the crops of each batch
+    are sampled in one vectorized call, and each batch runs a single forward pass under `torch.inference_mode`.
+
+    Args:
+        anns (list[dict]): SAM annotations (need "bbox" in XYWH).
+        image (np.ndarray): The segmented RGB image (H, W, 3).
+        model: Classifier from `gradcam.create_model` (or `registry.get_classifier`), in eval mode.
+        class_map (dict[str, int]): Class name to index.
+        batch_size (int): Crops per forward pass.
+        padding (float): Context around each mask bbox, as a fraction of its size.
+
+    Returns:
+        list[dict]: Copies of the annotations with "class" (name), "class_index" and "probability" added.
+    """
+    if not anns:
+        return []
+    index_to_str = {v: k for k, v in class_map.items()}
+    device = _model_device(model)
+
+    gray_pil = Image.fromarray(image).convert("L") if image.ndim == 3 else Image.fromarray(image)
+    gray = torch.from_numpy(np.asarray(gray_pil, dtype=np.float32) / 255).to(device)
+    boxes = crop_boxes(anns, gray.shape, padding=padding) # type: ignore
+
+    class_indices, probabilities = [], []
+    with torch.inference_mode():
+        for start in range(0, len(anns), batch_size):
+            crops = extract_crops(gray, boxes[start:start + batch_size])
+            batch_probabilities = _class_probabilities(model(crops).float())
+            best = batch_probabilities.max(dim=1)
+            class_indices.extend(best.indices.tolist())
+            probabilities.extend(best.values.tolist())
+
+    return [{**ann, "class": index_to_str.get(index, f"Class {index}"), "class_index": index, "probability": round(probability, 4)}
+            for ann, index, probability in zip(anns, class_indices, probabilities)]
+
+
+def render_class_overlay(anns: list[dict], original_image_array: np.ndarray, class_map: dict[str, int],
+                         borders=True, alpha=0.45, cmap_name=CLASS_CMAP, border_color=(1.0, 1.0, 1.0)):
+    """
+    Overlays the classified masks on the image, one colour per class, and returns a Pillow Image and a Matplotlib Figure.
+
+    Args:
+        anns (list[dict]): Annotations returned by `classify_masks`.
+        original_image_array (np.ndarray): The base RGB image (H, W, 3).
+        class_map (dict[str, int]): Class name to index (legend and colours).
+        borders (bool): Whether to outline every mask (neighbouring masks of the same class stay distinct).
+        alpha (float): Transparency of the mask fill (0.0 to 1.0).
+        cmap_name (str): Matplotlib colormap, indexed by class.
+        border_color (tuple): RGB tuple for borders (0.0 to 1.0).
+
+    Returns:
+        (PIL Image, Matplotlib Figure): The composite image in RGBA mode, and a figure with a class legend.
+    """
+    base_pil = Image.fromarray(original_image_array).convert("RGBA")
+    cmap = plt.get_cmap(cmap_name)
+    n_classes = max(len(class_map), 2)
+
+    final_pil = base_pil
+    if anns:
+        sorted_anns = sorted(anns, key=(lambda x: x['area']), reverse=True)
+        h, w = mask_shape(sorted_anns[0])
+        labels = label_image(sorted_anns, (h, w))
+
+        # Palette: row 0 is transparent, row i+1 is the class colour of annotation i
+        colors = np.zeros((len(sorted_anns) + 1, 4), dtype=np.float32)
+        colors[1:] = cmap(np.array([ann["class_index"] for ann in sorted_anns]) % cmap.N)
+        colors[1:, 3] = alpha
+        layer = (colors * np.float32(255)).astype(np.uint8)[labels]
+        if borders:
+            border_rgba = np.array([*border_color[:3], min(1.0, alpha + 0.4)], dtype=np.float32)
+            layer[label_boundaries(labels)] = (border_rgba * np.float32(255)).astype(np.uint8)
+        final_pil = Image.alpha_composite(base_pil, Image.fromarray(layer, mode="RGBA"))
+
+    fig = plt.figure(figsize=FIGSIZE, dpi=DPI)
+    ax = fig.add_subplot(111)
+    ax.imshow(final_pil)
+    ax.axis('off')
+
+    # Legend: class name and number of masks
+    counts = np.bincount([ann["class_index"] for ann in anns], minlength=n_classes) if anns else np.zeros(n_classes, dtype=int)
+    handles = [mpatches.Patch(color=cmap(index % cmap.N), label=f"{name} ({counts[index] if index < len(counts) else 0})")
+               for name, index in sorted(class_map.items(), key=lambda item: item[1])]
+    ax.legend(handles=handles, loc='upper right', title='Class')
+    fig.tight_layout(pad=0)
+
+    return final_pil, fig
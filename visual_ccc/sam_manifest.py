@@ -0,0 +1,119 @@
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Literal
+
+
+# Why an image is (or is not) processed in a run
+STALE_REASONS = ("new", "changed", "failed", "missing", "params")
+UP_TO_DATE = "up-to-date"
+
+
+def file_hash(path: Path, chunk_size: int = 1024**2) -> str:
+    """Content hash (blake2b) of a file."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def params_key(params: dict) -> str:
+    """Stable hash of a JSON-serializable parameter dict."""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+class SAMManifest:
+    """
+    Append-only JSONL log of processed images: input hash, parameters, model, output, status and timings.
+
+    The last record of an image describes its current state, so an interrupted run loses at most the
+    images in flight. A line cut short by a crash is ignored on load.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records: dict[str, dict] = dict()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        self.records.clear()
+        if not self.path.is_file():
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and "image" in record:
+                    self.records[record["image"]] = record
+
+    def append(self, record: dict):
+        """Records the outcome of one image (thread-safe, flushed immediately)."""
+        record = {**record, "timestamp": round(time.time(), 3)}
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+            self.records[record["image"]] = record
+
+    def input_info(self, image_name: str, path: Path) -> dict:
+        """Size, mtime and content hash of an input. The hash is reused from the last record if size and mtime match."""
+        stat = Path(path).stat()
+        info = {"size": stat.st_size, "mtime": stat.st_mtime}
+        previous = self.records.get(image_name)
+        if previous and previous.get("size") == info["size"] and previous.get("mtime") == info["mtime"] and previous.get("input_hash"):
+            info["input_hash"] = previous["input_hash"]
+        else:
+            info["input_hash"] = file_hash(path)
+        return info
+
+    def status(self, image_name: str, input_hash: str, run_key: dict, output_dir: Path) -> str:
+        """One of STALE_REASONS, or UP_TO_DATE."""
+        record = self.records.get(image_name)
+        if record is None:
+            return "new"
+        if record.get("input_hash") != input_hash:
+            return "changed"
+        # Settings first: a failed or missing output from other settings is still a "params" image
+        if any(record.get(key) != value for key, value in run_key.items()):
+            return "params"
+        if record.get("status") != "ok":
+            return "failed"
+        if not record.get("output") or not (Path(output_dir) / record["output"]).is_file():
+            return "missing"
+        return UP_TO_DATE
+
+    def plan(self, images_dict: dict[str, Path], run_key: dict, output_dir: Path,
+             mode: Literal["incremental", "force", "params-changed-only"] = "incremental") -> tuple[dict[str, dict], dict[str, int]]:
+        """
+        Selects the images to process.
+
+        Args:
+            images_dict (dict): Image name -> path.
+            run_key (dict): Settings that must match a previous record for its output to be reused
+                (e.g. {"params": ..., "model": ...}).
+            output_dir (Path): Directory holding the outputs named in the records.
+            mode (str): "incremental" processes new, changed, failed and stale images; "force" processes all;
+                "params-changed-only" only re-processes images previously done with other settings.
+
+        Returns:
+            tuple: ({image name: base record for the new entry}, {reason: number of images}).
+        """
+        selected: dict[str, dict] = dict()
+        summary: dict[str, int] = dict()
+
+        for image_name, path in images_dict.items():
+            info = self.input_info(image_name, path)
+            reason = self.status(image_name, info["input_hash"], run_key, output_dir)
+            summary[reason] = summary.get(reason, 0) + 1
+
+            if mode == "force" or (mode == "params-changed-only" and reason == "params") \
+                    or (mode == "incremental" and reason != UP_TO_DATE):
+                selected[image_name] = {"image": image_name, **info, **run_key, "reason": reason}
+
+        return selected, summary
@@ -0,0 +1,228 @@
+import json
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+# Annotation keys written to the per-image annotation file (besides the segmentation)
+EXPORT_KEYS = ["area", "bbox", "predicted_iou", "stability_score", "point_coords", "crop_box"]
+
+
+def encode_rle(mask: np.ndarray) -> dict:
+    """
+    Encodes a boolean (H, W) mask as an uncompressed COCO RLE.
+
+    Counts are run lengths over the column-major (Fortran order) pixels, starting with a run of zeros,
+    the same format SAM2 produces with `output_mode="uncompressed_rle"`.
+    """
+    h, w = mask.shape
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    change_indices = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], change_indices, [h * w]))).tolist()
+    if flat.size and flat[0]:
+        counts = [0] + counts
+    return {"size": [h, w], "counts": counts}
+
+
+def encode_rle_region(mask: np.ndarray, offset: tuple[int, int], shape: tuple[int, int]) -> dict:
+    """
+    Encodes a mask that covers only a region of a larger image as the uncompressed RLE of the full image,
+    without allocating the full (H, W) mask.
+
+    Args:
+        mask (np.ndarray): Boolean (h, w) mask of the region.
+        offset (tuple): (row, col) of the region's top-left pixel in the full image.
+        shape (tuple): (H, W) of the full image.
+    """
+    height, width = shape
+    row0, col0 = offset
+    # Start/end rows of the runs of every column (column-major order, like the flattened image)
+    padded = np.zeros((mask.shape[1], mask.shape[0] + 2), dtype=np.int8)
+    padded[:, 1:-1] = np.asarray(mask, dtype=bool).T
+    edges = np.diff(padded, axis=1)
+    start_cols, start_rows = np.nonzero(edges == 1)
+    end_cols, end_rows = np.nonzero(edges == -1)
+    starts = (col0 + start_cols) * height + row0 + start_rows
+    ends = (col0 + end_cols) * height + row0 + end_rows
+
+    if starts.size == 0:
+        return {"size": [height, width], "counts": [height * width]}
+
+    # A run reaching the bottom of a full-height column continues at the top of the next one
+    separate = ends[:-1] != starts[1:]
+    starts = np.concatenate((starts[:1], starts[1:][separate]))
+    ends = np.concatenate((ends[:-1][separate], ends[-1:]))
+
+    zeros = starts - np.concatenate(([0], ends[:-1]))
+    counts = np.stack((zeros, ends - starts), axis=1).ravel().tolist()
+    if ends[-1] < height * width:
+        counts.append(height * width - int(ends[-1]))
+    return {"size": [height, width], "counts": counts}
+
+
+def counts_to_string(counts: list[int]) -> str:
+    """Compresses RLE counts to the COCO string format (readable by pycocotools)."""
+    chars = []
+    for i, x in enumerate(counts):
+        # Counts after the second are stored as differences to the count two positions back
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def string_to_counts(string: Union[str, bytes]) -> list[int]:
+    """Decompresses a COCO RLE string to a list of counts."""
+    if isinstance(string, bytes):
+        string = string.decode("ascii")
+    counts: list[int] = []
+    p = 0
+    while p < len(string):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(string[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def decode_rle(rle: dict) -> np.ndarray:
+    """Decodes an uncompressed or COCO-compressed RLE to a boolean (H, W) mask."""
+    h, w = rle["size"]
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = string_to_counts(counts)
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, counts)
+    return np.ascontiguousarray(flat.reshape(w, h).T)
+
+
+def get_mask(ann: dict) -> np.ndarray:
+    """Returns the boolean mask of an annotation, decoding it only if it is stored as RLE."""
+    segmentation = ann["segmentation"]
+    if isinstance(segmentation, np.ndarray):
+        return segmentation
+    return decode_rle(segmentation)
+
+
+def mask_shape(ann: dict) -> tuple[int, int]:
+    """(H, W) of an annotation mask without decoding it."""
+    segmentation = ann["segmentation"]
+    if isinstance(segmentation, np.ndarray):
+        return segmentation.shape # type: ignore
+    h, w = segmentation["size"]
+    return h, w
+
+
+def compact_annotations(anns: list[dict]) -> list[dict]:
+    """Returns copies of the annotations with every binary mask replaced by its RLE."""
+    return [{**ann, "segmentation": encode_rle(ann["segmentation"])} if isinstance(ann["segmentation"], np.ndarray) else ann
+            for ann in anns]
+
+
+def export_annotations(anns: list[dict], save_path: Path, image_name: str):
+    """
+    Writes a per-image annotation file (JSON) with COCO-compressed RLE masks, areas, bboxes (XYWH),
+    predicted_iou, stability_score, point_coords and crop_box.
+
+    Args:
+        anns (list): List of annotation dicts from SAM (binary masks or RLE).
+        save_path (Path): Output JSON file.
+        image_name (str): Name of the source image.
+    """
+    annotations = []
+    height, width = mask_shape(anns[0]) if anns else (None, None)
+
+    for i, ann in enumerate(anns):
+        segmentation = ann["segmentation"]
+        rle = encode_rle(segmentation) if isinstance(segmentation, np.ndarray) else segmentation
+        counts = rle["counts"]
+        if not isinstance(counts, str):
+            counts = counts.decode("ascii") if isinstance(counts, bytes) else counts_to_string(counts)
+
+        record = {"id": i, "segmentation": {"size": list(rle["size"]), "counts": counts}}
+        record.update({key: ann[key] for key in EXPORT_KEYS if key in ann})
+        annotations.append(record)
+
+    with open(save_path, "w") as f:
+        json.dump({"image": image_name, "height": height, "width": width, "annotations": annotations}, f)
+
+
+def load_annotations(load_path: Path) -> list[dict]:
+    """Reads an annotation file written by `export_annotations`. Masks stay compressed until `get_mask`."""
+    with open(load_path) as f:
+        return json.load(f)["annotations"]
+
+
+def label_image(sorted_anns: list[dict], shape: tuple[int, int]) -> np.ndarray:
+    """
+    Paints the masks into one int32 label image: pixel value i+1 for the i-th annotation, 0 for background.
+    Later annotations are drawn over earlier ones (last writer wins).
+    """
+    labels = np.zeros(shape, dtype=np.int32)
+    for i, ann in enumerate(sorted_anns):
+        labels[get_mask(ann)] = i + 1
+    return labels
+
+
+def label_boundaries(labels: np.ndarray) -> np.ndarray:
+    """Boolean map of labelled pixels that touch a different label (or the image edge) in 4-connectivity."""
+    padded = np.pad(labels, 1, mode="constant", constant_values=0)
+    center = padded[1:-1, 1:-1]
+    boundary = ((center != padded[:-2, 1:-1]) | (center != padded[2:, 1:-1])
+                | (center != padded[1:-1, :-2]) | (center != padded[1:-1, 2:]))
+    return boundary & (labels > 0)
+
+
+def render_mask_layer(sorted_anns: list[dict], shape: tuple[int, int], borders=False, cmap_name="tab20", alpha=0.35, border_color=(1.0, 1.0, 1.0)) -> np.ndarray:
+    """
+    Builds the RGBA (uint8) overlay of the masks with a single palette lookup on the label image.
+
+    Args:
+        sorted_anns (list): Annotations in drawing order (the last one is on top).
+        shape (tuple): (H, W) of the masks.
+        borders (bool): Whether to outline every visible mask region (one label-boundary pass).
+        cmap_name (str): Matplotlib colormap name.
+        alpha (float): Transparency of the mask fill (0.0 to 1.0).
+        border_color (tuple): RGB tuple for borders (0.0 to 1.0).
+
+    Returns:
+        np.ndarray: (H, W, 4) uint8 overlay, transparent where there is no mask.
+    """
+    labels = label_image(sorted_anns, shape)
+
+    # Palette: row 0 is transparent, row i+1 is the colormap color of annotation i
+    cmap = plt.get_cmap(cmap_name)
+    colors = np.zeros((len(sorted_anns) + 1, 4), dtype=np.float32)
+    colors[1:] = cmap(np.arange(len(sorted_anns)) % cmap.N)
+    colors[1:, 3] = alpha
+    # Same float32 -> uint8 truncation as scaling a float32 layer
+    palette = (colors * np.float32(255)).astype(np.uint8)
+
+    layer = palette[labels]
+
+    if borders:
+        border_alpha = min(1.0, alpha + 0.4)
+        border_rgba = np.array([*border_color[:3], border_alpha], dtype=np.float32)
+        layer[label_boundaries(labels)] = (border_rgba * np.float32(255)).astype(np.uint8)
+
+    return layer
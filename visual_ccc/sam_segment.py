@@ -2,19 +2,16 @@ import numpy as np
 import torch
 import matplotlib.pyplot as plt
 from PIL import Image
-import cv2
-from hydra import initialize_config_dir
-from hydra.core.global_hydra import GlobalHydra
-from sam2.build_sam import build_sam2
-from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+from typing import Optional, TYPE_CHECKING
 
 from visual_ccc.paths import PM
+from visual_ccc.sam_cache import SAMEmbeddingCache
+from visual_ccc.sam_masks import mask_shape, render_mask_layer
 
-##############################
-# reset Hydra instance
-GlobalHydra.instance().clear()
-initialize_config_dir(config_dir=str(PM.resources), version_base='1.2')
+if TYPE_CHECKING:
+    from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
 
+##############################
 # config file name
 CONFIG_NAME = 'sam2_1_hiera_l.yaml'
 
@@ -59,11 +56,31 @@ def get_device():
     return device, dtype
 
 
+# Hydra config search path (done on first use instead of at import time)
+_hydra_ready = False
+
+def init_hydra():
+    """Points Hydra at the resources directory holding the SAM2 configs. Safe to call repeatedly."""
+    global _hydra_ready
+    if _hydra_ready:
+        return
+    from hydra import initialize_config_dir
+    from hydra.core.global_hydra import GlobalHydra
+    
+    # reset Hydra instance
+    GlobalHydra.instance().clear()
+    initialize_config_dir(config_dir=str(PM.resources), version_base='1.2')
+    _hydra_ready = True
+
+
 # build sam model
 def build_sam_model(device):
     """  
     Returns a built Sam2 model instance
     """
+    from sam2.build_sam import build_sam2
+    
+    init_hydra()
     postprocessing = (device.type == 'cuda')
     
     sam_model = build_sam2(config_file=CONFIG_NAME, 
@@ -75,13 +92,21 @@ def build_sam_model(device):
     return sam_model
 
 
-def get_generator(sam_model):
-    """ Returns a SAM2 mask generator instance."""
+def get_generator(sam_model, cache: Optional[SAMEmbeddingCache]=None, compact_masks: bool=False):
+    """ 
+    Returns a SAM2 mask generator instance. Image embeddings are reused from `cache` if given.
+    With `compact_masks`, annotation masks are returned as uncompressed RLE instead of full boolean arrays.
+    """
+    from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+    
     # mask generator
     mask_generator = SAM2AutomaticMaskGenerator(
         model=sam_model,
+        output_mode="uncompressed_rle" if compact_masks else "binary_mask",
         **MASK_GENERATOR_PARAMS
     )
+    if cache is not None:
+        cache.attach(mask_generator.predictor)
     return mask_generator
 
 
@@ -94,7 +119,7 @@ def transform_image(img: Image.Image):
 
 
 # Long process
-def generate_mask(mask_generator: SAM2AutomaticMaskGenerator, image: np.ndarray, device, dtype):
+def generate_mask(mask_generator: "SAM2AutomaticMaskGenerator", image: np.ndarray, device, dtype):
     """Long process to generate masks"""
     # Disable autocast on CPU to avoid warnings
     enable_autocast = (device.type != 'cpu')
@@ -142,38 +167,16 @@ def render_segmentation(anns: list[dict], original_image_array: np.ndarray, bord
         if 'segmentation' not in sorted_anns[0]:
             final_pil = base_pil
         else:
-            h, w = sorted_anns[0]['segmentation'].shape
+            h, w = mask_shape(sorted_anns[0])
             
             # Check dimensions match
             if base_pil.size != (w, h):
                  raise ValueError(f"Image shape {base_pil.size} does not match mask shape {(w, h)}")
 
-            # 2. Generate Mask Layer (using your existing logic)
-            mask_layer = np.zeros((h, w, 4), dtype=np.float32)
-            cmap = plt.get_cmap(cmap_name)
-            num_colors = cmap.N
-
-            for i, ann in enumerate(sorted_anns):
-                m = ann['segmentation']
-                color = list(cmap(i % num_colors)) 
-                color[3] = alpha 
-                mask_layer[m] = color 
-                
-                if borders:
-                    contours, _ = cv2.findContours(m.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                    if contours:
-                        # Simplify contours for speed/smoothness
-                        contours = [
-                            cv2.approxPolyDP(contour, epsilon=0.001 * cv2.arcLength(contour, True), closed=True) 
-                            for contour in contours
-                        ]
-                        border_alpha = min(1.0, alpha + 0.4)
-                        b_r, b_g, b_b = border_color[:3]
-                        final_border_color = (b_r, b_g, b_b, border_alpha)
-                        cv2.drawContours(mask_layer, contours, -1, final_border_color, thickness=1) 
+            # 2. Generate Mask Layer (int32 label image + uint8 palette lookup)
+            mask_uint8 = render_mask_layer(sorted_anns, (h, w), borders=borders, cmap_name=cmap_name, alpha=alpha, border_color=border_color)
 
             # 3. Composite using Pillow
-            mask_uint8 = (mask_layer * 255).astype(np.uint8)
             mask_pil = Image.fromarray(mask_uint8, mode="RGBA")
             final_pil = Image.alpha_composite(base_pil, mask_pil)
 
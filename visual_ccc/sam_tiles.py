@@ -0,0 +1,173 @@
+import numpy as np
+
+from visual_ccc.sam_masks import encode_rle_region, get_mask
+
+
+# Settings
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+MERGE_IOU_THRESH = 0.5
+
+
+def tile_boxes(height: int, width: int, tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> list[tuple[int, int, int, int]]:
+    """
+    Covers an image with overlapping tiles. The last row/column of tiles is aligned to the image border.
+
+    Returns:
+        list: (row0, col0, row1, col1) boxes, end-exclusive.
+    """
+    if overlap >= tile_size:
+        raise ValueError("overlap must be smaller than tile_size")
+    stride = tile_size - overlap
+
+    def starts(length: int) -> list[int]:
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+    return [(row, col, min(row + tile_size, height), min(col + tile_size, width))
+            for row in starts(height) for col in starts(width)]
+
+
+def _tile_pieces(anns: list[dict], box: tuple[int, int, int, int], tile_index: int) -> list[dict]:
+    """Crops every tile mask to its bounding box and places it in image coordinates."""
+    pieces = []
+    for ann in anns:
+        mask = get_mask(ann)
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if rows.size == 0:
+            continue
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        pieces.append({"mask": mask[r0:r1, c0:c1].copy(),
+                       "box": (box[0] + r0, box[1] + c0, box[0] + r1, box[1] + c1),
+                       "tile": tile_index,
+                       "ann": ann})
+    return pieces
+
+
+def _intersect(a: tuple, b: tuple):
+    """Intersection of two (row0, col0, row1, col1) boxes, or None."""
+    box = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+def _window(piece: dict, box: tuple) -> np.ndarray:
+    """The mask of a piece inside `box`, as a boolean array of the box shape."""
+    window = np.zeros((box[2] - box[0], box[3] - box[1]), dtype=bool)
+    overlap = _intersect(piece["box"], box)
+    if overlap is not None:
+        p0, p1 = piece["box"][0], piece["box"][1]
+        window[overlap[0] - box[0] : overlap[2] - box[0], overlap[1] - box[1] : overlap[3] - box[1]] = \
+            piece["mask"][overlap[0] - p0 : overlap[2] - p0, overlap[1] - p1 : overlap[3] - p1]
+    return window
+
+
+def _find(parents: list[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def merge_tile_masks(pieces: list[dict], tiles: list[tuple], shape: tuple[int, int], iou_thresh: float = MERGE_IOU_THRESH) -> list[dict]:
+    """
+    Merges the masks of overlapping tiles into image-level annotations.
+
+    Two masks from different tiles are the same object if their IoU measured inside the overlap of the two
+    tiles exceeds `iou_thresh`: this joins objects cut by a seam (both halves agree in the shared strip) and
+    removes duplicates found by both tiles. Joined masks are unioned; scores and prompt point come from the
+    highest-scoring member.
+
+    Returns:
+        list: SAM-style annotations with uncompressed RLE segmentations of the full image.
+    """
+    parents = list(range(len(pieces)))
+    by_tile: dict[int, list[int]] = dict()
+    for i, piece in enumerate(pieces):
+        by_tile.setdefault(piece["tile"], []).append(i)
+
+    for a in range(len(tiles)):
+        for b in range(a + 1, len(tiles)):
+            zone = _intersect(tiles[a], tiles[b])
+            if zone is None:
+                continue
+            in_a = [i for i in by_tile.get(a, []) if _intersect(pieces[i]["box"], zone)]
+            in_b = [j for j in by_tile.get(b, []) if _intersect(pieces[j]["box"], zone)]
+            for i in in_a:
+                for j in in_b:
+                    if _intersect(pieces[i]["box"], pieces[j]["box"]) is None:
+                        continue
+                    # Compare the two masks only inside the overlap of their tiles
+                    hull = (min(pieces[i]["box"][0], pieces[j]["box"][0]), min(pieces[i]["box"][1], pieces[j]["box"][1]),
+                            max(pieces[i]["box"][2], pieces[j]["box"][2]), max(pieces[i]["box"][3], pieces[j]["box"][3]))
+                    box = _intersect(hull, zone)
+                    if box is None:
+                        continue
+                    window_i, window_j = _window(pieces[i], box), _window(pieces[j], box)
+                    union = np.count_nonzero(window_i | window_j)
+                    if union and np.count_nonzero(window_i & window_j) / union > iou_thresh:
+                        parents[_find(parents, i)] = _find(parents, j)
+
+    groups: dict[int, list[int]] = dict()
+    for i in range(len(pieces)):
+        groups.setdefault(_find(parents, i), []).append(i)
+
+    merged = []
+    for members in groups.values():
+        box = (min(pieces[i]["box"][0] for i in members), min(pieces[i]["box"][1] for i in members),
+               max(pieces[i]["box"][2] for i in members), max(pieces[i]["box"][3] for i in members))
+        if len(members) == 1:
+            mask = pieces[members[0]]["mask"]
+        else:
+            mask = np.zeros((box[2] - box[0], box[3] - box[1]), dtype=bool)
+            for i in members:
+                mask |= _window(pieces[i], box)
+
+        best = max(members, key=lambda i: pieces[i]["ann"].get("predicted_iou", 0.0))
+        best_ann = pieces[best]["ann"]
+        tile = tiles[pieces[best]["tile"]]
+        ann = {"segmentation": encode_rle_region(mask, (box[0], box[1]), shape),
+               "area": int(np.count_nonzero(mask)),
+               # XYWH with inclusive max corner, as SAM reports bboxes
+               "bbox": [int(box[1]), int(box[0]), int(box[3] - 1 - box[1]), int(box[2] - 1 - box[0])],
+               "predicted_iou": max(pieces[i]["ann"].get("predicted_iou", 0.0) for i in members),
+               "stability_score": max(pieces[i]["ann"].get("stability_score", 0.0) for i in members)}
+        if "point_coords" in best_ann:
+            ann["point_coords"] = [[x + tile[1], y + tile[0]] for x, y in best_ann["point_coords"]]
+        if "crop_box" in best_ann:
+            x, y, w, h = best_ann["crop_box"]
+            ann["crop_box"] = [x + tile[1], y + tile[0], w, h]
+        merged.append(ann)
+
+    return merged
+
+
+def generate_tiled(mask_generator, image: np.ndarray, tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP,
+                   iou_thresh: float = MERGE_IOU_THRESH) -> list[dict]:
+    """
+    Runs the SAM2 automatic mask generator on overlapping tiles of a large image and merges the results.
+
+    Each tile is segmented at SAM's native resolution, so small structures are kept, and only one tile's
+    full-size masks are held at a time (the rest are cropped to their bounding boxes).
+
+    Args:
+        mask_generator (SAM2AutomaticMaskGenerator): Generator (any output mode).
+        image (np.ndarray): RGB image (H, W, 3).
+        tile_size (int): Side of the square tiles in pixels.
+        overlap (int): Overlap between neighbouring tiles in pixels. Should exceed the size of the objects
+            that must be joined across seams.
+        iou_thresh (float): Overlap-zone IoU above which masks of neighbouring tiles are merged.
+
+    Returns:
+        list: Annotations with uncompressed RLE masks of the full image.
+    """
+    height, width = image.shape[:2]
+    tiles = tile_boxes(height, width, tile_size, overlap)
+
+    pieces = []
+    for tile_index, (r0, c0, r1, c1) in enumerate(tiles):
+        tile_anns = mask_generator.generate(np.ascontiguousarray(image[r0:r1, c0:c1]))
+        pieces.extend(_tile_pieces(tile_anns, (r0, c0, r1, c1), tile_index))
+
+    return merge_tile_masks(pieces, tiles, (height, width), iou_thresh=iou_thresh)
@@ -0,0 +1,310 @@
+import argparse
+import csv
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Literal, Optional
+
+import cv2
+import numpy
+import torch
+
+from visual_ccc import gradcam, image_a
+from visual_ccc.clustering import ClusteringEngine
+from visual_ccc.image_source import ImageSource, open_image
+
+
+# Settings
+N_CLUSTERS = 3
+CHANGE_THRESHOLD = 0.01       # mean absolute thumbnail difference (0-1) below which a frame reuses the previous results
+WARM_START_THRESHOLD = 0.05   # below this difference, SAM reuses the image embedding of the previous key frame
+THUMBNAIL_SIZE = 64
+CHUNK_FRAMES = 32             # key frames classified per batch
+METRICS_FILE = "stack_metrics.csv"
+DEFAULT_OUTPUT_DIR = "visual_ccc_results"
+
+
+# Small grayscale thumbnail in [0, 1] used to compare frames
+def frame_signature(source: ImageSource) -> numpy.ndarray:
+    gray = cv2.cvtColor(source.rgb(), cv2.COLOR_RGB2GRAY)
+    thumbnail = cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    return thumbnail.astype(numpy.float32) / 255
+
+
+# Mean absolute difference between two frame signatures
+def frame_change(signature: numpy.ndarray, reference: Optional[numpy.ndarray]) -> float:
+    if reference is None:
+        return 1.0
+    return float(numpy.abs(signature - reference).mean())
+
+
+class SharedClusterModel:
+    """
+    KMeans model fitted once, on the first frame of a stack, and applied to every following frame.
+
+    The standardization (mean, std) of the first frame is kept as well, so a cluster covers the same
+    intensity range in every frame. Clusters are numbered from darkest to brightest.
+    """
+    def __init__(self, n_clusters: int = N_CLUSTERS):
+        self.n_clusters = n_clusters
+        self.model = None
+        self.mean = 0.0
+        self.std = 1.0
+        self._rank: Optional[numpy.ndarray] = None
+
+    def fit(self, gray: numpy.ndarray):
+        self.mean = float(gray.mean())
+        self.std = float(gray.std()) or 1.0
+        engine = ClusteringEngine(self._standardize(gray))
+        self.model = engine.fit(self.n_clusters)
+        order = numpy.argsort(self.model.cluster_centers_[:, 0])
+        self._rank = numpy.empty(self.n_clusters, dtype=numpy.int32)
+        self._rank[order] = numpy.arange(self.n_clusters, dtype=numpy.int32)
+
+    def _standardize(self, gray: numpy.ndarray) -> numpy.ndarray:
+        return ((gray.reshape(-1, 1).astype(numpy.float32) - self.mean) / self.std).astype(numpy.float32)
+
+    def percentages(self, gray: numpy.ndarray) -> list[float]:
+        """Area percentage of every cluster in a frame (fits the model on the first call)."""
+        if self.model is None:
+            self.fit(gray)
+        labels = self._rank[self.model.predict(self._standardize(gray))] # type: ignore
+        counts = numpy.bincount(labels, minlength=self.n_clusters)
+        return [round(100 * int(count) / labels.size, 2) for count in counts]
+
+
+class EmbeddingWarmStart:
+    """
+    Reuses the SAM2 image embeddings of the previous key frame for frames that changed little.
+
+    Wraps `predictor.set_image` (a SAM2ImagePredictor, e.g. `mask_generator.predictor`) for the lifetime of
+    the context (or until `close()`, which puts the previous `set_image` back, including other wrappers such
+    as `sam_cache`). Call `begin_frame(reuse)` before generating the masks of a frame: with `reuse=True`,
+    every crop whose shape matches the previous frame gets the stored features and skips the image encoder;
+    otherwise the features are computed and stored for the next frame.
+    """
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.reused = 0
+        self._compute = predictor.set_image
+        # Instance attribute replaced by this wrapper (None: the class method was used)
+        self._previous = vars(predictor).get("set_image")
+        self._features: list = []
+        self._call = 0
+        self._reuse = False
+        predictor.set_image = self._set_image
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Restores the previous `set_image` of the predictor and drops the stored features."""
+        if vars(self.predictor).get("set_image") == self._set_image:
+            if self._previous is None:
+                del self.predictor.set_image
+            else:
+                self.predictor.set_image = self._previous
+        self._features = []
+        self._reuse = False
+
+    def begin_frame(self, reuse: bool):
+        self._call = 0
+        self._reuse = reuse
+
+    def _set_image(self, image):
+        index = self._call
+        self._call += 1
+        if self._reuse and index < len(self._features) and self._features[index][0] == image.shape[:2]:
+            self.predictor.reset_predictor()
+            self.predictor._orig_hw = [image.shape[:2]]
+            self.predictor._features = self._features[index][1]
+            self.predictor._is_image_set = True
+            self.reused += 1
+            return
+
+        self._compute(image)
+        if index == 0:
+            self._features = []
+        self._features = self._features[:index] + [(image.shape[:2], self.predictor._features)]
+
+
+# Texture and clustering metrics of one frame (analysed at `output_size` like the GUI, None: native resolution)
+def frame_texture_metrics(source: ImageSource, clusters: SharedClusterModel, output_size: Optional[int]) -> dict:
+    gray, segmented, contrast = image_a.image_analysis(source.bgr(), output_size=output_size)
+    metrics = {"foreground_pct": round(100 * float(numpy.count_nonzero(segmented)) / segmented.size, 2),
+               "mean_contrast": round(float(contrast.mean()), 6)}
+    for i, percentage in enumerate(clusters.percentages(gray)):
+        metrics[f"cluster_{i}_pct"] = percentage
+    return metrics
+
+
+# SAM mask count and mean mask area of one frame
+def frame_sam_metrics(source: ImageSource, mask_generator, warm_start: EmbeddingWarmStart, reuse: bool, device, dtype) -> dict:
+    from visual_ccc import sam_segment
+
+    warm_start.begin_frame(reuse)
+    anns = sam_segment.generate_mask(mask_generator, source.rgb(), device, dtype)
+    n_pixels = source.rgb().shape[0] * source.rgb().shape[1]
+    mean_area = float(numpy.mean([ann["area"] for ann in anns])) if anns else 0.0
+    return {"n_masks": len(anns), "mean_mask_area_pct": round(100 * mean_area / n_pixels, 4)}
+
+
+def run_stack(stack_path: Path,
+              output_dir: Optional[Path] = None,
+              classes: Literal["2-class", "3-class"] = "3-class",
+              model_type: Literal["alexnet", "visualcnn"] = "alexnet",
+              n_clusters: int = N_CLUSTERS,
+              change_threshold: float = CHANGE_THRESHOLD,
+              output_size: Optional[int] = image_a.OUTPUT_SIZE,
+              sam: bool = False,
+              warm_start_threshold: float = WARM_START_THRESHOLD,
+              device: Optional[str] = None) -> Path:
+    """
+    Streams the frames of a multi-page TIFF (or `.npy` stack) through classification, texture and clustering,
+    and writes one row of metrics per frame to `stack_metrics.csv`.
+
+    Work is reused across frames: the KMeans model is fitted on the first frame only, a frame whose thumbnail
+    differs from the last processed (key) frame by less than `change_threshold` copies its results, and with
+    `sam=True` frames close to the key frame reuse its SAM2 image embedding. Frames are decoded lazily, one
+    chunk at a time.
+
+    Args:
+        stack_path (Path): Multi-page TIFF or `.npy` stack (a single image is a one-frame stack).
+        output_dir (Path | None): Results directory. Defaults to `<stack dir>/visual_ccc_results`.
+        classes (str): "2-class" or "3-class" model.
+        model_type (str): "alexnet" or "visualcnn".
+        n_clusters (int): Clusters of the shared KMeans model.
+        change_threshold (float): Mean absolute thumbnail difference (0-1) under which a frame is a near-duplicate.
+        output_size (int | None): Analysis width for texture and clustering (None: native resolution).
+        sam (bool): Also count SAM2 masks per frame.
+        warm_start_threshold (float): Difference under which SAM reuses the previous key frame embedding.
+        device (str | None): Torch device for the classifier. Defaults to CUDA if available, else CPU.
+
+    Returns:
+        Path: The metrics table.
+    """
+    stack_path = Path(stack_path)
+    source = open_image(stack_path)
+    if source is None:
+        raise IOError(f"'{stack_path}' is not a readable image stack.")
+    output_dir = Path(output_dir) if output_dir is not None else stack_path.parent / DEFAULT_OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+    metrics_path = output_dir / f"{stack_path.stem}_{METRICS_FILE}"
+    n_frames = source.n_frames
+    print(f"Found {n_frames} frames in '{stack_path.name}'.")
+
+    # classifier
+    torch_device = torch.device(device) if device else torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model, class_map = gradcam.create_model(classes=classes, model_type=model_type)
+    model.to(torch_device)
+    model.eval()
+    if class_map is None or not isinstance(class_map, dict):
+        class_map = {str(i): i for i in range(3 if classes == "3-class" else 2)}
+    transform_model, _ = gradcam.get_transforms()
+
+    # SAM2 (optional)
+    mask_generator, sam_device, sam_dtype = None, None, None
+    if sam:
+        from visual_ccc import registry
+        mask_generator, sam_device, sam_dtype = registry.get_sam()
+
+    clusters = SharedClusterModel(n_clusters)
+    fields = ["frame", "status", "reused_from", "change", "prediction", "foreground_pct", "mean_contrast",
+              *[f"cluster_{i}_pct" for i in range(n_clusters)], *(["n_masks", "mean_mask_area_pct"] if sam else [])]
+
+    key_signature, key_row = None, None
+    # Frame whose SAM embedding is stored (warm starts compare against it, not against the last key frame, to avoid drift)
+    embedding_signature = None
+    n_key_frames = 0
+    start_time = time.perf_counter()
+
+    # The warm start wraps the shared SAM predictor only while this stack is processed
+    with (EmbeddingWarmStart(mask_generator.predictor) if mask_generator is not None else nullcontext()) as warm_start, \
+         open(metrics_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        frames = source.frames()
+
+        for chunk_start in range(0, n_frames, CHUNK_FRAMES):
+            rows, inputs, reused = [], [], []
+            for frame in [next(frames) for _ in range(min(CHUNK_FRAMES, n_frames - chunk_start))]:
+                row = {"frame": frame.frame}
+                try:
+                    signature = frame_signature(frame)
+                    change = frame_change(signature, key_signature)
+                    row["change"] = round(change, 6)
+
+                    if key_row is not None and change < change_threshold:
+                        # Near-duplicate of the key frame: copy its results
+                        row.update({k: v for k, v in key_row.items() if k not in ("frame", "change")},
+                                   status="reused", reused_from=key_row["frame"])
+                        reused.append((row, key_row))
+                    else:
+                        row.update(status="ok", reused_from="")
+                        row.update(frame_texture_metrics(frame, clusters, output_size))
+                        if mask_generator is not None:
+                            reuse = frame_change(signature, embedding_signature) < warm_start_threshold
+                            if not reuse:
+                                embedding_signature = signature
+                            row.update(frame_sam_metrics(frame, mask_generator, warm_start, reuse, sam_device, sam_dtype)) # type: ignore
+                        inputs.append((len(rows), transform_model(frame.pil())))
+                        key_signature, key_row = signature, row
+                        n_key_frames += 1
+                except Exception as e:
+                    print(f"❌ Error processing frame {frame.frame}: {e}")
+                    row.update(status="error")
+                rows.append(row)
+                # Only the signature of the key frame is kept
+                frame.release()
+
+            # Classify the key frames of the chunk in one batch; reused frames copy the prediction of their key frame
+            if inputs:
+                predictions = gradcam.get_predictions_batch(torch.stack([x for _, x in inputs]), model, class_map, micro_batch_size=CHUNK_FRAMES)
+                for (position, _), prediction in zip(inputs, predictions):
+                    rows[position]["prediction"] = prediction
+            for row, key in reused:
+                row["prediction"] = key.get("prediction", "")
+            writer.writerows(rows)
+            f.flush()
+
+            done = min(chunk_start + CHUNK_FRAMES, n_frames)
+            print(f"    > Processed {done}/{n_frames} frames ({n_key_frames} analysed)...")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\nProcessed {n_frames} frames in {elapsed:.1f} s: {n_key_frames} analysed, {n_frames - n_key_frames} reused.")
+    if warm_start is not None:
+        print(f"SAM embeddings reused for {warm_start.reused} crops.")
+    print(f"Metrics saved to '{metrics_path}'.")
+    return metrics_path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="visual_ccc stack",
+                                     description="Per-frame classification, texture and clustering metrics of a multi-page TIFF or .npy stack.")
+    parser.add_argument("stack", type=Path, help="Multi-page TIFF or .npy stack.")
+    parser.add_argument("-o", "--output-dir", type=Path, default=None, help=f"Results directory (default: <stack dir>/{DEFAULT_OUTPUT_DIR}).")
+    parser.add_argument("--classes", choices=["2-class", "3-class"], default="3-class")
+    parser.add_argument("--model", choices=["alexnet", "visualcnn"], default="alexnet")
+    parser.add_argument("--clusters", type=int, default=N_CLUSTERS, help="Clusters of the shared KMeans model.")
+    parser.add_argument("--change-threshold", type=float, default=CHANGE_THRESHOLD,
+                        help="Frames closer than this to the last analysed frame reuse its results (0 disables).")
+    parser.add_argument("--native", action="store_true", help="Texture and clustering at native resolution.")
+    parser.add_argument("--sam", action="store_true", help="Also count SAM2 masks per frame.")
+    parser.add_argument("--device", default=None, help="Torch device (default: cuda if available, else cpu).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_stack(stack_path=args.stack,
+              output_dir=args.output_dir,
+              classes=args.classes,
+              model_type=args.model,
+              n_clusters=args.clusters,
+              change_threshold=args.change_threshold,
+              output_size=None if args.native else image_a.OUTPUT_SIZE,
+              sam=args.sam,
+              device=args.device)
@@ -0,0 +1,73 @@
+import importlib
+import sys
+import time
+from typing import Optional
+
+
+# Modules needed to show the main window
+STARTUP_MODULES = ["visual_ccc.mygui", "visual_ccc.registry"]
+# Modules deferred until a feature needs them (in the order the features usually load them)
+DEFERRED_MODULES = ["numpy", "PIL.Image", "visual_ccc.image_source", "torch", "torchvision", "matplotlib.pyplot", "visual_ccc.gradcam",
+                    "cv2", "skimage.feature", "sklearn.cluster", "visual_ccc.image_a",
+                    "visual_ccc.stack", "visual_ccc.dense_map", "hydra", "sam2.build_sam", "sam2.automatic_mask_generator", "visual_ccc.sam_segment",
+                    "visual_ccc.sam_classify", "visual_ccc.cam_engine"]
+
+
+# Import a module and return the seconds it took (0 if it was already imported, None if it is not installed)
+def time_import(name: str) -> Optional[float]:
+    if name in sys.modules:
+        return 0.0
+    start = time.perf_counter()
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        return None
+    return time.perf_counter() - start
+
+
+# Print one row per module, returning the updated cumulative time
+def _report(names: list[str], total: float) -> float:
+    for name in names:
+        elapsed = time_import(name)
+        if elapsed is None:
+            print(f"    {name:<40}{'not installed':>14}")
+            continue
+        total += elapsed
+        print(f"    {name:<40}{1000 * elapsed:11.1f} ms{1000 * total:>14.1f} ms")
+    return total
+
+
+def profile_startup(show_window: bool = True):
+    """
+    Reports the import time of every module on the way to the first window, then of the deferred modules
+    and the Hydra init. Times are incremental: dependencies shared with an earlier module count for that one.
+
+    Must run before the GUI modules are imported (e.g. `python -m visual_ccc --profile-startup`).
+    For a full per-module tree, use `python -X importtime -m visual_ccc --profile-startup`.
+    """
+    print(f"    {'module':<40}{'import':>14}{'cumulative':>17}")
+    print("Startup (before the first window):")
+    total = _report(STARTUP_MODULES, 0.0)
+
+    if show_window:
+        start = time.perf_counter()
+        try:
+            from visual_ccc import mygui
+            window = mygui.main_window()
+            window.read(timeout=0)
+        except Exception as e:
+            print(f"    {'main window':<40}{'unavailable':>14}  ({type(e).__name__}: {e})")
+        else:
+            total += time.perf_counter() - start
+            print(f"    {'main window':<40}{1000 * (time.perf_counter() - start):11.1f} ms{1000 * total:>14.1f} ms")
+            window.close()
+    print(f"Time to first window: {total:.2f} s\n")
+
+    print("Deferred (loaded on first use):")
+    total = _report(DEFERRED_MODULES, total)
+    if "visual_ccc.sam_segment" in sys.modules:
+        start = time.perf_counter()
+        sys.modules["visual_ccc.sam_segment"].init_hydra()
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        print(f"    {'Hydra init':<40}{1000 * elapsed:11.1f} ms{1000 * total:>14.1f} ms")
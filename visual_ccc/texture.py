@@ -0,0 +1,228 @@
+import numpy
+
+
+# Settings
+WINDOW_SIZE = 5
+STRIP_ROWS = 128
+
+
+# Sum every (win_rows x win_cols) window of an array using an integral image
+def _box_sum(values, win_rows: int, win_cols: int):
+    """
+    Returns the window sums of `values` for every valid window position.
+
+    The output has shape (rows - win_rows + 1, cols - win_cols + 1), where
+    element [a, b] is the sum of values[a : a+win_rows, b : b+win_cols].
+    """
+    rows, cols = values.shape
+    accumulator = numpy.int64 if values.dtype.kind in "biu" else numpy.float64
+
+    integral = numpy.zeros((rows + 1, cols + 1), dtype=accumulator)
+    numpy.cumsum(values, axis=0, dtype=accumulator, out=integral[1:, 1:])
+    numpy.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+    return (integral[win_rows:, win_cols:] - integral[:-win_rows, win_cols:]
+            - integral[win_rows:, :-win_cols] + integral[:-win_rows, :-win_cols])
+
+
+# Vectorized GLCM contrast map (2 levels, distance 1, angle 0, symmetric, normed)
+def glcm_contrast_map(segmented, window_size: int=WINDOW_SIZE, strip_rows: int=STRIP_ROWS, dtype=numpy.float64):
+    """
+    Computes the sliding-window GLCM contrast of a binary (0/255) image.
+
+    Equivalent to calling `graycomatrix(window // 255, [1], [0], levels=2, symmetric=True, normed=True)`
+    followed by `graycoprops(..., 'contrast')` on every window, including the float rounding of
+    skimage's two normalization steps. The image is processed in strips of `strip_rows` output rows,
+    so the working memory does not grow with the image height. Pixels closer than `window_size // 2`
+    to the border are 0.
+
+    Args:
+        segmented (np.ndarray): 2D uint8 image with values 0 or 255 (Otsu output).
+        window_size (int): Side of the square sliding window (odd).
+        strip_rows (int): Number of output rows computed at a time.
+        dtype: Output dtype (float32 halves the output size of native-resolution maps).
+
+    Returns:
+        np.ndarray: contrast map with the same shape as `segmented`.
+    """
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError(f"window_size must be a positive odd number, got {window_size}")
+    contrast = numpy.zeros(segmented.shape, dtype=dtype)
+    ws_h = window_size // 2
+    rows, cols = segmented.shape
+
+    if rows < window_size or cols < window_size:
+        return contrast
+
+    # Co-occurrence counts per window: a window holds window_size rows of (window_size - 1) pairs
+    n_pairs = window_size * (window_size - 1)
+
+    for start in range(ws_h, rows - ws_h, strip_rows):
+        stop = min(start + strip_rows, rows - ws_h)
+        # Scale to 0-1 (2 levels)
+        levels = (segmented[start - ws_h : stop + ws_h] // 255).astype(numpy.uint8)
+
+        # Horizontal neighbour pairs (distance 1, angle 0)
+        left = levels[:, :-1]
+        right = levels[:, 1:]
+
+        count_01 = _box_sum(left != right, window_size, window_size - 1)
+        count_11 = _box_sum(left & right, window_size, window_size - 1)
+        count_00 = n_pairs - count_01 - count_11
+
+        # Symmetric GLCM entries, normalized twice (graycomatrix normed=True, then graycoprops)
+        glcm = [2 * count_00, count_01, count_01, 2 * count_11]
+        for _ in range(2):
+            glcm_sums = ((glcm[0] + glcm[1]) + glcm[2]) + glcm[3]
+            glcm = [entry / glcm_sums for entry in glcm]
+
+        # Contrast weights (i-j)^2 are 1 off the diagonal and 0 on it
+        contrast[start:stop, ws_h : cols - ws_h] = glcm[1] + glcm[2]
+
+    return contrast
+
+
+# GLCM properties supported by the feature stack (same names as skimage.feature.graycoprops)
+TEXTURE_PROPERTIES = ('contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM')
+
+
+# Quantize a uint8 grayscale image to `levels` gray levels
+def quantize_gray(gray, levels: int):
+    if gray.dtype != numpy.uint8:
+        raise ValueError("gray must be a uint8 image")
+    if not 2 <= levels <= 256:
+        raise ValueError("levels must be between 2 and 256")
+    return (gray.astype(numpy.uint16) * levels // 256).astype(numpy.uint8)
+
+
+# Feature labels in the same order as the channels of glcm_feature_stack
+def texture_feature_names(properties=('contrast',), distances=(1,), angles=(0.0,)):
+    return [f"{prop}_d{distance}_a{round(numpy.degrees(angle))}"
+            for prop in properties for distance in distances for angle in angles]
+
+
+# Pixel offset for a (distance, angle) pair, using the same convention as graycomatrix
+def _glcm_offset(distance: int, angle: float):
+    return int(round(numpy.sin(angle) * distance)), int(round(numpy.cos(angle) * distance))
+
+
+# Compute every requested property for one (distance, angle) offset on a strip of quantized rows
+def _strip_offset_features(block, offset, properties, levels: int, window_size: int):
+    d_row, d_col = offset
+    block_rows, block_cols = block.shape
+
+    # Pair (a, b): anchor pixel and its neighbour at the offset, both inside the block
+    r0, r1 = max(0, -d_row), block_rows - max(0, d_row)
+    c0, c1 = max(0, -d_col), block_cols - max(0, d_col)
+    a = block[r0:r1, c0:c1].astype(numpy.int64)
+    b = block[r0 + d_row : r1 + d_row, c0 + d_col : c1 + d_col].astype(numpy.int64)
+
+    # Pairs whose both pixels fall inside a window
+    win_rows, win_cols = window_size - abs(d_row), window_size - abs(d_col)
+    n_pairs = win_rows * win_cols
+
+    def window_mean(values):
+        return _box_sum(values, win_rows, win_cols) / n_pairs
+
+    diff = a - b
+    results = dict()
+
+    # Symmetric GLCM: sum_ij P_ij * f(i-j) is the window mean of f over the pairs
+    if 'contrast' in properties:
+        results['contrast'] = window_mean(diff * diff)
+    if 'dissimilarity' in properties:
+        results['dissimilarity'] = window_mean(numpy.abs(diff))
+    if 'homogeneity' in properties:
+        results['homogeneity'] = window_mean(1.0 / (1.0 + diff * diff))
+
+    # Correlation from exact integer moments of the symmetric GLCM
+    if 'correlation' in properties:
+        sum_i = _box_sum(a + b, win_rows, win_cols)
+        sum_ii = _box_sum(a * a + b * b, win_rows, win_cols)
+        sum_ij = _box_sum(a * b, win_rows, win_cols)
+        variance = 2 * n_pairs * sum_ii - sum_i * sum_i
+        covariance = 4 * n_pairs * sum_ij - sum_i * sum_i
+        correlation = numpy.ones(variance.shape, dtype=numpy.float64)
+        numpy.divide(covariance, variance, out=correlation, where=variance > 0)
+        results['correlation'] = correlation
+
+    # ASM / energy: sum_ij P_ij^2 needs the squared histogram counts. Instead of one box sum per level pair,
+    # count the sample pairs (s, t) of a window with the same unordered level pair, one displacement t - s at a time.
+    # Off-diagonal counts are split between P_ij and P_ji, so they are weighted 1 against 2 for diagonal ones.
+    if 'ASM' in properties or 'energy' in properties:
+        pair_codes = numpy.minimum(a, b) * levels + numpy.maximum(a, b)
+        pair_weights = numpy.where(a == b, 2, 1)
+        code_rows, code_cols = pair_codes.shape
+
+        # Zero displacement: every sample matches itself
+        squared_counts = _box_sum(pair_weights, win_rows, win_cols)
+        # Displacements (s_row, s_col) and their opposites give the same count, so count one half-plane twice
+        for s_row in range(0, win_rows):
+            for s_col in range(-(win_cols - 1), win_cols):
+                if s_row == 0 and s_col <= 0:
+                    continue
+                u0, u1 = 0, code_rows - s_row
+                v0, v1 = max(0, -s_col), code_cols - max(0, s_col)
+                matches = (pair_codes[u0:u1, v0:v1] == pair_codes[u0 + s_row : u1 + s_row, v0 + s_col : v1 + s_col])
+                squared_counts += 2 * _box_sum(matches * pair_weights[u0:u1, v0:v1], win_rows - s_row, win_cols - abs(s_col))
+
+        asm = squared_counts / (2 * n_pairs * n_pairs)
+        results['ASM'] = asm
+        results['energy'] = numpy.sqrt(asm)
+
+    return results
+
+
+# Multi-property, multi-offset GLCM texture maps in one pass
+def glcm_feature_stack(gray, properties=('contrast',), distances=(1,), angles=(0.0,), levels: int=8,
+                       window_size: int=WINDOW_SIZE, strip_rows: int=STRIP_ROWS):
+    """
+    Computes sliding-window GLCM properties for every (property, distance, angle) combination.
+
+    Each window GLCM is symmetric and normalized, matching `graycomatrix(..., symmetric=True, normed=True)`
+    followed by `graycoprops`. The pair statistics of each offset are shared by all properties, and the image
+    is processed in strips of `strip_rows` output rows to keep memory bounded. Pixels closer than
+    `window_size // 2` to the border are 0.
+
+    Args:
+        gray (np.ndarray): 2D uint8 grayscale image.
+        properties (Sequence[str]): Any of TEXTURE_PROPERTIES.
+        distances (Sequence[int]): Pixel pair distances.
+        angles (Sequence[float]): Pixel pair angles in radians.
+        levels (int): Number of gray levels to quantize the image to (e.g. 8, 16, 32).
+        window_size (int): Side of the square sliding window (odd).
+        strip_rows (int): Number of output rows computed at a time.
+
+    Returns:
+        np.ndarray: float32 array of shape (H, W, F), channels ordered as `texture_feature_names`.
+    """
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError(f"window_size must be a positive odd number, got {window_size}")
+    for prop in properties:
+        if prop not in TEXTURE_PROPERTIES:
+            raise ValueError(f"{prop} is an invalid property. Choose from {TEXTURE_PROPERTIES}")
+
+    offsets = [_glcm_offset(distance, angle) for distance in distances for angle in angles]
+    if any(abs(d_row) >= window_size or abs(d_col) >= window_size for d_row, d_col in offsets):
+        raise ValueError("Every distance must be smaller than window_size")
+
+    quantized = quantize_gray(gray, levels)
+    rows, cols = quantized.shape
+    n_offsets = len(offsets)
+    ws_h = window_size // 2
+
+    stack = numpy.zeros((rows, cols, len(properties) * n_offsets), dtype=numpy.float32)
+    if rows < window_size or cols < window_size:
+        return stack
+
+    for start in range(ws_h, rows - ws_h, strip_rows):
+        stop = min(start + strip_rows, rows - ws_h)
+        block = quantized[start - ws_h : stop + ws_h]
+
+        for o, offset in enumerate(offsets):
+            results = _strip_offset_features(block, offset, properties, levels, window_size)
+            for p, prop in enumerate(properties):
+                # Channel order: property, then distance, then angle
+                stack[start:stop, ws_h : cols - ws_h, p * n_offsets + o] = results[prop]
+
+    return stack
@@ -43,8 +43,9 @@ class VisualCNN(nn.Module):
         out_features = 3 if classes == "3-class" else 1
         self.classifier = nn.Linear(256, out_features)
         
-        # Placeholder for gradients
+        # Placeholders for gradients and forward activations
         self.grads = None
+        self.activations = None
 
     # Hook for gradients
     def activations_hook(self, grad):
@@ -57,6 +58,7 @@ class VisualCNN(nn.Module):
         # Register hook at the last convolutional layer
         if x.requires_grad:
             x.register_hook(self.activations_hook)
+            self.activations = x
             
         # Global Average Pooling and Flatten
         x = self.gap(x)
@@ -73,3 +75,7 @@ class VisualCNN(nn.Module):
     # Method for the activation extraction
     def get_activations(self, x):
         return self.features(x)
+
+    # Method for the activations captured during the last forward pass
+    def get_forward_activations(self):
+        return self.activations